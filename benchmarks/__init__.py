@@ -0,0 +1,3 @@
+"""
+Performance benchmarks, run from the repository root, e.g. `python -m benchmarks.metadata_loading`
+"""
@@ -0,0 +1,73 @@
+"""
+Compares extracting header.stamp and pose.x from the Spatz messages of the test_state_only bag, as done by
+create_thumbnail_spatz. The messages are repeated to the given count (default: one hour at 100 Hz).
+
+- deserialize_loop: deserialize_cdr per message, as create_thumbnail_spatz did before FieldDecoder was introduced
+- field_decoder: FieldDecoder (vectorised)
+
+Usage: python -m benchmarks.cdr_decoding [--messages N] [--repeat N]
+"""
+import argparse
+import itertools
+import timeit
+from pathlib import Path
+
+import numpy as np
+import rosbags.rosbag2 as rb
+from rosbags.serde import deserialize_cdr
+
+from rosbagsApp.bag_storage.cdr import FieldDecoder
+from rosbagsApp.bag_storage.thumbnails import register_spatz_types
+
+MSGTYPE = "spatz_interfaces/msg/Spatz"
+FIELDS = ["header.stamp.sec", "header.stamp.nanosec", "pose.x"]
+
+
+def load_messages(path: Path, count: int) -> list[bytes]:
+    with rb.Reader(path) as reader:
+        connections = [c for c in reader.connections if c.msgtype == MSGTYPE]
+        messages = [bytes(rawdata) for _, _, rawdata in reader.messages(connections)]
+    return list(itertools.islice(itertools.cycle(messages), count))
+
+
+def deserialize_loop(messages: list[bytes]):
+    xs = np.zeros((len(messages),))
+    ys = np.zeros((len(messages),))
+    for i, rawdata in enumerate(messages):
+        msg = deserialize_cdr(rawdata, MSGTYPE)
+        xs[i] = float(msg.header.stamp.sec) + float(msg.header.stamp.nanosec * 1e-9)
+        ys[i] = msg.pose.x
+    return xs, ys
+
+
+def field_decoder(messages: list[bytes]):
+    fields = FieldDecoder(MSGTYPE, FIELDS).decode(messages)
+    return fields["header.stamp.sec"].astype(np.float64) + fields["header.stamp.nanosec"] * 1e-9, fields["pose.x"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=360000, help="Number of messages to decode")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of passes over all messages")
+    parser.add_argument("--bag", type=Path, default=Path("rosbagsApp/testdata/test_state_only"),
+                        help="Bag containing Spatz messages")
+    args = parser.parse_args()
+
+    register_spatz_types()
+    messages = load_messages(args.bag, args.messages)
+    print(f"{len(messages)} messages, {args.repeat} passes")
+
+    expected = deserialize_loop(messages)
+    actual = field_decoder(messages)
+    assert all(np.array_equal(e, a) for e, a in zip(expected, actual)), "Results differ"
+
+    baseline = None
+    for decoder in (deserialize_loop, field_decoder):
+        seconds = timeit.timeit(lambda: decoder(messages), number=args.repeat)
+        per_message = seconds / (args.repeat * len(messages))
+        baseline = baseline or per_message
+        print(f"{decoder.__name__:>16}: {per_message * 1e9:10.1f} ns/message ({baseline / per_message:6.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
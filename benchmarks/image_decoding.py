@@ -0,0 +1,64 @@
+"""
+Compares decoding frames of a JPEG stream (sensor_msgs/msg/CompressedImage) for a thumbnail of the given height:
+
+- full: decoding at full resolution, then downscaling (as before reduced decoding)
+- reduced: compressed_image_to_bgr with min_height (IMREAD_REDUCED_*), then downscaling
+
+Usage: python -m benchmarks.image_decoding [--width N] [--height N] [--thumbnail-height N] [--frames N]
+"""
+import argparse
+import timeit
+
+import cv2
+import numpy as np
+from rosbags.typesys.types import builtin_interfaces__msg__Time as Time, \
+    sensor_msgs__msg__CompressedImage as CompressedImage, std_msgs__msg__Header as Header
+
+from rosbagsApp.bag_storage.images import compressed_image_to_bgr
+
+
+def jpeg_message(width: int, height: int) -> CompressedImage:
+    # Noise over a gradient, not as compressible as a flat image
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 200, width, dtype=np.float32)[np.newaxis, :, np.newaxis]
+    image = (gradient + rng.normal(0, 20, (height, width, 3))).clip(0, 255).astype(np.uint8)
+    success, jpeg = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    assert success
+    return CompressedImage(Header(Time(0, 0), "camera"), format="jpeg", data=jpeg.reshape(-1))
+
+
+def thumbnail(image: np.ndarray, height: int) -> np.ndarray:
+    size = (max(1, round(image.shape[1] * height / image.shape[0])), height)
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def full(msg: CompressedImage, height: int) -> np.ndarray:
+    return thumbnail(cv2.imdecode(msg.data, cv2.IMREAD_COLOR), height)
+
+
+def reduced(msg: CompressedImage, height: int) -> np.ndarray:
+    return thumbnail(compressed_image_to_bgr(msg, min_height=height), height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=3840)
+    parser.add_argument("--height", type=int, default=2160)
+    parser.add_argument("--thumbnail-height", type=int, default=240)
+    parser.add_argument("--frames", type=int, default=20, help="Number of decoded frames per variant")
+    args = parser.parse_args()
+
+    msg = jpeg_message(args.width, args.height)
+    print(f"{args.width}x{args.height} JPEG ({len(msg.data) / 2 ** 20:.1f} MiB) to {args.thumbnail_height} px")
+    difference = np.abs(full(msg, args.thumbnail_height).astype(np.int16) - reduced(msg, args.thumbnail_height))
+    print(f"Mean absolute difference of the thumbnails: {difference.mean():.2f}")
+
+    baseline = None
+    for decoder in (full, reduced):
+        seconds = timeit.timeit(lambda: decoder(msg, args.thumbnail_height), number=args.frames) / args.frames
+        baseline = baseline or seconds
+        print(f"{decoder.__name__:>8}: {seconds * 1e3:8.1f} ms/frame ({baseline / seconds:6.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
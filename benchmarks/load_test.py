@@ -0,0 +1,250 @@
+"""
+Load test comparing a synchronous gunicorn worker (WSGI) with the uvicorn worker of deployment/gunicorn.conf.py (ASGI),
+both with `--workers` processes, serving a synthetic archive (see synthetic_archive) from a temporary database.
+
+- Slow clients download exports of random bags, reading at most `--slow-rate` KiB/s (e.g. over a slow VPN)
+- Fast clients request the bag list API, detail pages and single messages in a loop
+
+Reported are the throughput and latencies of the fast requests (including requests completed only after the slow
+clients disconnected at the end). A synchronous worker serves one request at a time, so fast requests wait while a
+worker streams an export to a slow client.
+
+Usage: python -m benchmarks.load_test [--bags N] [--messages N] [--workers N] [--slow-clients N] [--fast-clients N]
+       [--slow-rate KIB] [--duration SECONDS] [--archive-dir DIR]
+"""
+import argparse
+import http.client
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlencode
+
+import django
+
+from benchmarks.synthetic_archive import ArchiveConfig, generate_archive
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+SERVERS = {
+    "wsgi": ["rosbagBrowser.wsgi:application"],
+    "asgi": ["--config", str(REPO_DIR / "deployment" / "gunicorn.conf.py")],
+}
+SETTINGS_MODULE = "load_test_settings"
+READ_SIZE = 16 * 1024
+
+
+class Client(threading.Thread):
+    """Client thread requesting paths until stopped, with its own connection"""
+
+    def __init__(self, port: int, cookie: str, stop: threading.Event, seed: int):
+        super().__init__(daemon=True)
+        self.port = port
+        self.headers = {"Cookie": cookie}
+        self.stop = stop
+        self.random = random.Random(seed)
+        self.errors = 0
+
+    def connect(self) -> http.client.HTTPConnection:
+        return http.client.HTTPConnection("127.0.0.1", self.port, timeout=120)
+
+
+class FastClient(Client):
+    def __init__(self, *args, paths: list[str]):
+        super().__init__(*args)
+        self.paths = paths
+        self.latencies: list[float] = []
+
+    def run(self):
+        connection = self.connect()
+        while not self.stop.is_set():
+            start = time.perf_counter()
+            try:
+                connection.request("GET", self.random.choice(self.paths), headers=self.headers)
+                response = connection.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                self.errors += 1
+                connection.close()
+                connection = self.connect()
+                continue
+            if response.status != 200:
+                self.errors += 1
+            else:
+                self.latencies.append(time.perf_counter() - start)
+        connection.close()
+
+
+class SlowClient(Client):
+    def __init__(self, *args, paths: list[str], rate: float):
+        super().__init__(*args)
+        self.paths = paths
+        self.rate = rate
+        self.received = 0
+
+    def run(self):
+        while not self.stop.is_set():
+            connection = self.connect()
+            try:
+                connection.connect()
+                # Small receive buffer, the server cannot get rid of the export by filling socket buffers
+                connection.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, READ_SIZE)
+                connection.request("GET", self.random.choice(self.paths), headers=self.headers)
+                response = connection.getresponse()
+                start = time.perf_counter()
+                received = 0
+                # Disconnects in the middle of an export when stopped
+                while not self.stop.is_set() and len(chunk := response.read(READ_SIZE)) > 0:
+                    received += len(chunk)
+                    self.stop.wait(max(0.0, start + received / self.rate - time.perf_counter()))
+                self.received += received
+            except (OSError, http.client.HTTPException):
+                self.errors += 1
+            finally:
+                connection.close()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_ready(port: int, cookie: str, path: str, server: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("Server exited, see its log")
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+        try:
+            connection.request("GET", path, headers={"Cookie": cookie})
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+        finally:
+            connection.close()
+    raise TimeoutError("Server did not start")
+
+
+def run_server(name: str, args, env: dict[str, str], log: Path, cookie: str, fast_paths: list[str],
+               slow_paths: list[str]) -> dict:
+    port = free_port()
+    command = [sys.executable, "-m", "gunicorn", *SERVERS[name], "--workers", str(args.workers), "--bind",
+               f"127.0.0.1:{port}", "--timeout", "300", "--access-logfile", "/dev/null"]
+    with open(log, "w") as log_file:
+        server = subprocess.Popen(command, cwd=REPO_DIR, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    try:
+        # Warm up: catalog scan and caches of all workers
+        wait_until_ready(port, cookie, fast_paths[0], server)
+        for path in fast_paths[:args.workers * 4]:
+            wait_until_ready(port, cookie, path, server)
+
+        stop = threading.Event()
+        slow = [SlowClient(port, cookie, stop, i, paths=slow_paths, rate=args.slow_rate * 1024)
+                for i in range(args.slow_clients)]
+        for client in slow:
+            client.start()
+        # Slow clients occupy the server first
+        time.sleep(1)
+        fast = [FastClient(port, cookie, stop, 1000 + i, paths=fast_paths) for i in range(args.fast_clients)]
+        for client in fast:
+            client.start()
+        time.sleep(args.duration)
+        stop.set()
+        for client in fast + slow:
+            client.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = sorted(latency for client in fast for latency in client.latencies)
+    return {
+        "requests": len(latencies),
+        "throughput": len(latencies) / args.duration,
+        "p50": statistics.median(latencies) if len(latencies) > 0 else float("nan"),
+        "p95": statistics.quantiles(latencies, n=20)[18] if len(latencies) > 1 else float("nan"),
+        "max": latencies[-1] if len(latencies) > 0 else float("nan"),
+        "errors": sum(client.errors for client in fast + slow),
+        "exported": sum(client.received for client in slow),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bags", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=300, help="Messages per topic")
+    parser.add_argument("--image-width", type=int, default=160)
+    parser.add_argument("--image-height", type=int, default=120)
+    parser.add_argument("--workers", type=int, default=1, help="Gunicorn worker processes")
+    parser.add_argument("--io-threads", type=int, default=8, help="ROSBAG_IO_THREADS of the ASGI workers")
+    parser.add_argument("--slow-clients", type=int, default=4)
+    parser.add_argument("--fast-clients", type=int, default=4)
+    parser.add_argument("--slow-rate", type=float, default=256, help="KiB/s read by each slow client")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds of load per server")
+    parser.add_argument("--archive-dir", type=Path, help="Directory for the generated archive (reused if it exists), "
+                                                         "defaults to a temporary directory (deleted afterwards)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="rosbag_load_test_") as tmp:
+        tmp = Path(tmp)
+        archive = (args.archive_dir or tmp / "archive").resolve()
+        config = ArchiveConfig(bags=args.bags, messages=args.messages, image_width=args.image_width,
+                               image_height=args.image_height)
+        print(f"Generating/checking archive of {args.bags} bags in {archive}")
+        rel_paths = generate_archive(archive, config, progress=True)
+
+        (tmp / f"{SETTINGS_MODULE}.py").write_text("\n".join([
+            "from rosbagBrowser.settings import *",
+            "DEBUG = False",
+            "ALLOWED_HOSTS = ['127.0.0.1']",
+            f"DATABASES['default']['NAME'] = {str(tmp / 'db.sqlite3')!r}",
+            f"ROSBAG_STORAGE_PATH = {str(archive)!r}",
+            f"ROSBAG_IO_THREADS = {args.io_threads}",
+        ]) + "\n")
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=SETTINGS_MODULE,
+                   PYTHONPATH=os.pathsep.join([str(tmp), str(REPO_DIR)]))
+        # Required by the settings, not used
+        env.setdefault("GITLAB_KEY", "benchmark")
+        env.setdefault("GITLAB_SECRET", "benchmark")
+        os.environ.update(env)
+        sys.path.insert(0, str(tmp))
+        django.setup()
+        from django.contrib.auth.models import User
+        from django.core.management import call_command
+        from django.test import Client as TestClient
+        from django.urls import reverse
+
+        call_command("migrate", verbosity=0)
+        client = TestClient()
+        client.force_login(User.objects.create_user("benchmark"))
+        cookie = f"sessionid={client.cookies['sessionid'].value}"
+
+        fast_paths = [f"{reverse('rosbags:bags_api')}?limit=50"]
+        slow_paths = []
+        for rel_path in rel_paths:
+            fast_paths.append(reverse("rosbags:detail", args=[rel_path.as_posix()]))
+            fast_paths.append(f"{reverse('rosbags:messages_api')}?"
+                              f"{urlencode({'bag_path': rel_path.as_posix(), 'topic': '/spatz_0', 'index': 0})}")
+            slow_paths.append(f"{reverse('rosbags:export')}?{urlencode({'bag_path': rel_path.as_posix()})}")
+
+        results = {}
+        for name in SERVERS:
+            print(f"Load test of {name} ({args.workers} workers, {args.slow_clients} slow clients at "
+                  f"{args.slow_rate:g} KiB/s, {args.fast_clients} fast clients, {args.duration:g} s)")
+            results[name] = result = run_server(name, args, env, tmp / f"{name}.log", cookie, fast_paths, slow_paths)
+            print(f"{name:>6}: {result['requests']:6d} fast requests ({result['throughput']:8.1f}/s), latency "
+                  f"p50 {result['p50'] * 1e3:8.1f} ms, p95 {result['p95'] * 1e3:8.1f} ms, "
+                  f"max {result['max'] * 1e3:8.1f} ms, {result['exported'] / 2 ** 20:6.1f} MiB exported, "
+                  f"{result['errors']} errors")
+        if results["wsgi"]["requests"] > 0:
+            print(f"Throughput of fast requests: {results['asgi']['throughput'] / results['wsgi']['throughput']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
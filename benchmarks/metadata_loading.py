@@ -0,0 +1,73 @@
+"""
+Compares loading recording metadata (start time, duration, topics) of the testdata bags:
+
+- three_readers: one rosbags Reader per property, as ROSBag did before RecordingInfo was introduced
+- single_reader: RecordingInfo.from_reader
+- metadata_file: RecordingInfo.from_metadata_file
+
+Usage: python -m benchmarks.metadata_loading [--repeat N] [--storage PATH]
+"""
+import argparse
+import datetime
+import os
+import timeit
+from pathlib import Path
+
+import rosbags.rosbag2 as rb
+
+from rosbagsApp.bag_storage.recording_info import RecordingInfo
+
+
+def find_bags(base_path: Path) -> list[Path]:
+    bags = []
+    for dir_path, dir_names, file_names in os.walk(base_path):
+        if "metadata.yaml" in file_names:
+            bags.append(Path(dir_path))
+    return bags
+
+
+def three_readers(path: Path):
+    with rb.Reader(path) as reader:
+        start = datetime.datetime.fromtimestamp(reader.start_time // 1000000000, tz=datetime.timezone.utc)
+    with rb.Reader(path) as reader:
+        duration = datetime.timedelta(microseconds=reader.duration // 1000)
+    with rb.Reader(path) as reader:
+        topics = [(c.topic, c.msgtype, c.msgcount) for c in reader.connections]
+    return start, duration, topics
+
+
+def single_reader(path: Path):
+    return RecordingInfo.from_reader(path)
+
+
+def metadata_file(path: Path):
+    return RecordingInfo.from_metadata_file(path)
+
+
+def readable(path: Path) -> bool:
+    try:
+        RecordingInfo.from_metadata_file(path)
+        return True
+    except rb.ReaderError:
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20, help="Number of passes over all bags")
+    parser.add_argument("--storage", type=Path, default=Path("rosbagsApp/testdata"), help="Directory containing bags")
+    args = parser.parse_args()
+
+    bags = [b for b in find_bags(args.storage) if readable(b)]
+    print(f"{len(bags)} bags, {args.repeat} passes")
+
+    baseline = None
+    for loader in (three_readers, single_reader, metadata_file):
+        seconds = timeit.timeit(lambda: [loader(b) for b in bags], number=args.repeat)
+        per_bag = seconds / (args.repeat * len(bags))
+        baseline = baseline or per_bag
+        print(f"{loader.__name__:>14}: {per_bag * 1e6:10.1f} us/bag ({baseline / per_bag:5.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Compares the throughput of reading a split bag with rosbags.rosbag2.Reader (sequential) and ParallelReader, for each
+compression mode (none, file, message). The bag is generated with `--splits` database files of `--messages` camera
+images each (written with the rosbags writer, then combined into one bag).
+
+- full: Reading all messages in timestamp order
+- seek: Reading the first message after each of `--seeks` random timestamps (as done by sample_frames), the
+  decompressed files of file compressed bags are kept by ParallelReader (DecompressionCache)
+
+The DecompressionCache is cleared before each measurement. Parallel reading only pays off with multiple CPU cores and
+compressed bags, the threads add overhead when reading uncompressed bags.
+
+Usage: python -m benchmarks.parallel_reader [--splits N] [--messages N] [--threads N] [--seeks N] [--output-dir DIR]
+"""
+import argparse
+import random
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+import numpy as np
+import rosbags.rosbag2 as rb
+from rosbags.serde import serialize_cdr
+from rosbags.typesys.types import builtin_interfaces__msg__Time as Time, sensor_msgs__msg__Image as Image, \
+    std_msgs__msg__Header as Header
+from ruamel.yaml import YAML
+
+START_TIME = 1680307200 * 1000000000
+MESSAGE_INTERVAL = 33000000
+COMPRESSION_MODES = {"none": rb.Writer.CompressionMode.NONE, "file": rb.Writer.CompressionMode.FILE,
+                     "message": rb.Writer.CompressionMode.MESSAGE}
+
+
+def image(timestamp: int, rng: np.random.Generator, width: int, height: int) -> bytes:
+    # Gradient with noise, compresses like camera images (unlike uniform noise)
+    row = (np.arange(width, dtype=np.uint16) * 255 // width).astype(np.uint8)
+    data = np.tile(row, height) + rng.integers(0, 8, (width * height,), dtype=np.uint8)
+    msg = Image(Header(Time(timestamp // 1000000000, timestamp % 1000000000), "camera"), height=height, width=width,
+                encoding="mono8", is_bigendian=0, step=width, data=data)
+    return serialize_cdr(msg, Image.__msgtype__)
+
+
+def write_split_bag(path: Path, splits: int, messages: int, compression: str, width: int, height: int):
+    """Bag of `splits` consecutive database files, each written as a separate bag and combined into one"""
+    rng = np.random.default_rng(0)
+    yaml = YAML(typ="safe")
+    path.mkdir(parents=True)
+    infos = []
+    for i in range(splits):
+        split_path = path / f"split_{i}"
+        writer = rb.Writer(split_path)
+        writer.set_compression(COMPRESSION_MODES[compression], rb.Writer.CompressionFormat.ZSTD)
+        with writer:
+            connection = writer.add_connection("/camera/image", Image.__msgtype__)
+            for k in range(messages):
+                timestamp = START_TIME + (i * messages + k) * MESSAGE_INTERVAL
+                writer.write(connection, timestamp, image(timestamp, rng, width, height))
+        infos.append(yaml.load(split_path / "metadata.yaml")["rosbag2_bagfile_information"])
+        for file in infos[-1]["relative_file_paths"]:
+            (split_path / file).rename(path / file)
+        shutil.rmtree(split_path)
+
+    metadata = infos[0]
+    end = max(info["starting_time"]["nanoseconds_since_epoch"] + info["duration"]["nanoseconds"] for info in infos)
+    metadata["relative_file_paths"] = [file for info in infos for file in info["relative_file_paths"]]
+    metadata["files"] = [file for info in infos for file in info["files"]]
+    metadata["duration"]["nanoseconds"] = end - metadata["starting_time"]["nanoseconds_since_epoch"]
+    metadata["message_count"] = sum(info["message_count"] for info in infos)
+    metadata["topics_with_message_count"][0]["message_count"] = metadata["message_count"]
+    yaml.default_flow_style = False
+    yaml.dump({"rosbag2_bagfile_information": metadata}, path / "metadata.yaml")
+
+
+def full(reader) -> int:
+    return sum(len(data) for _, _, data in reader.messages())
+
+
+def seek(reader, timestamps: list[int]) -> int:
+    size = 0
+    for timestamp in timestamps:
+        messages = reader.messages(start=timestamp)
+        try:
+            size += len(next(messages)[2])
+        finally:
+            messages.close()
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--splits", type=int, default=8, help="Database files of the bag")
+    parser.add_argument("--messages", type=int, default=100, help="Images per database file")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--threads", type=int, help="Threads of ParallelReader, defaults to ROSBAG_READER_THREADS")
+    parser.add_argument("--seeks", type=int, default=20, help="Random timestamps read by the seek benchmark")
+    parser.add_argument("--output-dir", type=Path, help="Directory for the generated bags, defaults to a temporary "
+                                                        "directory (deleted afterwards)")
+    args = parser.parse_args()
+
+    # Default settings of the app, imported once configured
+    settings.configure()
+    from rosbagsApp.bag_storage.parallel_reader import DecompressionCache, ParallelReader
+
+    with tempfile.TemporaryDirectory(prefix="rosbag_parallel_reader_", dir=args.output_dir) as tmp:
+        for compression in COMPRESSION_MODES:
+            path = Path(tmp) / compression
+            write_split_bag(path, args.splits, args.messages, compression, args.width, args.height)
+            rng = random.Random(0)
+            end = START_TIME + args.splits * args.messages * MESSAGE_INTERVAL
+            timestamps = [rng.randrange(START_TIME, end) for _ in range(args.seeks)]
+            for benchmark, operation in (("full", full), ("seek", lambda r: seek(r, timestamps))):
+                baseline = None
+                for name, reader in (("sequential", rb.Reader(path)), ("parallel", ParallelReader(path, args.threads))):
+                    DecompressionCache.clear_shared()
+                    with reader:
+                        start = time.perf_counter()
+                        size = operation(reader)
+                        seconds = time.perf_counter() - start
+                    baseline = baseline or seconds
+                    print(f"{compression:>8} {benchmark:>5} {name:>11}: {seconds:8.3f} s "
+                          f"{size / seconds / 1e6:9.1f} MB/s ({baseline / seconds:5.2f}x)")
+    DecompressionCache.clear_shared()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Benchmark suite for the bag archive, measuring at multiple archive sizes (default: 10, 1k and 10k bags, see
+synthetic_archive):
+
+- storage_iteration_cold: Iterating over BagStorage with an empty catalog (first request after start)
+- storage_iteration: Iterating over BagStorage (rescan, catalog up-to-date)
+- find_by_name: Looking up a random bag by name
+- list_view, bags_api, bags_api_search: Bag list page and the first page of the bag list API (unfiltered and searched,
+  payload cache cleared)
+- bags_api_cached, bags_api_not_modified: First page of the bag list API from the payload cache (gzip compressed) and
+  revalidated by ETag
+- detail: Detail page of a random bag
+- generate_thumbnails: Generating thumbnails of one bag (for a sample of bags)
+- thumbnail, thumbnail_not_modified: Serving a thumbnail (unconditional and revalidated by ETag)
+- timeseries: Downsampled values of a Spatz field of a random bag (cache built on first request of each bag)
+
+Views are requested through the Django test client, using a temporary database. Archives are generated on the first
+run and reused afterwards. Results (seconds per operation) are written as json, which can be compared to the results
+of a previous run using --compare.
+
+Usage: python -m benchmarks.suite [--scales N ...] [--archive-dir DIR] [--output FILE] [--compare FILE]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+from pathlib import Path
+from typing import Callable
+from urllib.parse import urlencode
+
+import django
+
+from benchmarks.synthetic_archive import ArchiveConfig, generate_archive
+
+# Results with a median this much slower than in the compared run are reported as regressions
+REGRESSION_THRESHOLD = 1.2
+
+
+def measure(operation: Callable[[], None], repeat: int) -> dict[str, float]:
+    """Execute the operation `repeat` times, :return: statistics of the durations in seconds"""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        operation()
+        durations.append(time.perf_counter() - start)
+    return {"repeat": repeat, "min": min(durations), "median": statistics.median(durations),
+            "mean": statistics.fmean(durations)}
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_scale(archive: Path, rel_paths: list[Path], args) -> dict[str, dict[str, float]]:
+    # Imported once Django is set up
+    from django.contrib.auth import get_user_model
+    from django.test import Client
+    from django.urls import reverse
+
+    import rosbagsApp.settings
+    from rosbagsApp.bag_storage.storage import BagStorage, ROSBag
+    from rosbagsApp.payload_cache import PayloadCache
+
+    rosbagsApp.settings.ROSBAG_STORAGE_PATH = str(archive)
+    rng = random.Random(0)
+    client = Client()
+    client.force_login(get_user_model().objects.get_or_create(username="benchmark")[0])
+
+    def get(url: str, **headers):
+        response = client.get(url, **headers)
+        assert response.status_code in (200, 304), f"{url}: {response.status_code}"
+        if response.streaming:
+            b"".join(response.streaming_content)
+        response.close()
+
+    def get_uncached(url: str):
+        PayloadCache.shared().clear()
+        get(url)
+
+    results = {"storage_iteration_cold": measure(lambda: list(BagStorage()), 1),
+               "storage_iteration": measure(lambda: list(BagStorage()), args.repeat),
+               "find_by_name": measure(lambda: BagStorage().find_by_name(rng.choice(rel_paths).name),
+                                       args.samples),
+               "list_view": measure(lambda: get(reverse("rosbags:list")), args.repeat),
+               "bags_api": measure(lambda: get_uncached(reverse("rosbags:bags_api")), args.repeat),
+               "bags_api_search": measure(lambda: get_uncached(reverse("rosbags:bags_api") + "?q=parking"),
+                                          args.repeat),
+               "detail": measure(lambda: get(reverse("rosbags:detail", args=[str(rng.choice(rel_paths))])),
+                                 args.samples)}
+    results["bags_api_cached"] = measure(lambda: get(reverse("rosbags:bags_api"), HTTP_ACCEPT_ENCODING="gzip"),
+                                         args.repeat)
+    bags_api_etag = client.get(reverse("rosbags:bags_api"))["ETag"]
+    results["bags_api_not_modified"] = measure(
+        lambda: get(reverse("rosbags:bags_api"), HTTP_IF_NONE_MATCH=bags_api_etag), args.repeat)
+
+    thumbnail_bags = iter(rng.sample(rel_paths, min(args.thumbnail_bags, len(rel_paths))))
+    results["generate_thumbnails"] = measure(lambda: ROSBag(archive, next(thumbnail_bags)).generate_thumbnails(),
+                                             min(args.thumbnail_bags, len(rel_paths)))
+
+    thumbnails = [reverse("rosbags:thumbnail", args=[str(bag.rel_path), thumb])
+                  for bag in BagStorage() for thumbs in bag.thumbnails().values() for thumb in thumbs]
+    results["thumbnail"] = measure(lambda: get(rng.choice(thumbnails)), args.samples)
+    etags = {url: client.get(url)["ETag"] for url in thumbnails}
+
+    def revalidate():
+        url = rng.choice(thumbnails)
+        get(url, HTTP_IF_NONE_MATCH=etags[url])
+
+    results["thumbnail_not_modified"] = measure(revalidate, args.samples)
+    results["timeseries"] = measure(lambda: get(reverse("rosbags:timeseries_api") + "?" + urlencode(
+        {"bag_path": str(rng.choice(rel_paths)), "topic": "/spatz_0", "field": "velocity.x", "width": 1000})),
+                                    args.samples)
+    return results
+
+
+def compare(results: dict, previous: dict) -> int:
+    """Print the change of each median compared to a previous run, :return: Number of regressions"""
+    regressions = 0
+    for scale, benchmarks in results.items():
+        for name, result in benchmarks.items():
+            old = previous.get(scale, {}).get(name)
+            if old is None:
+                continue
+            ratio = result["median"] / max(old["median"], 1e-12)
+            regression = ratio > REGRESSION_THRESHOLD
+            regressions += regression
+            print(f"{scale:>6} {name:>24}: {old['median'] * 1e3:10.3f} ms -> {result['median'] * 1e3:10.3f} ms "
+                  f"({ratio:5.2f}x){' REGRESSION' if regression else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=[10, 1000, 10000], help="Numbers of bags")
+    parser.add_argument("--archive-dir", type=Path, default=Path(tempfile.gettempdir()) / "rosbagBrowser-benchmark",
+                        help="Directory for the generated archives (reused by later runs)")
+    parser.add_argument("--messages", type=int, default=20, help="Messages per topic of the generated bags")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions of whole-archive benchmarks")
+    parser.add_argument("--samples", type=int, default=50, help="Repetitions of single-bag benchmarks")
+    parser.add_argument("--thumbnail-bags", type=int, default=5, help="Bags to generate thumbnails for")
+    parser.add_argument("--output", type=Path, default=Path("benchmark_results.json"), help="Results file")
+    parser.add_argument("--compare", type=Path, help="Results of a previous run to compare to")
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "rosbagBrowser.settings")
+    # Required by the settings, not used
+    os.environ.setdefault("GITLAB_KEY", "benchmark")
+    os.environ.setdefault("GITLAB_SECRET", "benchmark")
+    django.setup()
+    from django.test.utils import setup_databases, setup_test_environment, teardown_databases
+    setup_test_environment()
+    databases = setup_databases(verbosity=0, interactive=False)
+
+    config = ArchiveConfig(messages=args.messages)
+    results = {}
+    try:
+        for scale in args.scales:
+            scale_config = ArchiveConfig(**dict(asdict(config), bags=scale))
+            archive = (args.archive_dir / f"bags_{scale}").resolve()
+            print(f"Generating/checking archive of {scale} bags in {archive}")
+            rel_paths = generate_archive(archive, scale_config, progress=True)
+            results[str(scale)] = run_scale(archive, rel_paths, args)
+            for name, result in results[str(scale)].items():
+                print(f"{scale:>6} {name:>24}: {result['median'] * 1e3:10.3f} ms (median of {result['repeat']})")
+    finally:
+        teardown_databases(databases, verbosity=0)
+
+    args.output.write_text(json.dumps({
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "archive": {name: value for name, value in asdict(config).items() if name != "bags"},
+        "results": results,
+    }, indent=2))
+    print(f"Results written to {args.output}")
+
+    if args.compare is not None:
+        regressions = compare(results, json.loads(args.compare.read_text())["results"])
+        if regressions > 0:
+            print(f"{regressions} regressions (slower than {REGRESSION_THRESHOLD}x)")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Generates a synthetic bag archive for benchmarks, written with the rosbags writer.
+
+Bags are distributed over nested subdirectories (`--depth` levels with `--fanout` directories each) and contain
+Spatz topics (`spatz_interfaces/msg/Spatz`), image topics (`sensor_msgs/msg/Image`, bayer encoded) and other topics
+(`std_msgs/msg/Header`), recorded at 10 Hz. Every bag has an additional_metadata.json with a description, tags,
+hardware and location, so the archive can be searched and filtered.
+
+Usage: python -m benchmarks.synthetic_archive OUTPUT [--bags N] [--depth N] [--spatz-topics N] [--image-topics N]
+       [--other-topics N] [--messages N]
+"""
+import argparse
+import json
+import random
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import numpy as np
+import rosbags.rosbag2 as rb
+from rosbags.serde import serialize_cdr
+from rosbags.typesys import types
+from rosbags.typesys.types import builtin_interfaces__msg__Time as Time, geometry_msgs__msg__Point as Point, \
+    sensor_msgs__msg__Image as Image, std_msgs__msg__Header as Header
+
+from rosbagsApp.bag_storage.thumbnails import register_spatz_types
+
+# Description of the archive, stored in the output directory. An existing archive is reused if it matches.
+ARCHIVE_FILE_NAME = "synthetic_archive.json"
+SPATZ_MSGTYPE = "spatz_interfaces/msg/Spatz"
+# Start of the first recording (2023-04-01), recordings are one hour apart
+START_TIME = 1680307200 * 1000000000
+MESSAGE_INTERVAL = 100000000
+
+TAGS = ["parking", "obstacles", "intersection", "night", "rain", "calibration", "crash", "testing"]
+HARDWARE = ["spatz", "mock_robot", "simulation"]
+LOCATIONS = ["lab", "parking_lot", "test_track"]
+
+
+@dataclass(frozen=True)
+class ArchiveConfig:
+    bags: int = 10
+    depth: int = 2  # Number of subdirectory levels above the bags
+    fanout: int = 10  # Subdirectories per level
+    spatz_topics: int = 1
+    image_topics: int = 1
+    other_topics: int = 2
+    messages: int = 50  # Messages per topic
+    image_width: int = 64
+    image_height: int = 48
+    seed: int = 0
+
+
+def bag_rel_path(config: ArchiveConfig, i: int) -> Path:
+    """Path of the i-th bag, relative to the archive"""
+    parts = []
+    remaining = i
+    for _ in range(config.depth):
+        parts.append(f"group_{remaining % config.fanout}")
+        remaining //= config.fanout
+    return Path(*parts, f"bag_{i:06d}")
+
+
+def spatz_message(timestamp: int, i: int):
+    spatz = types.spatz_interfaces__msg__Spatz
+    params = types.spatz_interfaces__msg__SystemParams(*([0.5] * 10))
+    return spatz(header=_header(timestamp, "odom"), pose=Point(x=0.1 * i, y=np.sin(0.1 * i), z=0.01 * i),
+                 velocity=Point(1.0, 0.0, 0.0), acceleration=Point(0.0, 0.0, 0.0), d_psi=0.0, laser_front=1.0,
+                 steer_angle_front=0.0, steer_angle_rear=0.0, light_switch_rear=False, integrated_distance=0.1 * i,
+                 system_params=params)
+
+
+def image_message(config: ArchiveConfig, timestamp: int, rng: np.random.Generator) -> Image:
+    return Image(_header(timestamp, "camera"), height=config.image_height, width=config.image_width,
+                 encoding="bayer_rggb8", is_bigendian=0, step=config.image_width,
+                 data=rng.integers(0, 256, (config.image_height * config.image_width,), dtype=np.uint8))
+
+
+def _header(timestamp: int, frame_id: str) -> Header:
+    return Header(Time(timestamp // 1000000000, timestamp % 1000000000), frame_id)
+
+
+def write_bag(config: ArchiveConfig, path: Path, i: int):
+    rng = np.random.default_rng(config.seed * 1000003 + i)
+    start = START_TIME + i * 3600 * 1000000000
+    with rb.Writer(path) as writer:
+        connections = [(writer.add_connection(f"/spatz_{j}", SPATZ_MSGTYPE), "spatz")
+                       for j in range(config.spatz_topics)]
+        connections += [(writer.add_connection(f"/camera_{j}/image", Image.__msgtype__), "image")
+                        for j in range(config.image_topics)]
+        connections += [(writer.add_connection(f"/topic_{j}", Header.__msgtype__), "other")
+                        for j in range(config.other_topics)]
+        for k in range(config.messages):
+            timestamp = start + k * MESSAGE_INTERVAL
+            for connection, kind in connections:
+                if kind == "spatz":
+                    msg = spatz_message(timestamp, k)
+                elif kind == "image":
+                    msg = image_message(config, timestamp, rng)
+                else:
+                    msg = _header(timestamp, "base_link")
+                writer.write(connection, timestamp, serialize_cdr(msg, connection.msgtype))
+
+    choice = random.Random(config.seed * 1000003 + i)
+    (path / "additional_metadata.json").write_text(json.dumps({
+        "description": f"Synthetic recording {i} on the {choice.choice(LOCATIONS)}",
+        "tags": choice.sample(TAGS, 2),
+        "hardware": choice.choice(HARDWARE),
+        "location": choice.choice(LOCATIONS),
+    }))
+
+
+def generate_archive(path: Path, config: ArchiveConfig, progress: bool = False) -> list[Path]:
+    """
+    Write the archive, unless the directory already contains one with the same configuration
+    :return: Paths of all bags, relative to the archive
+    """
+    rel_paths = [bag_rel_path(config, i) for i in range(config.bags)]
+    archive_file = path / ARCHIVE_FILE_NAME
+    if archive_file.exists() and json.loads(archive_file.read_text()) == asdict(config):
+        return rel_paths
+    if path.exists() and any(path.iterdir()):
+        raise FileExistsError(f"{path} is not empty and does not contain an archive with the same configuration")
+
+    register_spatz_types()
+    for i, rel_path in enumerate(rel_paths):
+        (path / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        write_bag(config, path / rel_path, i)
+        if progress and (i + 1) % 100 == 0:
+            print(f"{i + 1}/{config.bags} bags written")
+    archive_file.write_text(json.dumps(asdict(config)))
+    return rel_paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output", type=Path, help="Empty or not existing directory")
+    defaults = ArchiveConfig()
+    for name, value in asdict(defaults).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=value)
+    args = parser.parse_args()
+
+    config = ArchiveConfig(**{name: getattr(args, name) for name in asdict(defaults)})
+    rel_paths = generate_archive(args.output, config, progress=True)
+    print(f"{len(rel_paths)} bags in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
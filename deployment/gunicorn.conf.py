@@ -0,0 +1,18 @@
+"""
+Gunicorn configuration, deployed to the project directory (see deploy.yml) and loaded by gunicorn.service.
+
+Uvicorn workers serve the ASGI application: a worker handles requests concurrently, blocking work is executed in its
+pool of ROSBAG_IO_THREADS threads, streamed responses are sent from a pool of ROSBAG_STREAM_THREADS threads (see
+rosbagsApp/asgi.py). A slow client downloading an export therefore does not block the worker like a synchronous
+gunicorn worker.
+"""
+wsgi_app = "rosbagBrowser.asgi:application"
+worker_class = "uvicorn.workers.UvicornWorker"
+# Each worker keeps its own caches (bag index, open bags, decompressed files), a few workers suffice since they are
+# not blocked by requests. Metrics are summed over the workers through ROSBAG_METRICS_DIR.
+workers = 2
+# Streamed exports do not delay the heartbeat of a uvicorn worker, the timeout only restarts hanging workers
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+accesslog = "-"
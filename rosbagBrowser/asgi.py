@@ -9,8 +9,12 @@ https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "rosbagBrowser.settings")
+django.setup(set_prefix=False)
 
-application = get_asgi_application()
+# Django's handler with cancellation of disconnected clients and streaming from the I/O thread pool, see rosbagsApp.asgi
+from rosbagsApp.asgi import ASGIHandler  # noqa: E402 (requires settings)
+
+application = ASGIHandler()
@@ -9,6 +9,10 @@ DEBUG = False
 STATIC_ROOT = "/django_static/static"
 ROSBAG_STORAGE_PATH = "/opt/aufnahmen/2023/rosbags"
 ROSBAG_MOUNT_PATH = "/opt/aufnahmen/2023/rosbags"
+ROSBAG_ACCEL_REDIRECT_PREFIX = "/internal/rosbags/"
+ROSBAG_INSTRUMENTATION = True
+# Runtime directory of gunicorn.service, metrics of all workers are reported (and reset when the service restarts)
+ROSBAG_METRICS_DIR = "/run/rosbagBrowser/metrics"
 SECURE_SSL_REDIRECT = True
 SESSION_COOKIE_SECURE = True
 CSRF_COOKIE_SECURE = True
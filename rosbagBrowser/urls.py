@@ -17,9 +17,12 @@ from django.contrib import admin
 from django.urls import include, path
 from django.contrib.auth import views as auth_views
 
+from rosbagsApp import views as rosbags_views
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("rosbags/", include('rosbagsApp.urls')),
+    path("metrics", rosbags_views.metrics, name="metrics"),
     path('', include('landingpage.urls')),
     path('', include('social_django.urls')),
     path('accounts/logout/', auth_views.LogoutView.as_view(), name="logout"),
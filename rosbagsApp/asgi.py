@@ -0,0 +1,191 @@
+"""
+Serving the app with ASGI (uvicorn workers, see deployment/gunicorn.conf.py) without blocking the event loop.
+
+Views are async (see blocking_view), their blocking work (scanning the storage, catalog queries, reading bags,
+rendering templates) is executed by run_blocking in a pool of ROSBAG_IO_THREADS threads per process. A slow NFS scan or
+a long export occupies one thread of the pool instead of the whole worker. Django 4.1 iterates streaming responses in
+the event loop and does not notice disconnected clients, so ASGIHandler additionally
+
+- iterates streaming responses (exports, thumbnails) in a separate pool of ROSBAG_STREAM_THREADS threads. A thread
+  is occupied until the client has received the whole response, so slow downloads must not take the threads of views.
+  If all stream threads are busy, further responses wait before sending their body.
+- cancels the view when the client disconnects and closes a streamed iterator (e.g. stopping an export), blocking
+  work can stop early by calling raise_if_cancelled
+
+With ROSBAG_IO_THREADS = 0 (ROSBAG_STREAM_THREADS = 0), blocking work (streaming) is executed in Django's thread for
+synchronous code instead (like synchronous views), which is required by tests: data of a test transaction is not
+visible to other threads.
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+
+from asgiref.sync import sync_to_async
+from django import db
+from django.core.exceptions import RequestAborted
+from django.core.handlers import asgi
+
+import rosbagsApp.settings
+
+T = TypeVar("T")
+
+# Pool name ("io" or "stream") -> executor
+_executors: dict[str, ThreadPoolExecutor] = {}
+_executor_lock = threading.Lock()
+
+
+class _Connection:
+    """Client connection of a request, watched for disconnects once the request body has been received"""
+
+    def __init__(self, receive):
+        self._receive = receive
+        self._listener: Optional[asyncio.Task] = None
+        # Set when the client disconnected, checked by blocking work in other threads
+        self.cancelled = threading.Event()
+        self.disconnected = asyncio.Event()
+
+    async def receive(self) -> dict:
+        message = await self._receive()
+        if message["type"] == "http.disconnect":
+            self._disconnect()
+        elif not message.get("more_body", False):
+            # The next message is the disconnect
+            self._listener = asyncio.create_task(self._listen())
+        return message
+
+    async def _listen(self):
+        while (await self._receive())["type"] != "http.disconnect":
+            pass
+        self._disconnect()
+
+    def _disconnect(self):
+        self.cancelled.set()
+        self.disconnected.set()
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+
+
+_connection: contextvars.ContextVar[Optional[_Connection]] = contextvars.ContextVar("connection", default=None)
+
+
+def _get_executor(name: str, threads: int) -> ThreadPoolExecutor:
+    with _executor_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = _executors[name] = ThreadPoolExecutor(threads, thread_name_prefix=f"rosbagsApp-{name}")
+        return executor
+
+
+def _run(context: contextvars.Context, func: Callable[..., T], args, kwargs) -> T:
+    try:
+        return context.run(func, *args, **kwargs)
+    finally:
+        # Threads of the pool are not managed by Django, close connections like at the end of a request
+        db.close_old_connections()
+
+
+async def _run_in_pool(name: str, threads: int, func: Callable[..., T], *args, **kwargs) -> T:
+    if threads == 0:
+        return await sync_to_async(func, thread_sensitive=True)(*args, **kwargs)
+    call = functools.partial(_run, contextvars.copy_context(), func, args, kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_get_executor(name, threads), call)
+
+
+async def run_blocking(func: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Execute blocking code in the pool of ROSBAG_IO_THREADS threads (with the context variables of the caller, e.g.
+    instrumentation spans of the request)
+    """
+    return await _run_in_pool("io", rosbagsApp.settings.ROSBAG_IO_THREADS, func, *args, **kwargs)
+
+
+def blocking_view(view):
+    """Async view executing a synchronous view with run_blocking"""
+
+    @functools.wraps(view)
+    async def async_view(request, *args, **kwargs):
+        return await run_blocking(view, request, *args, **kwargs)
+
+    return async_view
+
+
+def raise_if_cancelled():
+    """
+    Stop blocking work of a request whose client disconnected (no-op outside of ASGI requests)
+    :raises RequestAborted: Client disconnected
+    """
+    connection = _connection.get()
+    if connection is not None and connection.cancelled.is_set():
+        raise RequestAborted()
+
+
+class ASGIHandler(asgi.ASGIHandler):
+    """Django's ASGI handler, cancelling requests of disconnected clients and streaming responses from a thread pool"""
+
+    async def handle(self, scope, receive, send):
+        connection = _Connection(receive)
+        token = _connection.set(connection)
+        try:
+            await super().handle(scope, connection.receive, send)
+        except RequestAborted:
+            pass
+        finally:
+            connection.close()
+            _connection.reset(token)
+
+    async def get_response_async(self, request):
+        connection = _connection.get()
+        if connection is None:
+            return await super().get_response_async(request)
+        response = asyncio.ensure_future(super().get_response_async(request))
+        disconnected = asyncio.ensure_future(connection.disconnected.wait())
+        try:
+            await asyncio.wait([response, disconnected], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            disconnected.cancel()
+        if not response.done():
+            # Work already running in the pool continues until it checks raise_if_cancelled
+            response.cancel()
+            raise RequestAborted()
+        return response.result()
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        # Headers as in asgi.ASGIHandler.send_response
+        headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode("ascii")
+            if isinstance(value, str):
+                value = value.encode("latin1")
+            headers.append((bytes(header), bytes(value)))
+        for cookie in response.cookies.values():
+            headers.append((b"Set-Cookie", cookie.output(header="").encode("ascii").strip()))
+        await send({"type": "http.response.start", "status": response.status_code, "headers": headers})
+
+        loop = asyncio.get_running_loop()
+        connection = _connection.get()
+
+        def stream():
+            # Iterated in one thread, iterators may use thread bound resources (e.g. SQLite connections of a reader).
+            # Waiting for each chunk to be sent limits the buffered data.
+            try:
+                for part in response:
+                    if connection is not None and connection.cancelled.is_set():
+                        return
+                    for chunk, _ in self.chunk_bytes(part):
+                        message = {"type": "http.response.body", "body": chunk, "more_body": True}
+                        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+                asyncio.run_coroutine_threadsafe(send({"type": "http.response.body"}), loop).result()
+            finally:
+                # Closes the iterator of the response, e.g. stops an export if the client disconnected
+                response.close()
+
+        await _run_in_pool("stream", rosbagsApp.settings.ROSBAG_STREAM_THREADS, stream)
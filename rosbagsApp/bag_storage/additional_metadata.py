@@ -1,9 +1,16 @@
 import datetime
 import json
+import os
+import threading
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import Iterable
 
 from django.contrib.staticfiles import finders
-from jsonschema.validators import validate
+from jsonschema.exceptions import ValidationError
+from jsonschema.validators import validator_for
+
+from rosbagsApp.instrumentation import cache_lookup, span
 
 additional_metadata_file_name = "additional_metadata.json"
 
@@ -12,6 +19,46 @@ additional_metadata_schema_location = finders.find("rosbagsApp/additional_metada
 with open(additional_metadata_schema_location, 'r') as schema_file:
     additional_metadata_schema = json.load(schema_file)
 
+# Creating a validator is much more expensive than validating a (small) document, so it is only done once
+_validator_class = validator_for(additional_metadata_schema)
+_validator_class.check_schema(additional_metadata_schema)
+additional_metadata_validator = _validator_class(additional_metadata_schema)
+
+# Path -> ((st_ino, st_mtime_ns, st_size), validated json-form), see load_additional_metadata_file
+_parse_cache: dict[Path, tuple[tuple[int, int, int], dict]] = {}
+_parse_cache_lock = threading.Lock()
+
+
+def schema_errors(metadata) -> list[str]:
+    """All violations of the schema (empty for valid metadata)"""
+    return [f"{'/'.join(str(p) for p in error.absolute_path) or '<root>'}: {error.message}"
+            for error in sorted(additional_metadata_validator.iter_errors(metadata), key=lambda e: e.path)]
+
+
+def load_additional_metadata_file(path: Path) -> dict:
+    """
+    Read and validate additional_metadata.json. Files which did not change since they were last loaded (same inode,
+    mtime and size) are neither parsed nor validated again.
+    :return: Json-form of the additional metadata, must not be modified
+    :raises OSError: File not readable
+    :raises ValueError: Invalid json
+    :raises ValidationError: Schema violated
+    """
+    with open(path, 'rb') as metadata_file:
+        st = os.fstat(metadata_file.fileno())
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        cached = _parse_cache.get(path)
+        cache_lookup("additional_metadata", cached is not None and cached[0] == key)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        with span("additional_metadata"):
+            metadata = json.load(metadata_file)
+    with span("schema_validation"):
+        additional_metadata_validator.validate(metadata)
+    with _parse_cache_lock:
+        _parse_cache[path] = (key, metadata)
+    return metadata
+
 
 def thumbnails_to_sets(from_json: dict[str, list[str]] | None) -> dict[str, set[str]] | None:
     """
@@ -46,7 +93,8 @@ class AdditionalMetadata:
 
     def __init__(self, description: str | None = None, hardware: str | None = None, location: str | None = None,
                  thumbnails: dict[str, set[str]] = None,
-                 tags: list[str] = None, recording_time: datetime.datetime | None = None):
+                 tags: list[str] = None, recording_time: datetime.datetime | None = None,
+                 thumbnail_versions: dict[str, int] = None, thumbnail_failures: dict[str, int] = None):
         self.description = description
         self.hardware = hardware
         self.location = location
@@ -61,8 +109,17 @@ class AdditionalMetadata:
             if len(tags) != len(set(tags)):
                 raise RuntimeError(f"Tags in AdditionalMetadata must be unique. Tags given: {tags}")
         self.recording_time = recording_time
-
-    def to_json(self) -> str:
+        # Thumbnail file name -> version of generator
+        self.thumbnail_versions = thumbnail_versions
+        if thumbnail_versions is None:
+            self.thumbnail_versions = {}
+        # Topic -> version of the generator which failed for it
+        self.thumbnail_failures = thumbnail_failures
+        if thumbnail_failures is None:
+            self.thumbnail_failures = {}
+
+    def to_dict(self) -> dict:
+        """Json-form of the additional metadata, validated against the schema"""
         self_dict = {}
 
         if self.description is not None:
@@ -83,18 +140,36 @@ class AdditionalMetadata:
         if self.recording_time is not None:
             self_dict["recording_time"] = self.recording_time.isoformat()
 
-        validate(self_dict, additional_metadata_schema)
-        return json.dumps(self_dict, indent=2)
+        if self.thumbnail_versions is not None and len(self.thumbnail_versions) > 0:
+            self_dict["thumbnail_versions"] = self.thumbnail_versions
+
+        if self.thumbnail_failures is not None and len(self.thumbnail_failures) > 0:
+            self_dict["thumbnail_failures"] = self.thumbnail_failures
+
+        additional_metadata_validator.validate(self_dict)
+        return self_dict
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
 
     @staticmethod
     def from_file(path: Path) -> 'AdditionalMetadata':
-        with open(path, 'r') as metadata_file:
-            metadata = json.load(metadata_file)
-        validate(metadata, additional_metadata_schema)
+        return AdditionalMetadata.from_dict(load_additional_metadata_file(path), validate_schema=False)
+
+    @staticmethod
+    def from_dict(metadata: dict, validate_schema: bool = True) -> 'AdditionalMetadata':
+        """
+        :param metadata: Json-form of the additional metadata
+        :param validate_schema: Validation can be skipped for dicts which have already been validated (e.g. cached)
+        """
+        if validate_schema:
+            additional_metadata_validator.validate(metadata)
         return AdditionalMetadata(metadata.get("description"), metadata.get("hardware"), metadata.get("location"),
-                                  thumbnails_to_sets(metadata.get("thumbnails")), metadata.get("tags", []),
+                                  thumbnails_to_sets(metadata.get("thumbnails")), list(metadata.get("tags", [])),
                                   datetime.datetime.fromisoformat(
-                                      metadata["recording_time"]) if "recording_time" in metadata else None
+                                      metadata["recording_time"]) if "recording_time" in metadata else None,
+                                  dict(metadata.get("thumbnail_versions", {})),
+                                  dict(metadata.get("thumbnail_failures", {}))
                                   )
 
     @staticmethod
@@ -102,3 +177,30 @@ class AdditionalMetadata:
         # TODO: Make more (all) fields optional, to enable creating thumbnails without setting empty values for other
         #  metadata (https://github.com/teamspatzenhirn/rosbagBrowser/issues/3)
         return AdditionalMetadata("", "", "", None, ["no_metadata"])
+
+
+@dataclass
+class AdditionalMetadataLoadResult:
+    # Path -> json-form of valid files
+    metadata: dict[Path, dict] = field(default_factory=dict)
+    # Path -> all problems of invalid files
+    errors: dict[Path, list[str]] = field(default_factory=dict)
+
+
+def load_additional_metadata_files(paths: Iterable[Path]) -> AdditionalMetadataLoadResult:
+    """
+    Read and validate many additional_metadata.json files (using the parse cache). Invalid files do not abort
+    loading, all schema violations of all files are reported.
+    """
+    result = AdditionalMetadataLoadResult()
+    for path in paths:
+        try:
+            result.metadata[path] = load_additional_metadata_file(path)
+        except OSError as e:
+            result.errors[path] = [str(e)]
+        except ValueError as e:
+            result.errors[path] = [f"Invalid json: {e}"]
+        except ValidationError:
+            with open(path, 'r') as metadata_file:
+                result.errors[path] = schema_errors(json.load(metadata_file))
+    return result
@@ -0,0 +1,104 @@
+"""
+Archive-wide totals (number of bags, recorded duration, bytes on disk) per hardware, location, tag, month of recording
+and topic, stored in CatalogAggregate.
+
+Aggregates are maintained incrementally by the BagCatalog: when entries are loaded or removed, the contributions of
+the previous entries are subtracted and those of the new entries added (see AggregateChanges). Reading them is a
+single query, independent of the number of bags. Like the bag list, only readable bags (without error) are counted.
+"""
+from typing import Iterable
+
+from django.db.models import F
+
+from rosbagsApp.models import CatalogAggregate, CatalogEntry, CatalogTag
+
+
+def contributions(entry: CatalogEntry, tags: Iterable[str]) -> list[tuple[str, str]]:
+    """(dimension, key) of all aggregates an entry is counted in"""
+    if entry.error is not None:
+        return []
+    keys = [(CatalogAggregate.TOTAL, "")]
+    if entry.hardware:
+        keys.append((CatalogAggregate.HARDWARE, entry.hardware))
+    if entry.location:
+        keys.append((CatalogAggregate.LOCATION, entry.location))
+    if entry.recording_date is not None:
+        keys.append((CatalogAggregate.MONTH, entry.recording_date.strftime("%Y-%m")))
+    keys += [(CatalogAggregate.TAG, tag) for tag in sorted(set(tags))]
+    keys += [(CatalogAggregate.TOPIC, topic) for topic in sorted({topic for topic, _, _ in entry.topics})]
+    return keys
+
+
+class AggregateChanges:
+    """Changes of the aggregates of one storage, collected for many entries and written at once"""
+
+    def __init__(self, storage_path: str):
+        self.storage_path = storage_path
+        # (dimension, key) -> [bags, duration, size]
+        self._deltas: dict[tuple[str, str], list[int]] = {}
+
+    def add(self, entry: CatalogEntry, tags: Iterable[str], sign: int = 1):
+        """Count an entry (sign 1) or stop counting it (sign -1)"""
+        for key in contributions(entry, tags):
+            delta = self._deltas.setdefault(key, [0, 0, 0])
+            delta[0] += sign
+            delta[1] += sign * (entry.duration or 0)
+            delta[2] += sign * (entry.size or 0)
+
+    def add_stored(self, entries: list[CatalogEntry], sign: int = 1):
+        """
+        Count (sign 1) or stop counting (sign -1) entries with their tags as stored in the database. Must be called
+        before the entries are deleted or replaced.
+        """
+        tags: dict[int, list[str]] = {}
+        for entry_id, tag in CatalogTag.objects.filter(entry__in=entries).values_list("entry_id", "tag"):
+            tags.setdefault(entry_id, []).append(tag)
+        for entry in entries:
+            self.add(entry, tags.get(entry.id, []), sign)
+
+    def apply(self):
+        """
+        Write the changes to the database (should be called within the transaction which changed the entries). Existing
+        aggregates are updated by adding the deltas in the database, so changes applied concurrently are not lost.
+        """
+        deltas = {key: delta for key, delta in self._deltas.items() if any(delta)}
+        self._deltas = {}
+        if len(deltas) == 0:
+            return
+        aggregates = CatalogAggregate.objects.filter(storage_path=self.storage_path)
+        existing = set(aggregates.filter(dimension__in={d for d, _ in deltas}, key__in={k for _, k in deltas})
+                       .values_list("dimension", "key"))
+        created = []
+        for (dimension, key), (bags, duration, size) in deltas.items():
+            if (dimension, key) in existing:
+                aggregates.filter(dimension=dimension, key=key).update(
+                    bags=F("bags") + bags, duration=F("duration") + duration, size=F("size") + size)
+            else:
+                created.append(CatalogAggregate(storage_path=self.storage_path, dimension=dimension, key=key,
+                                                bags=bags, duration=duration, size=size))
+        CatalogAggregate.objects.bulk_create(created)
+        # Nothing counted anymore (e.g. last bag with a tag removed)
+        aggregates.filter(bags__lte=0).delete()
+
+
+def rebuild_aggregates(storage_path: str):
+    """Recompute all aggregates of a storage from its catalog entries (the bags are not accessed)"""
+    CatalogAggregate.objects.filter(storage_path=storage_path).delete()
+    entries = CatalogEntry.objects.filter(storage_path=storage_path, error__isnull=True)
+    changes = AggregateChanges(storage_path)
+    changes.add_stored(list(entries))
+    changes.apply()
+
+
+def counted_bags(storage_path: str) -> int:
+    """Number of bags counted by the aggregates, differs from the number of readable entries if they are out of sync"""
+    total = CatalogAggregate.objects.filter(storage_path=storage_path, dimension=CatalogAggregate.TOTAL).first()
+    return total.bags if total is not None else 0
+
+
+def aggregates(storage_path: str) -> dict[str, list[CatalogAggregate]]:
+    """All aggregates of a storage by dimension, most bags first"""
+    result = {dimension: [] for dimension in CatalogAggregate.DIMENSIONS}
+    for aggregate in CatalogAggregate.objects.filter(storage_path=storage_path).order_by("-bags", "key"):
+        result[aggregate.dimension].append(aggregate)
+    return result
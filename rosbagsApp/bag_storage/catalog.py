@@ -0,0 +1,283 @@
+import contextlib
+import datetime
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+import rosbags.rosbag2 as rb
+from django.db import connection, transaction
+from django.db.models import F
+
+from rosbagsApp.bag_storage.additional_metadata import AdditionalMetadata, AdditionalMetadataLoadResult, \
+    additional_metadata_file_name, load_additional_metadata_files
+from rosbagsApp.bag_storage.aggregates import AggregateChanges, counted_bags, rebuild_aggregates
+from rosbagsApp.bag_storage.recording_info import RecordingInfo
+from rosbagsApp.bag_storage.scanner import BagEvent, BagEventType
+from rosbagsApp.bag_storage.search import index_entry
+from rosbagsApp.instrumentation import cache_lookup, span
+from rosbagsApp.models import CatalogEntry, CatalogGeneration, CatalogTag, CatalogTopic
+
+logger = logging.getLogger(__name__)
+
+
+def file_mtime(path: Path) -> Optional[int]:
+    """st_mtime_ns of the file, None if it does not exist"""
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def database_size(path: Path) -> int:
+    """Bytes of all database files (.db3, or .zstd if compressed by file) of a bag"""
+    with os.scandir(path) as it:
+        return sum(e.stat().st_size for e in it if e.name.endswith((".db3", ".zstd")) and e.is_file())
+
+
+class BagCatalog:
+    """
+    Persistent catalog of the bags in a BagStorage, stored in the django database.
+
+    Reading metadata.yaml and additional_metadata.json for every bag on every request is slow for
+    large storages (especially on network mounts). The catalog keeps the contents of both files per bag, and only
+    re-reads them if the mtime of one of the files changed. Revalidating an entry therefore only costs two stat calls.
+
+    Archive-wide aggregates (see rosbagsApp.bag_storage.aggregates) and the generation are updated together with the
+    entries.
+    """
+
+    def __init__(self, base_path: Path):
+        """
+        :param base_path: Resolved path of the BagStorage
+        """
+        self.base_path = base_path
+        self._storage_path = str(base_path)
+
+    def entries(self):
+        return CatalogEntry.objects.filter(storage_path=self._storage_path)
+
+    def generation(self) -> int:
+        """
+        Counter which changes whenever an entry is added, changed or removed, i.e. responses derived from the catalog
+        can be cached until the generation changes
+        """
+        generation = CatalogGeneration.objects.filter(storage_path=self._storage_path) \
+            .values_list("generation", flat=True).first()
+        return generation if generation is not None else 0
+
+    def _increment_generation(self):
+        """Must be called within the transaction which changed the entries"""
+        # Starts at the current time, so a recreated counter (e.g. after the database was reset) does not repeat
+        # generations of the old one
+        counter, created = CatalogGeneration.objects.get_or_create(storage_path=self._storage_path,
+                                                                   defaults={"generation": time.time_ns()})
+        if not created:
+            CatalogGeneration.objects.filter(id=counter.id).update(generation=F("generation") + 1)
+
+    @contextlib.contextmanager
+    def _write_transaction(self):
+        """
+        transaction.atomic() which starts with a write, so SQLite takes the write lock at the beginning of the
+        transaction (like BEGIN IMMEDIATE). A transaction which reads first and is then upgraded fails immediately with
+        "database is locked" if another connection (e.g. another web worker or the thumbnail worker) is writing, while
+        waiting for the write lock respects the busy timeout.
+        """
+        outermost = not connection.in_atomic_block
+        with transaction.atomic():
+            if outermost:
+                CatalogGeneration.objects.filter(storage_path=self._storage_path).update(generation=F("generation"))
+            yield
+
+    def update(self, events: list[BagEvent], bags: list[Path]):
+        """
+        Apply changes reported by the StorageScanner
+        :param events: Changes since the last update
+        :param bags: Paths of all bags currently in the storage, relative to the storage
+        """
+        if len(events) == 0 and self.entries().count() == len(bags):
+            # Unchanged (most requests), checked without taking the write lock
+            return
+        with self._write_transaction():
+            if len(events) > 0:
+                known = {e.rel_path: e for e in self.entries()}
+                changed = []
+                removed = []
+                for event in events:
+                    entry = known.get(str(event.rel_path))
+                    if event.type == BagEventType.REMOVED:
+                        if entry is not None:
+                            removed.append(entry)
+                    else:
+                        changed.append((event.rel_path, entry))
+                self._delete(removed)
+                self._revalidate_all(changed)
+
+            if self.entries().count() != len(bags):
+                # Catalog out of sync with the scanner, e.g. bags removed while the server was not running or database
+                # reset while the scanner kept its state
+                self._reconcile(bags)
+
+                if counted_bags(self._storage_path) != self.entries().filter(error__isnull=True).count():
+                    # Aggregates of a catalog written before they existed, or changed by another process
+                    logger.info("Rebuilding aggregates of %s", self._storage_path)
+                    rebuild_aggregates(self._storage_path)
+
+    def _reconcile(self, bags: list[Path]):
+        catalogued = set(self.entries().values_list("rel_path", flat=True))
+        expected = {str(p): p for p in bags}
+        self._revalidate_all([(expected[key], None) for key in expected.keys() - catalogued])
+        stale = catalogued - expected.keys()
+        if len(stale) > 0:
+            self._delete(list(self.entries().filter(rel_path__in=stale)))
+
+    def _delete(self, entries: list[CatalogEntry]):
+        """Delete entries and subtract them from the aggregates"""
+        if len(entries) == 0:
+            return
+        with self._write_transaction():
+            # Read again within the transaction, entries deleted or changed in the meantime (e.g. by another process)
+            # must not be subtracted twice or with their previous contents
+            entries = list(CatalogEntry.objects.filter(id__in=[e.id for e in entries]))
+            changes = AggregateChanges(self._storage_path)
+            changes.add_stored(entries, -1)
+            CatalogEntry.objects.filter(id__in=[e.id for e in entries]).delete()
+            changes.apply()
+            self._increment_generation()
+
+    def get(self, rel_path: Path) -> Optional[CatalogEntry]:
+        """
+        Up-to-date entry of a single bag
+        :param rel_path: Path of the bag, relative to the storage
+        :return: Entry, or None if there is no bag at rel_path
+        """
+        entry = self.entries().filter(rel_path=str(rel_path)).first()
+        return self._revalidate_all([(rel_path, entry)])[0]
+
+    def _revalidate_all(self, bags: list[tuple[Path, Optional[CatalogEntry]]]) -> list[Optional[CatalogEntry]]:
+        """
+        Update the entries of bags whose files changed. The additional metadata of all these bags is loaded at once.
+        :param bags: Path of the bag and its current entry (None if not catalogued)
+        :return: Up-to-date entries, None for paths which are not a bag (anymore)
+        """
+        results = []
+        outdated = []
+        removed = []
+        for rel_path, entry in bags:
+            path = self.base_path / rel_path
+            metadata_mtime = file_mtime(path / "metadata.yaml")
+            if metadata_mtime is None:
+                # Not a bag (anymore)
+                if entry is not None:
+                    removed.append(entry)
+                results.append(None)
+                continue
+
+            additional_metadata_mtime = file_mtime(path / additional_metadata_file_name)
+            if entry is not None and entry.metadata_mtime == metadata_mtime \
+                    and entry.additional_metadata_mtime == additional_metadata_mtime:
+                cache_lookup("catalog", True)
+                results.append(entry)
+                continue
+            cache_lookup("catalog", False)
+            results.append(None)
+            outdated.append((len(results) - 1, rel_path, metadata_mtime, additional_metadata_mtime, entry))
+
+        self._delete(removed)
+        if len(outdated) == 0:
+            return results
+
+        additional_metadata = load_additional_metadata_files(
+            [self.base_path / rel_path / additional_metadata_file_name
+             for _, rel_path, _, additional_metadata_mtime, _ in outdated if additional_metadata_mtime is not None])
+        if len(additional_metadata.errors) > 0:
+            errors = "\n".join(f"{path}: {'; '.join(errors)}" for path, errors in additional_metadata.errors.items())
+            logger.warning("Invalid %s in %d bags:\n%s", additional_metadata_file_name, len(additional_metadata.errors),
+                           errors)
+
+        changes = AggregateChanges(self._storage_path)
+        for i, rel_path, metadata_mtime, additional_metadata_mtime, _ in outdated:
+            fields, tags = self._load(self.base_path / rel_path, metadata_mtime, additional_metadata_mtime,
+                                      additional_metadata)
+            with self._write_transaction():
+                # The entry as stored now, it might have been replaced since it was read (e.g. by another process)
+                old_entry = self.entries().filter(rel_path=str(rel_path)).first()
+                if old_entry is not None:
+                    # Subtracted before its tags are replaced
+                    changes.add_stored([old_entry], -1)
+                entry, created = CatalogEntry.objects.update_or_create(storage_path=self._storage_path,
+                                                                       rel_path=str(rel_path), defaults=fields)
+                if not created:
+                    entry.catalog_topics.all().delete()
+                    entry.catalog_tags.all().delete()
+                CatalogTopic.objects.bulk_create(
+                    [CatalogTopic(entry=entry, name=topic, msgtype=msgtype, msgcount=msgcount)
+                     for topic, msgtype, msgcount in entry.topics])
+                CatalogTag.objects.bulk_create([CatalogTag(entry=entry, tag=tag) for tag in tags])
+                index_entry(entry, tags)
+                changes.add(entry, tags)
+            results[i] = entry
+        with self._write_transaction():
+            changes.apply()
+            self._increment_generation()
+        return results
+
+    @staticmethod
+    def _load(path: Path, metadata_mtime: int, additional_metadata_mtime: Optional[int],
+              loaded: AdditionalMetadataLoadResult) -> tuple[dict, list[str]]:
+        """
+        Read bag contents
+        :param loaded: Additional metadata, loaded by load_additional_metadata_files
+        :return: CatalogEntry fields, tags
+        """
+        fields = {"name": path.name,
+                  "metadata_mtime": metadata_mtime,
+                  "additional_metadata_mtime": additional_metadata_mtime,
+                  "start_time": None,
+                  "duration": None,
+                  "topics": [],
+                  "size": None,
+                  "additional_metadata": None,
+                  "recording_date": None,
+                  "hardware": None,
+                  "location": None,
+                  "error": None}
+        errors = []
+
+        try:
+            with span("metadata_yaml"):
+                info = RecordingInfo.from_metadata_file(path)
+            fields["start_time"] = info.start_time
+            fields["duration"] = info.duration
+            fields["topics"] = [list(t) for t in info.topics]
+            fields["size"] = database_size(path)
+        except rb.ReaderError as e:
+            errors.append(str(e))
+
+        additional_metadata = AdditionalMetadata.default()
+        if additional_metadata_mtime is not None:
+            metadata_path = path / additional_metadata_file_name
+            if metadata_path in loaded.errors:
+                errors.append(f"Invalid {additional_metadata_file_name} in {path}: "
+                              f"{'; '.join(loaded.errors[metadata_path])}")
+            else:
+                try:
+                    metadata = loaded.metadata[metadata_path]
+                    additional_metadata = AdditionalMetadata.from_dict(metadata, validate_schema=False)
+                    fields["additional_metadata"] = metadata
+                except (ValueError, RuntimeError) as e:
+                    # Not covered by the schema, e.g. malformed recording_time or duplicate tags
+                    errors.append(f"Invalid {additional_metadata_file_name} in {path}: {e}")
+
+        fields["hardware"] = additional_metadata.hardware
+        fields["location"] = additional_metadata.location
+        if additional_metadata.recording_time is not None:
+            fields["recording_date"] = additional_metadata.recording_time
+        elif fields["start_time"] is not None:
+            fields["recording_date"] = datetime.datetime.fromtimestamp(fields["start_time"] // 1000000000,
+                                                                       tz=datetime.timezone.utc)
+
+        if len(errors) > 0:
+            fields["error"] = "\n".join(errors)
+        return fields, additional_metadata.tags
@@ -0,0 +1,221 @@
+"""
+Vectorised decoding of selected numeric fields from many CDR serialized messages.
+
+rosbags' deserialize_cdr creates one Python object per message (and per nested message), which dominates the runtime
+when only a few fields of every message in a large bag are needed (e.g. timestamps and positions for a plot).
+Messages whose layout does not depend on their content are therefore decoded in batches: the offsets of the requested
+fields are computed from the msg definition, the payloads of a batch are joined into one buffer and the fields are
+read through a NumPy structured dtype, without creating any per-message objects.
+
+Strings (e.g. std_msgs/Header.frame_id) and sequences of base types shift the offsets of all following fields by their
+length. The layout is therefore computed for the first payload of each batch and only used for payloads of the same
+size whose length fields are equal, which is the case for virtually all messages of a topic. The remaining payloads
+and message types which can not be handled this way (e.g. sequences of messages or strings) are decoded using
+deserialize_cdr.
+"""
+import itertools
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+import numpy as np
+from rosbags.serde import deserialize_cdr
+from rosbags.serde.messages import get_msgdef
+from rosbags.serde.typing import Msgdef
+from rosbags.serde.utils import SIZEMAP, Valtype
+from rosbags.typesys import types
+
+# Size of the encapsulation header preceding the CDR payload, alignment is relative to the end of the header
+_HEADER_SIZE = 4
+
+_DTYPES = {
+    "bool": "?",
+    "int8": "i1",
+    "int16": "i2",
+    "int32": "i4",
+    "int64": "i8",
+    "uint8": "u1",
+    "uint16": "u2",
+    "uint32": "u4",
+    "uint64": "u8",
+    "float32": "f4",
+    "float64": "f8",
+}
+
+
+class UnsupportedLayout(Exception):
+    """The message type contains fields whose offsets can not be derived from a single message"""
+
+
+@dataclass(frozen=True)
+class _Layout:
+    # Requested field -> offset within the serialized message (including header)
+    offsets: dict[str, int]
+    # (offset, value) of all length fields preceding the requested fields, the layout is only valid for messages
+    # where these are equal
+    lengths: tuple[tuple[int, int], ...]
+
+
+def _align(pos: int, size: int) -> int:
+    return (pos + size - 1) & -size
+
+
+class FieldDecoder:
+    """
+    Reads numeric fields (given as dotted paths, e.g. "header.stamp.sec") of serialized messages of one type.
+    The message type must be registered (see rosbags.typesys.register_types).
+    """
+
+    def __init__(self, msgtype: str, fields: list[str], batch_size: int = 4096):
+        self.msgtype = msgtype
+        self.fields = list(fields)
+        self.batch_size = batch_size
+        self._msgdef = get_msgdef(msgtype, types)
+        self._base_types: dict[str, str] = {}  # Numeric field -> ROS base type
+        self._collect_base_types(self._msgdef, "")
+        for name in self.fields:
+            if name not in self._base_types:
+                raise ValueError(f"{msgtype} has no numeric field \"{name}\"")
+        # Layouts by payload size, reused for all batches (None if the size can not be decoded vectorised)
+        self._layouts: dict[int, Optional[_Layout]] = {}
+        self.fallback_count = 0  # Number of messages decoded using deserialize_cdr
+
+    def _collect_base_types(self, msgdef: Msgdef, prefix: str):
+        for field in msgdef.fields:
+            desc = field.descriptor
+            if desc.valtype == Valtype.BASE and desc.args in _DTYPES:
+                self._base_types[prefix + field.name] = desc.args
+            elif desc.valtype == Valtype.MESSAGE:
+                self._collect_base_types(desc.args, f"{prefix}{field.name}.")
+
+    def decode(self, rawdata: Iterable[bytes]) -> dict[str, np.ndarray]:
+        """
+        :param rawdata: Serialized messages (e.g. from rosbags.rosbag2.Reader.messages)
+        :return: Requested field -> array of its values, in the order of the messages
+        """
+        results = {name: [] for name in self.fields}
+        iterator = iter(rawdata)
+        while True:
+            batch = list(itertools.islice(iterator, self.batch_size))
+            if not batch:
+                break
+            for name, values in self._decode_batch(batch).items():
+                results[name].append(values)
+        return {name: np.concatenate(values) if values else np.zeros((0,), dtype=_DTYPES[self._base_types[name]])
+                for name, values in results.items()}
+
+    def _decode_batch(self, batch: list[bytes]) -> dict[str, np.ndarray]:
+        values = {name: np.empty((len(batch),), dtype=_DTYPES[self._base_types[name]]) for name in self.fields}
+        decoded = np.zeros((len(batch),), dtype=bool)
+
+        # Payloads of equal size can share a layout
+        sizes = np.fromiter(map(len, batch), dtype=np.int64, count=len(batch))
+        starts = np.cumsum(sizes) - sizes
+        buffer = np.frombuffer(b"".join(batch), dtype=np.uint8)
+        # Only little endian (the default of all ROS 2 middlewares) is decoded vectorised
+        little_endian = sizes >= _HEADER_SIZE
+        little_endian[little_endian] = buffer[starts[little_endian] + 1] == 1
+
+        for size in np.unique(sizes[little_endian]).tolist():
+            indices = np.flatnonzero(little_endian & (sizes == size))
+            layout = self._layout(size, batch[indices[0]])
+            if layout is None:
+                continue
+            dtype = np.dtype({
+                "names": [f"f{i}" for i in range(len(self.fields) + len(layout.lengths))],
+                "formats": ["<" + _DTYPES[self._base_types[name]] for name in self.fields] +
+                           ["<u4"] * len(layout.lengths),
+                "offsets": [layout.offsets[name] for name in self.fields] + [offset for offset, _ in layout.lengths],
+                "itemsize": size,
+            })
+            if len(indices) == len(batch):
+                records = np.frombuffer(buffer, dtype=dtype)
+            else:
+                records = np.frombuffer(buffer[starts[indices, None] + np.arange(size)].tobytes(), dtype=dtype)
+            matching = np.ones((len(indices),), dtype=bool)
+            for j, (_, length) in enumerate(layout.lengths):
+                matching &= records[f"f{len(self.fields) + j}"] == length
+            target = indices[matching]
+            for j, name in enumerate(self.fields):
+                values[name][target] = records[f"f{j}"][matching]
+            decoded[target] = True
+
+        for i in np.flatnonzero(~decoded):
+            self.fallback_count += 1
+            msg = deserialize_cdr(batch[i], self.msgtype)
+            for name in self.fields:
+                value = msg
+                for part in name.split("."):
+                    value = getattr(value, part)
+                values[name][i] = value
+        return values
+
+    def _layout(self, size: int, sample: bytes) -> Optional[_Layout]:
+        """Layout valid for `sample`, None if it can not be used for vectorised decoding"""
+        if size in self._layouts and self._layouts[size] is None:
+            return None
+        layout = self._layouts.get(size)
+        if layout is not None and all(self._read_length(sample, offset) == length
+                                      for offset, length in layout.lengths):
+            return layout
+        try:
+            offsets = {}
+            lengths = []
+            self._walk(self._msgdef, 0, "", sample, offsets, lengths)
+        except UnsupportedLayout:
+            self._layouts[size] = None
+            return None
+        layout = _Layout({name: offsets[name] for name in self.fields}, tuple(lengths))
+        self._layouts[size] = layout
+        return layout
+
+    @staticmethod
+    def _read_length(data: bytes, offset: int) -> int:
+        return int.from_bytes(data[offset:offset + 4], "little")
+
+    def _walk(self, msgdef: Msgdef, pos: int, prefix: str, sample: bytes,
+              offsets: dict[str, int], lengths: list[tuple[int, int]]) -> int:
+        """
+        Computes the offsets of the fields of `msgdef` (relative to the end of the header) in `sample`
+        Stops once the offsets of all requested fields are known, the following fields do not affect them.
+        :return: Position after the message (or the last requested field)
+        """
+        for field in msgdef.fields:
+            if all(name in offsets for name in self.fields):
+                return pos
+            name = prefix + field.name
+            desc = field.descriptor
+            if desc.valtype == Valtype.BASE:
+                if desc.args == "string":
+                    pos = self._walk_length(pos, sample, lengths)
+                    pos += lengths[-1][1]
+                else:
+                    pos = _align(pos, SIZEMAP[desc.args])
+                    offsets[name] = _HEADER_SIZE + pos
+                    pos += SIZEMAP[desc.args]
+            elif desc.valtype == Valtype.MESSAGE:
+                pos = self._walk(desc.args, pos, f"{name}.", sample, offsets, lengths)
+            elif desc.valtype == Valtype.ARRAY:
+                subdesc, length = desc.args
+                if subdesc.valtype != Valtype.BASE or subdesc.args == "string":
+                    raise UnsupportedLayout(f"Array {name}")
+                pos = _align(pos, SIZEMAP[subdesc.args]) + length * SIZEMAP[subdesc.args]
+            else:
+                subdesc = desc.args[0]
+                if subdesc.valtype != Valtype.BASE or subdesc.args == "string":
+                    raise UnsupportedLayout(f"Sequence {name}")
+                pos = self._walk_length(pos, sample, lengths)
+                count = lengths[-1][1]
+                if count > 0:
+                    pos = _align(pos, SIZEMAP[subdesc.args]) + count * SIZEMAP[subdesc.args]
+            if pos > len(sample) - _HEADER_SIZE:
+                raise UnsupportedLayout("Message shorter than its layout")
+        return pos
+
+    @staticmethod
+    def _walk_length(pos: int, sample: bytes, lengths: list[tuple[int, int]]) -> int:
+        pos = _align(pos, 4)
+        offset = _HEADER_SIZE + pos
+        if offset + 4 > len(sample):
+            raise UnsupportedLayout("Message shorter than its layout")
+        lengths.append((offset, FieldDecoder._read_length(sample, offset)))
+        return pos + 4
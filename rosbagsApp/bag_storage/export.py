@@ -0,0 +1,166 @@
+"""
+Export of clips (time range and subset of topics) of a bag as a new rosbag2, streamed as tar archive.
+
+Serialized messages are copied from the reader to the writer without deserializing them. SQLite databases can not be
+written to a stream, so the clip is written as split files of at most ROSBAG_EXPORT_SPLIT_SIZE bytes of messages: each
+split is written to a temporary directory, streamed as soon as it is complete and deleted. Memory use and temporary
+disk space are therefore bounded by the split size, independent of the length of the clip. The first split is only
+FIRST_SPLIT_SIZE bytes and each following split doubles in size up to the split size, so the download starts without
+waiting for a full split. metadata.yaml (listing all splits) is the last member of the archive.
+"""
+import io
+import tarfile
+import tempfile
+import time
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+import rosbags.rosbag2 as rb
+from ruamel.yaml import YAML
+
+import rosbagsApp.settings
+
+READ_CHUNK_SIZE = 1024 * 1024
+# Bytes of messages in the first split file, bounds the time until the first bytes of the archive are sent
+FIRST_SPLIT_SIZE = 1024 * 1024
+
+
+def _tar_header(name: str, size: int, directory: bool = False) -> bytes:
+    info = tarfile.TarInfo(name)
+    info.size = 0 if directory else size
+    info.type = tarfile.DIRTYPE if directory else tarfile.REGTYPE
+    info.mode = 0o755 if directory else 0o644
+    info.mtime = int(time.time())
+    return info.tobuf(format=tarfile.PAX_FORMAT)
+
+
+def _tar_file(name: str, path: Path) -> Iterator[bytes]:
+    """Tar member with the contents of a file, read in chunks"""
+    size = path.stat().st_size
+    yield _tar_header(name, size)
+    with open(path, "rb") as file:
+        while chunk := file.read(READ_CHUNK_SIZE):
+            yield chunk
+    if size % tarfile.BLOCKSIZE != 0:
+        yield tarfile.NUL * (tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE)
+
+
+def _tar_bytes(name: str, data: bytes) -> Iterator[bytes]:
+    yield _tar_header(name, len(data))
+    yield data + tarfile.NUL * (-len(data) % tarfile.BLOCKSIZE)
+
+
+class _Split:
+    """Split file of the clip, written with the rosbags writer"""
+
+    def __init__(self, directory: Path, name: str, reader: rb.Reader, topics: list[str]):
+        self.writer = rb.Writer(directory / name)
+        self.writer.open()
+        self.connections = {}
+        for connection in reader.connections:
+            if connection.topic in topics:
+                self.connections[connection.id] = self.writer.add_connection(
+                    connection.topic, connection.msgtype, connection.ext.serialization_format,
+                    connection.ext.offered_qos_profiles)
+        self.size = 0
+        self.start: Optional[int] = None
+        self.end: Optional[int] = None
+        self.counts: dict[str, int] = {topic: 0 for topic in topics}
+
+    def write(self, connection, timestamp: int, data: bytes):
+        self.writer.write(self.connections[connection.id], timestamp, data)
+        self.size += len(data)
+        self.start = timestamp if self.start is None else min(self.start, timestamp)
+        self.end = timestamp if self.end is None else max(self.end, timestamp)
+        self.counts[connection.topic] += 1
+
+    def close(self) -> Path:
+        """:return: Path of the database file"""
+        self.writer.close()
+        return self.writer.dbpath
+
+
+def _metadata(reader: rb.Reader, topics: list[str], splits: list[tuple[str, _Split]]) -> bytes:
+    """metadata.yaml of the clip (same format as written by the rosbags writer)"""
+    start = min((s.start for _, s in splits if s.start is not None), default=0)
+    end = max((s.end for _, s in splits if s.end is not None), default=0)
+    connections = {c.topic: c for c in reader.connections if c.topic in topics}
+    metadata = {"rosbag2_bagfile_information": {
+        "version": 6,
+        "storage_identifier": "sqlite3",
+        "relative_file_paths": [name for name, _ in splits],
+        "duration": {"nanoseconds": end - start},
+        "starting_time": {"nanoseconds_since_epoch": start},
+        "message_count": sum(sum(s.counts.values()) for _, s in splits),
+        "topics_with_message_count": [
+            {"topic_metadata": {"name": topic,
+                                "type": connections[topic].msgtype,
+                                "serialization_format": connections[topic].ext.serialization_format,
+                                "offered_qos_profiles": connections[topic].ext.offered_qos_profiles},
+             "message_count": sum(s.counts[topic] for _, s in splits)}
+            for topic in topics],
+        "compression_format": "",
+        "compression_mode": "",
+        "files": [{"path": name,
+                   "starting_time": {"nanoseconds_since_epoch": s.start or 0},
+                   "duration": {"nanoseconds": (s.end or 0) - (s.start or 0)},
+                   "message_count": sum(s.counts.values())}
+                  for name, s in splits],
+        "custom_data": {},
+    }}
+    yaml = YAML(typ="safe")
+    yaml.default_flow_style = False
+    stream = io.StringIO()
+    yaml.dump(metadata, stream)
+    return stream.getvalue().encode()
+
+
+def export_clip(path: Path, name: str, topics: Iterable[str], start: Optional[int] = None,
+                stop: Optional[int] = None, split_size: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Tar archive of a bag directory containing the messages of the given topics within [start, stop)
+    :param path: Bag to export from
+    :param name: Name of the exported bag (directory in the archive)
+    :param topics: Topics to export, must be contained in the bag (all topics if empty)
+    :param start: First timestamp (ns) to export, defaults to the start of the bag
+    :param stop: Timestamp (ns) after the last exported message, defaults to the end of the bag
+    :param split_size: Maximum bytes of messages per split file, defaults to ROSBAG_EXPORT_SPLIT_SIZE
+    :return: Chunks of the archive, generated while reading the bag
+    :raises rb.ReaderError: Bag is not readable
+    :raises KeyError: A topic is not contained in the bag
+    """
+    split_size = split_size or rosbagsApp.settings.ROSBAG_EXPORT_SPLIT_SIZE
+    with rb.Reader(path) as reader, tempfile.TemporaryDirectory(prefix="rosbag_export_") as tmp:
+        available = {c.topic for c in reader.connections}
+        topics = list(dict.fromkeys(topics)) or list(dict.fromkeys(c.topic for c in reader.connections))
+        for topic in topics:
+            if topic not in available:
+                raise KeyError(topic)
+        connections = [c for c in reader.connections if c.topic in topics]
+
+        yield _tar_header(name, 0, directory=True)
+        splits: list[tuple[str, _Split]] = []
+        split = None
+        current_split_size = min(FIRST_SPLIT_SIZE, split_size)
+        for connection, timestamp, data in reader.messages(connections, start, stop):
+            if split is None:
+                split = _Split(Path(tmp), f"{name}_{len(splits)}", reader, topics)
+            split.write(connection, timestamp, data)
+            if split.size >= current_split_size:
+                yield from _finish_split(name, splits, split)
+                split = None
+                current_split_size = min(2 * current_split_size, split_size)
+        if split is not None or len(splits) == 0:
+            # An empty clip still contains one (empty) database
+            yield from _finish_split(name, splits, split or _Split(Path(tmp), f"{name}_0", reader, topics))
+
+        yield from _tar_bytes(f"{name}/metadata.yaml", _metadata(reader, topics, splits))
+        yield tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+
+
+def _finish_split(name: str, splits: list[tuple[str, _Split]], split: _Split) -> Iterator[bytes]:
+    db_path = split.close()
+    file_name = f"{name}_{len(splits)}.db3"
+    splits.append((file_name, split))
+    yield from _tar_file(f"{name}/{file_name}", db_path)
+    db_path.unlink()
@@ -0,0 +1,176 @@
+"""
+Conversion of image messages (sensor_msgs/msg/Image and CompressedImage) to 8 bit BGR images for thumbnails and
+previews.
+
+Raw images are wrapped in a numpy view of the message data without copying (rows padded to `step` bytes are
+supported) and converted with a single OpenCV call. 16 bit and float images are scaled to 8 bit by their maximum value,
+so depth images and 10/12 bit cameras using only a part of the 16 bit range are visible.
+
+Compressed images are decoded at 1/2, 1/4 or 1/8 of their resolution (IMREAD_REDUCED_*) if the caller only needs a
+lower resolution. The size is read from the JPEG or PNG header beforehand. libjpeg scales during the inverse DCT, so a
+reduced JPEG is never decoded at full resolution.
+"""
+import struct
+from dataclasses import dataclass
+from typing import Any, Optional
+
+import cv2
+import numpy as np
+from rosbags.typesys.types import sensor_msgs__msg__CompressedImage as CompressedImage, \
+    sensor_msgs__msg__Image as Image
+
+IMAGE_MSGTYPES = {Image.__msgtype__, CompressedImage.__msgtype__}
+
+
+@dataclass(frozen=True)
+class RawEncoding:
+    dtype: str  # numpy type of a channel
+    channels: int
+    conversion: Optional[int]  # cv2.cvtColor code to BGR (applied after scaling to 8 bit), None if already BGR
+
+
+# Encoding names of sensor_msgs/image_encodings.h
+RAW_ENCODINGS = {
+    "bgr8": RawEncoding("u1", 3, None),
+    "rgb8": RawEncoding("u1", 3, cv2.COLOR_RGB2BGR),
+    "bgra8": RawEncoding("u1", 4, cv2.COLOR_BGRA2BGR),
+    "rgba8": RawEncoding("u1", 4, cv2.COLOR_RGBA2BGR),
+    "bgr16": RawEncoding("u2", 3, None),
+    "rgb16": RawEncoding("u2", 3, cv2.COLOR_RGB2BGR),
+    "mono8": RawEncoding("u1", 1, cv2.COLOR_GRAY2BGR),
+    "mono16": RawEncoding("u2", 1, cv2.COLOR_GRAY2BGR),
+    "8UC1": RawEncoding("u1", 1, cv2.COLOR_GRAY2BGR),
+    "8UC3": RawEncoding("u1", 3, None),
+    "16UC1": RawEncoding("u2", 1, cv2.COLOR_GRAY2BGR),
+    # Depth in meters, NaN or infinite where unknown
+    "32FC1": RawEncoding("f4", 1, cv2.COLOR_GRAY2BGR),
+    # UYVY, two bytes per pixel
+    "yuv422": RawEncoding("u1", 2, cv2.COLOR_YUV2BGR_UYVY),
+    "yuv422_yuy2": RawEncoding("u1", 2, cv2.COLOR_YUV2BGR_YUY2),
+}
+for _pattern in ("rggb", "bggr", "gbrg", "grbg"):
+    for _bits, _dtype in ((8, "u1"), (16, "u2")):
+        RAW_ENCODINGS[f"bayer_{_pattern}{_bits}"] = RawEncoding(
+            _dtype, 1, getattr(cv2, f"COLOR_BAYER_{_pattern.upper()}2BGR"))
+
+# Reduction factor -> imdecode flag, largest first
+REDUCED_DECODE_FLAGS = {8: cv2.IMREAD_REDUCED_COLOR_8, 4: cv2.IMREAD_REDUCED_COLOR_4, 2: cv2.IMREAD_REDUCED_COLOR_2}
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Start of frame markers of all JPEG processes (0xC4, 0xC8 and 0xCC are other segments)
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# compressedDepth images (image_transport_plugins) start with a header of the depth quantization, followed by a PNG
+COMPRESSED_DEPTH_HEADER_SIZE = 12
+
+
+def image_array(msg: Image) -> np.ndarray:
+    """
+    View of the pixels of a raw image as (height, width) or (height, width, channels) array, without copying
+    :raises ValueError: Encoding is not supported, or data is smaller than described by height, width and step
+    """
+    encoding = RAW_ENCODINGS.get(msg.encoding)
+    if encoding is None:
+        raise ValueError(f"Image encoding {msg.encoding} is not supported")
+    dtype = np.dtype(encoding.dtype).newbyteorder(">" if msg.is_bigendian else "<")
+    row_bytes = msg.width * encoding.channels * dtype.itemsize
+    if msg.step < row_bytes or (msg.height > 0 and len(msg.data) < msg.step * (msg.height - 1) + row_bytes):
+        raise ValueError(f"Image data of {len(msg.data)} bytes too small for {msg.height} rows of {msg.step} bytes")
+
+    data = np.frombuffer(msg.data, dtype=np.uint8)
+    # Rows without their padding, the last row does not need to be padded
+    rows = np.lib.stride_tricks.as_strided(data, shape=(msg.height, row_bytes), strides=(msg.step, 1),
+                                           writeable=False)
+    shape = (msg.height, msg.width) if encoding.channels == 1 else (msg.height, msg.width, encoding.channels)
+    return rows.view(dtype).reshape(shape)
+
+
+def to_8bit(image: np.ndarray) -> np.ndarray:
+    """
+    Image scaled to 8 bit, 16 bit and float images by their maximum value (i.e. to the range 0..255). Non-finite
+    values of float images become 0.
+    """
+    if image.dtype == np.uint8:
+        return image
+    if image.dtype.kind == "f":
+        image = np.nan_to_num(image.astype(image.dtype.newbyteorder("=")), nan=0, posinf=0, neginf=0)
+    elif not image.dtype.isnative or image.strides[0] % image.itemsize != 0:
+        # Copied, OpenCV supports neither big endian data nor rows not aligned to the size of a value
+        image = image.astype(image.dtype.newbyteorder("="))
+    maximum = float(image.max(initial=0))
+    return cv2.convertScaleAbs(image, alpha=255 / maximum if maximum > 0 else 1)
+
+
+def image_to_bgr(msg: Image) -> np.ndarray:
+    """
+    Raw image as 8 bit BGR image (a view of the message data for bgr8)
+    :raises ValueError: Encoding is not supported, or data is smaller than described by height, width and step
+    """
+    image = to_8bit(image_array(msg))
+    conversion = RAW_ENCODINGS[msg.encoding].conversion
+    return image if conversion is None else cv2.cvtColor(image, conversion)
+
+
+def compressed_image_size(data: np.ndarray) -> Optional[tuple[int, int]]:
+    """(width, height) from the header of a JPEG or PNG image, None for other formats or if the header is invalid"""
+    if data[:len(PNG_SIGNATURE)].tobytes() == PNG_SIGNATURE:
+        if len(data) < 24:
+            return None
+        return struct.unpack(">II", data[16:24].tobytes())
+    if data[:2].tobytes() != b"\xff\xd8":
+        return None
+    # Segments up to the start of frame, which contains the size
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            # Fill byte
+            i += 1
+        elif marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">HH", data[i + 5:i + 9].tobytes())
+            return width, height
+        elif marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # Markers without length
+            i += 2
+        else:
+            i += 2 + struct.unpack(">H", data[i + 2:i + 4].tobytes())[0]
+    return None
+
+
+def compressed_image_to_bgr(msg: CompressedImage, min_height: Optional[int] = None) -> np.ndarray:
+    """
+    Compressed image as 8 bit BGR image, decoded at a reduced resolution if it has at least min_height rows then
+    :param min_height: Rows required by the caller, None for full resolution
+    :raises ValueError: Image can not be decoded
+    """
+    data = np.frombuffer(msg.data, dtype=np.uint8)
+    if "compresseddepth" in msg.format.lower():
+        image = cv2.imdecode(data[COMPRESSED_DEPTH_HEADER_SIZE:], cv2.IMREAD_ANYDEPTH)
+        if image is None:
+            raise ValueError(f"Decoding {msg.format} image failed")
+        return cv2.cvtColor(to_8bit(image), cv2.COLOR_GRAY2BGR)
+
+    flags = cv2.IMREAD_COLOR
+    size = compressed_image_size(data)
+    if min_height is not None and size is not None:
+        flags = next((flag for factor, flag in REDUCED_DECODE_FLAGS.items() if size[1] // factor >= min_height),
+                     flags)
+    image = cv2.imdecode(data, flags)
+    if image is None:
+        raise ValueError(f"Decoding {msg.format} image failed")
+    return image
+
+
+def message_to_bgr(msg: Any, min_height: Optional[int] = None) -> np.ndarray:
+    """
+    Image message (see IMAGE_MSGTYPES) as 8 bit BGR image
+    :param min_height: Rows required by the caller, compressed images are decoded at a reduced resolution then. Raw
+        images are always converted at full resolution.
+    :raises ValueError: Message type or encoding is not supported, or the image can not be decoded
+    """
+    if msg.__msgtype__ == Image.__msgtype__:
+        return image_to_bgr(msg)
+    if msg.__msgtype__ == CompressedImage.__msgtype__:
+        return compressed_image_to_bgr(msg, min_height)
+    raise ValueError(f"{msg.__msgtype__} is not an image message type")
@@ -0,0 +1,107 @@
+import logging
+import threading
+from pathlib import Path
+from typing import Optional
+
+from rosbagsApp.bag_storage.scanner import BagEvent, BagEventType
+from rosbagsApp.models import CatalogEntry
+
+logger = logging.getLogger(__name__)
+
+
+class AmbiguousBagName(LookupError):
+    """Multiple bags (in different subdirectories) have the requested name"""
+
+    def __init__(self, name: str, paths: list[Path]):
+        super().__init__(f"Multiple bags are named \"{name}\": {', '.join(str(p) for p in sorted(paths))}")
+        self.name = name
+        self.paths = paths
+
+
+class BagIndex:
+    """
+    In-memory index of the bags of a storage for lookups by name and path, shared by all BagStorage instances (of one
+    process) for the same directory. It is kept up to date by the events of the StorageScanner, i.e. invalidated by
+    directory mtimes.
+
+    Catalog entries of bags are cached together with the mtimes of metadata.yaml and additional_metadata.json they were
+    loaded for, a cached entry is only returned while both are unchanged. Entries are not modified after caching,
+    requests construct their own ROSBag from them (see BagStorage.find_by_path).
+    """
+
+    _indexes: dict[Path, 'BagIndex'] = {}
+    _indexes_lock = threading.Lock()
+
+    def __init__(self, base_path: Path):
+        self.base_path = base_path
+        self._built = False
+        self._paths_by_name: dict[str, set[Path]] = {}
+        # Bag path -> ((mtime of metadata.yaml, mtime of additional_metadata.json), catalog entry)
+        self._entries: dict[Path, tuple[tuple[int, Optional[int]], CatalogEntry]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def for_storage(base_path: Path) -> 'BagIndex':
+        with BagIndex._indexes_lock:
+            index = BagIndex._indexes.get(base_path)
+            if index is None:
+                index = BagIndex(base_path)
+                BagIndex._indexes[base_path] = index
+            return index
+
+    @property
+    def built(self) -> bool:
+        """Whether the index has been populated by a scan"""
+        return self._built
+
+    def update(self, events: list[BagEvent], bags: list[Path]):
+        """
+        Apply changes reported by the StorageScanner
+        :param events: Changes since the last update
+        :param bags: Paths of all bags currently in the storage, relative to the storage
+        """
+        with self._lock:
+            if not self._built:
+                for rel_path in bags:
+                    self._paths_by_name.setdefault(rel_path.name, set()).add(rel_path)
+                self._built = True
+                names = self._paths_by_name.keys()
+            else:
+                names = set()
+                for event in events:
+                    name = event.rel_path.name
+                    if event.type == BagEventType.ADDED:
+                        self._paths_by_name.setdefault(name, set()).add(event.rel_path)
+                        names.add(name)
+                    elif event.type == BagEventType.REMOVED and name in self._paths_by_name:
+                        self._paths_by_name[name].discard(event.rel_path)
+                        if len(self._paths_by_name[name]) == 0:
+                            del self._paths_by_name[name]
+                    if event.type != BagEventType.ADDED:
+                        self._entries.pop(event.rel_path, None)
+
+            for name in names:
+                paths = self._paths_by_name.get(name, set())
+                if len(paths) > 1:
+                    logger.warning("%s", AmbiguousBagName(name, list(paths)))
+
+    def paths(self, name: str) -> list[Path]:
+        """Paths of all bags with the given name"""
+        return sorted(self._paths_by_name.get(name, set()))
+
+    def contains(self, rel_path: Path) -> bool:
+        return rel_path in self._paths_by_name.get(rel_path.name, set())
+
+    def duplicate_names(self) -> dict[str, list[Path]]:
+        """Names shared by multiple bags, with the paths of these bags"""
+        return {name: sorted(paths) for name, paths in self._paths_by_name.items() if len(paths) > 1}
+
+    def cached_entry(self, rel_path: Path, mtimes: tuple[int, Optional[int]]) -> Optional[CatalogEntry]:
+        """Cached catalog entry of a bag, None if not cached or loaded for different mtimes. Must not be modified."""
+        cached = self._entries.get(rel_path)
+        if cached is None or cached[0] != mtimes:
+            return None
+        return cached[1]
+
+    def cache_entry(self, rel_path: Path, mtimes: tuple[int, Optional[int]], entry: CatalogEntry):
+        self._entries[rel_path] = (mtimes, entry)
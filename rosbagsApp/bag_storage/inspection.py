@@ -0,0 +1,58 @@
+"""
+Conversion of deserialized messages to json for inspecting them in the browser.
+"""
+import base64
+import math
+from typing import Any, Optional
+
+import cv2
+import numpy as np
+
+from rosbagsApp.bag_storage.images import IMAGE_MSGTYPES, message_to_bgr
+
+# Arrays and sequences with more items are truncated to their first items
+MAX_ARRAY_ITEMS = 32
+# Height of image previews in pixels (images are not scaled up)
+IMAGE_PREVIEW_HEIGHT = 240
+
+
+def message_to_json(msg: Any) -> Any:
+    """
+    Deserialized message (or field value) as json compatible value. Messages become dicts, arrays and sequences
+    lists. Arrays with more than MAX_ARRAY_ITEMS items become {"length": <length>, "items": <first items>}.
+    Non-finite floats are converted to strings ("nan", "inf"), they can not be represented in json.
+    """
+    if hasattr(msg, "__msgtype__"):
+        return {name: message_to_json(getattr(msg, name)) for name in msg.__dataclass_fields__
+                if name != "__msgtype__"}
+    if isinstance(msg, (np.ndarray, list, tuple)):
+        items = [message_to_json(item) for item in msg[:MAX_ARRAY_ITEMS]]
+        if len(msg) > MAX_ARRAY_ITEMS:
+            return {"length": len(msg), "items": items}
+        return items
+    if isinstance(msg, np.generic):
+        msg = msg.item()
+    if isinstance(msg, float) and not math.isfinite(msg):
+        return str(msg)
+    return msg
+
+
+def image_preview(msg: Any) -> Optional[str]:
+    """
+    Preview of an image message (sensor_msgs/msg/Image or CompressedImage) as PNG data URL
+    :return: None if msg is not an image or its encoding is not supported
+    """
+    if msg.__msgtype__ not in IMAGE_MSGTYPES:
+        return None
+    try:
+        image = message_to_bgr(msg, min_height=IMAGE_PREVIEW_HEIGHT)
+    except (ValueError, cv2.error):
+        return None
+
+    if image.shape[0] > IMAGE_PREVIEW_HEIGHT:
+        width = max(round(image.shape[1] * IMAGE_PREVIEW_HEIGHT / image.shape[0]), 1)
+        image = cv2.resize(image, (width, IMAGE_PREVIEW_HEIGHT), interpolation=cv2.INTER_AREA)
+    success, png = cv2.imencode(".png", image)
+    if not success:
+        return None
+    return "data:image/png;base64," + base64.b64encode(png.tobytes()).decode()
@@ -0,0 +1,428 @@
+"""
+Reading of split (multiple database files) and compressed bags using multiple threads.
+
+rosbags.rosbag2.Reader reads the database files of a bag one after another, decompressing each file (or message) in
+the reading thread. ParallelReader reads up to ROSBAG_READER_THREADS files at once: each file is read by a producer
+thread, which decompresses it (compression mode "file", see DecompressionCache) or its messages (mode "message") and
+passes chunks of messages through a bounded queue. The chunks of all files are merged in timestamp order, files are
+only waited for once the merge reaches their start time (from metadata.yaml), later files are prefetched in the
+background. zstd decompression and SQLite release the GIL, so threads are sufficient.
+
+Memory use is bounded by the queues: at most PREFETCH_CHUNKS chunks of about CHUNK_BYTES per file being read.
+"""
+import atexit
+import bisect
+import contextlib
+import os
+import queue
+import shutil
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+import rosbags.rosbag2 as rb
+import zstandard
+
+import rosbagsApp.settings
+
+# Messages are passed from producer threads in chunks of at most CHUNK_MESSAGES messages or about CHUNK_BYTES bytes.
+# The first chunk of a file holds FIRST_CHUNK_MESSAGES, the size doubles with every chunk (reading only the first
+# messages, e.g. seeking, stays cheap)
+FIRST_CHUNK_MESSAGES = 1
+CHUNK_MESSAGES = 1024
+CHUNK_BYTES = 1024 * 1024
+# Chunks buffered per file
+PREFETCH_CHUNKS = 2
+# Rows fetched from SQLite at once while filling a chunk
+FETCH_SIZE = 64
+# Decompressed files are kept in a directory per process below this directory, so the files of killed processes can be
+# deleted by others (see DecompressionCache.remove_stale)
+DECOMPRESSION_ROOT = Path(tempfile.gettempdir()) / "rosbag_decompressed"
+
+
+class _CacheEntry:
+    def __init__(self):
+        self.path: Optional[Path] = None
+        self.size = 0
+        self.users = 0
+        self.ready = threading.Event()
+        self.error: Optional[Exception] = None
+
+
+class DecompressionCache:
+    """
+    Decompressed database files (compression mode "file"), kept in a temporary directory up to `max_bytes`. Least
+    recently used files are deleted once they are not in use, so repeated reads of a bag (e.g. seeking, or generating
+    thumbnails and statistics) decompress it only once.
+
+    The temporary directory is created in the directory of the process (see process_directory). Files of processes
+    killed before clearing their cache are deleted by remove_stale.
+    """
+    _shared: Optional["DecompressionCache"] = None
+    _shared_pid: Optional[int] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple[str, int, int], _CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._directory: Optional[Path] = None
+
+    @classmethod
+    def shared(cls) -> "DecompressionCache":
+        """
+        Cache of this process, limited to ROSBAG_DECOMPRESSION_CACHE_SIZE. Forked processes (thumbnail jobs) get their
+        own cache, which they should clear before exiting (atexit handlers are not run by multiprocessing).
+        """
+        with cls._shared_lock:
+            if cls._shared is None or cls._shared_pid != os.getpid():
+                cls.remove_stale()
+                cls._shared = DecompressionCache(rosbagsApp.settings.ROSBAG_DECOMPRESSION_CACHE_SIZE)
+                cls._shared_pid = os.getpid()
+            return cls._shared
+
+    @classmethod
+    def clear_shared(cls):
+        """Delete the decompressed files of the cache of this process"""
+        with cls._shared_lock:
+            cache = cls._shared if cls._shared_pid == os.getpid() else None
+        if cache is not None:
+            cache.clear()
+            with contextlib.suppress(OSError):
+                # Only removed if empty, i.e. no other cache of this process holds files
+                cls.process_directory(os.getpid()).rmdir()
+
+    @staticmethod
+    def process_directory(pid: int) -> Path:
+        """Directory of the decompressed files of the caches of a process"""
+        return DECOMPRESSION_ROOT / str(pid)
+
+    @classmethod
+    def remove_process_files(cls, pid: int):
+        """Delete the decompressed files of a process which has exited"""
+        shutil.rmtree(cls.process_directory(pid), ignore_errors=True)
+
+    @classmethod
+    def remove_stale(cls):
+        """Delete the decompressed files of all processes which have exited (e.g. killed thumbnail jobs)"""
+        try:
+            directories = list(DECOMPRESSION_ROOT.iterdir())
+        except OSError:
+            return
+        for directory in directories:
+            if not directory.name.isdigit():
+                continue
+            try:
+                os.kill(int(directory.name), 0)
+            except ProcessLookupError:
+                cls.remove_process_files(int(directory.name))
+            except OSError:
+                # Running, but owned by another user
+                pass
+
+    @contextlib.contextmanager
+    def open(self, path: Path) -> Iterator[Path]:
+        """
+        Decompressed copy of a zstd compressed database file, which is kept while the context is active
+        :raises rb.ReaderError: File not readable
+        """
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            raise rb.ReaderError(f"Could not read {path}: {e}")
+        key = (str(path), st.st_mtime_ns, st.st_size)
+        with self._lock:
+            entry = self._entries.get(key)
+            created = entry is None
+            if created:
+                entry = self._entries[key] = _CacheEntry()
+            self._entries.move_to_end(key)
+            entry.users += 1
+
+        try:
+            if created:
+                self._decompress(path, entry)
+            entry.ready.wait()
+            if entry.error is not None:
+                raise rb.ReaderError(f"Could not decompress {path}: {entry.error}")
+            yield entry.path
+        finally:
+            with self._lock:
+                entry.users -= 1
+                if entry.error is not None and self._entries.get(key) is entry:
+                    del self._entries[key]
+                self._evict()
+
+    def _decompress(self, path: Path, entry: _CacheEntry):
+        try:
+            with self._lock:
+                if self._directory is None:
+                    parent = self.process_directory(os.getpid())
+                    parent.mkdir(parents=True, exist_ok=True)
+                    self._directory = Path(tempfile.mkdtemp(dir=parent))
+                directory = self._directory
+            fd, target = tempfile.mkstemp(suffix=".db3", dir=directory)
+            with open(path, "rb") as infile, os.fdopen(fd, "wb") as outfile:
+                zstandard.ZstdDecompressor().copy_stream(infile, outfile)
+            entry.path = Path(target)
+            entry.size = entry.path.stat().st_size
+        except (OSError, zstandard.ZstdError) as e:
+            entry.error = e
+        finally:
+            entry.ready.set()
+
+    def _evict(self):
+        """Delete least recently used files not in use until the cache fits (called with the lock held)"""
+        total = sum(entry.size for entry in self._entries.values())
+        for key, entry in list(self._entries.items()):
+            if total <= self.max_bytes:
+                break
+            if entry.users == 0 and entry.ready.is_set():
+                del self._entries[key]
+                total -= entry.size
+                if entry.path is not None:
+                    entry.path.unlink(missing_ok=True)
+
+    def clear(self):
+        """Delete all files not in use"""
+        with self._lock:
+            max_bytes, self.max_bytes = self.max_bytes, 0
+            self._evict()
+            self.max_bytes = max_bytes
+            if len(self._entries) == 0 and self._directory is not None:
+                shutil.rmtree(self._directory, ignore_errors=True)
+                self._directory = None
+
+
+atexit.register(DecompressionCache.clear_shared)
+
+
+@contextlib.contextmanager
+def decompressed(path: Path, file_compression: bool) -> Iterator[Path]:
+    """
+    Like rosbags.rosbag2.reader.decompress, but keeping decompressed files in the shared DecompressionCache
+    :raises rb.ReaderError: File not readable
+    """
+    if not file_compression:
+        yield path
+        return
+    with DecompressionCache.shared().open(path) as db_path:
+        yield db_path
+
+
+class _Chunk:
+    __slots__ = ("timestamps", "messages")
+
+    def __init__(self, timestamps: list[int], messages: list[tuple[rb.reader.Connection, int, bytes]]):
+        self.timestamps = timestamps
+        self.messages = messages
+
+
+class _FileStream:
+    """Messages of one database file, read by a producer thread"""
+
+    def __init__(self, path: Path, start_time: Optional[int]):
+        self.path = path
+        self.start_time = start_time  # None if unknown (metadata.yaml before version 5)
+        self.queue: queue.Queue = queue.Queue(PREFETCH_CHUNKS)
+        self.thread: Optional[threading.Thread] = None
+        self.chunk: Optional[_Chunk] = None
+        self.exhausted = False
+
+    def start(self, reader: "ParallelReader", query: str, args: list, topics: dict[str, rb.reader.Connection],
+              cancelled: threading.Event):
+        self.thread = threading.Thread(target=self._produce, args=(reader, query, args, topics, cancelled),
+                                       name=f"ParallelReader {self.path.name}", daemon=True)
+        self.thread.start()
+
+    def _put(self, item, cancelled: threading.Event) -> bool:
+        while not cancelled.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self, reader: "ParallelReader", query: str, args: list, topics: dict[str, rb.reader.Connection],
+                 cancelled: threading.Event):
+        try:
+            with contextlib.ExitStack() as stack:
+                db_path = stack.enter_context(decompressed(self.path, reader.compression_mode == "file"))
+                connection = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?immutable=1", uri=True)
+                stack.callback(connection.close)
+                connmap = {topic_id: topics[name]
+                           for name, topic_id in connection.execute("SELECT name, id FROM topics") if name in topics}
+                if len(connmap) == 0:
+                    self._put(None, cancelled)
+                    return
+                decompress = zstandard.ZstdDecompressor().decompress if reader.compression_mode == "message" else None
+                cursor = connection.execute(query.format(ids=",".join("?" * len(connmap))), list(connmap) + args)
+                timestamps, messages, size = [], [], 0
+                chunk_messages = FIRST_CHUNK_MESSAGES
+                while rows := cursor.fetchmany(min(FETCH_SIZE, chunk_messages)):
+                    for topic_id, timestamp, data in rows:
+                        if decompress is not None:
+                            data = decompress(data)
+                        timestamps.append(timestamp)
+                        messages.append((connmap[topic_id], timestamp, data))
+                        size += len(data)
+                    if len(messages) >= chunk_messages or size >= CHUNK_BYTES:
+                        if not self._put(_Chunk(timestamps, messages), cancelled):
+                            return
+                        timestamps, messages, size = [], [], 0
+                        chunk_messages = min(2 * chunk_messages, CHUNK_MESSAGES)
+                if len(messages) > 0 and not self._put(_Chunk(timestamps, messages), cancelled):
+                    return
+                self._put(None, cancelled)
+        except (sqlite3.Error, zstandard.ZstdError) as e:
+            self._put(rb.ReaderError(f"Could not read {self.path}: {e}"), cancelled)
+        except Exception as e:
+            # Raised by the consuming thread, which would wait forever otherwise
+            self._put(e, cancelled)
+
+    def next_chunk(self):
+        """Wait for the next chunk, sets `exhausted` at the end of the file"""
+        item = self.queue.get()
+        if isinstance(item, Exception):
+            raise item
+        self.chunk = item
+        self.exhausted = item is None
+
+
+class ParallelReader:
+    """
+    Reader of a bag reading its database files in parallel, with the interface of rosbags.rosbag2.Reader used for
+    reading messages (connections, start_time, end_time, compression_mode, messages)
+    """
+
+    def __init__(self, path: Path | str, threads: Optional[int] = None):
+        """
+        :param threads: Number of files read at once, defaults to ROSBAG_READER_THREADS
+        :raises rb.ReaderError: Bag not readable
+        """
+        self._reader = rb.Reader(path)
+        self.path = self._reader.path
+        self.threads = max(1, threads or rosbagsApp.settings.ROSBAG_READER_THREADS)
+
+    def __enter__(self) -> "ParallelReader":
+        self._reader.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._reader.close()
+
+    @property
+    def connections(self) -> list[rb.reader.Connection]:
+        return self._reader.connections
+
+    @property
+    def paths(self) -> list[Path]:
+        return self._reader.paths
+
+    @property
+    def compression_mode(self) -> Optional[str]:
+        return self._reader.compression_mode
+
+    @property
+    def start_time(self) -> int:
+        return self._reader.start_time
+
+    @property
+    def end_time(self) -> int:
+        return self._reader.end_time
+
+    def _file_streams(self, start: Optional[int], stop: Optional[int]) -> list[_FileStream]:
+        """Streams of all files which may contain messages within [start, stop), ordered by their start time"""
+        files = {Path(f["path"]).name: f for f in self._reader.files}
+        streams = []
+        for path in self.paths:
+            info = files.get(path.name)
+            if info is None:
+                streams.append(_FileStream(path, None))
+                continue
+            first = info["starting_time"]["nanoseconds_since_epoch"]
+            last = first + info["duration"]["nanoseconds"]
+            if (stop is None or first < stop) and (start is None or last >= start):
+                streams.append(_FileStream(path, first))
+        # Files with unknown start time are needed immediately
+        return sorted(streams, key=lambda s: -2 ** 63 if s.start_time is None else s.start_time)
+
+    def message_chunks(self, connections: Iterable[rb.reader.Connection] = (), start: Optional[int] = None,
+                       stop: Optional[int] = None) -> Iterator[list[tuple[rb.reader.Connection, int, bytes]]]:
+        """
+        Messages like rosbags.rosbag2.Reader.messages, in lists of consecutive messages (cheaper to process in batches)
+        """
+        topics = {c.topic: c for c in (list(connections) or self.connections)}
+        query = "SELECT topic_id, timestamp, data FROM messages WHERE topic_id IN ({ids})"
+        args = []
+        if start is not None:
+            query += " AND timestamp >= ?"
+            args.append(start)
+        if stop is not None:
+            query += " AND timestamp < ?"
+            args.append(stop)
+        query += " ORDER BY timestamp"
+
+        pending = self._file_streams(start, stop)
+        active: list[_FileStream] = []
+        cancelled = threading.Event()
+        consumed = False
+
+        try:
+            while True:
+                # Files needed by the merge (active) are always read. Once messages have been consumed (not only the
+                # first message is read, like when seeking), the next files are prefetched while fewer than `threads`
+                # files are read
+                reading = len(active) + sum(1 for s in pending if s.thread is not None)
+                for stream in pending:
+                    if reading >= self.threads or not consumed:
+                        break
+                    if stream.thread is None:
+                        stream.start(self, query, args, topics, cancelled)
+                        reading += 1
+                for stream in active:
+                    if stream.thread is None:
+                        stream.start(self, query, args, topics, cancelled)
+                for stream in active:
+                    if stream.chunk is None and not stream.exhausted:
+                        stream.next_chunk()
+                active = [s for s in active if not s.exhausted]
+                bound = pending[0].start_time if pending else None
+                if bound is None and pending:
+                    bound = -2 ** 63
+                heads = [s.chunk.timestamps[0] for s in active]
+                if pending and (len(active) == 0 or min(heads) >= bound):
+                    # The merge reached the start of the next file
+                    active.append(pending.pop(0))
+                    continue
+                if len(active) == 0:
+                    return
+
+                i = min(range(len(active)), key=heads.__getitem__)
+                stream = active[i]
+                others = [h for j, h in enumerate(heads) if j != i] + ([bound] if pending else [])
+                limit = min(others, default=None)
+                chunk = stream.chunk
+                consumed = True
+                if limit is None or chunk.timestamps[-1] <= limit:
+                    stream.chunk = None
+                    yield chunk.messages
+                else:
+                    k = bisect.bisect_right(chunk.timestamps, limit)
+                    stream.chunk = _Chunk(chunk.timestamps[k:], chunk.messages[k:])
+                    yield chunk.messages[:k]
+        finally:
+            cancelled.set()
+
+    def messages(self, connections: Iterable[rb.reader.Connection] = (), start: Optional[int] = None,
+                 stop: Optional[int] = None) -> Iterator[tuple[rb.reader.Connection, int, bytes]]:
+        """
+        Messages of the given connections (all if empty) within [start, stop) in timestamp order, like
+        rosbags.rosbag2.Reader.messages
+        """
+        for chunk in self.message_chunks(connections, start, stop):
+            yield from chunk
@@ -0,0 +1,271 @@
+"""
+Pool of open bags for random access to single messages (e.g. inspecting messages while scrubbing through a bag).
+
+rosbags.rosbag2.Reader opens (and for file compressed bags decompresses) every database for each call of messages().
+An OpenBag keeps the metadata and one SQLite connection per database open, file compressed databases are decompressed
+once (kept in the DecompressionCache while the bag is open). Open bags are shared by all requests of a process and
+closed when they have not been used for ROSBAG_READER_POOL_IDLE_TIMEOUT seconds (by a timer, also if no further request
+arrives), or when more than ROSBAG_READER_POOL_SIZE bags are open (least recently used first).
+
+Messages are looked up through a per-topic index of timestamps and message ids (16 bytes per message), read on the
+first lookup of a topic and kept with the open bag. Lookups by index or timestamp are then a binary search and a
+primary key query, instead of counting or skipping all earlier messages of the topic. Opening a bag does not read the
+messages, the number of messages of each topic is taken from metadata.yaml.
+"""
+import contextlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Generator, Optional
+
+import numpy as np
+import rosbags.rosbag2 as rb
+import zstandard
+
+import rosbagsApp.settings
+from rosbagsApp.bag_storage.catalog import file_mtime
+from rosbagsApp.bag_storage.parallel_reader import decompressed
+from rosbagsApp.instrumentation import cache_lookup, span
+
+logger = logging.getLogger(__name__)
+
+
+class OpenBag:
+    """Bag whose databases are kept open, for looking up messages of a topic by index or timestamp"""
+
+    def __init__(self, path: Path):
+        """:raises rb.ReaderError: Bag not readable"""
+        self.path = path
+        self.metadata_mtime = file_mtime(path / "metadata.yaml")
+        self._stack = contextlib.ExitStack()
+        try:
+            reader = self._stack.enter_context(rb.Reader(path))
+            self.connections = {c.topic: c for c in reader.connections}
+            self._msgcounts: dict[str, int] = {}
+            for c in reader.connections:
+                self._msgcounts[c.topic] = self._msgcounts.get(c.topic, 0) + c.msgcount
+            self._decompress = zstandard.ZstdDecompressor().decompress \
+                if reader.compression_mode == "message" else None
+            # Per database: connection, topic name -> topic id
+            self._databases: list[tuple[sqlite3.Connection, dict[str, int]]] = []
+            for storage_path in reader.paths:
+                db_path = self._stack.enter_context(decompressed(storage_path, reader.compression_mode == "file"))
+                # Used by one request at a time (see ReaderPool.open), but not necessarily from the same thread
+                db = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?immutable=1", uri=True,
+                                     check_same_thread=False)
+                self._stack.callback(db.close)
+                topic_ids = {name: topic_id for topic_id, name in db.execute("SELECT id, name FROM topics")}
+                self._databases.append((db, topic_ids))
+        except sqlite3.Error as e:
+            self._stack.close()
+            raise rb.ReaderError(f"Cannot read database of {path}: {e}")
+        except Exception:
+            self._stack.close()
+            raise
+        # (database, topic id) -> timestamps and ids of the messages of the topic, sorted by (timestamp, id)
+        self._topic_indexes: dict[tuple[int, int], tuple[np.ndarray, np.ndarray]] = {}
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.evicted = False  # Removed from the pool while in use, closed once released
+        self.closed = False
+
+    def close(self):
+        self._stack.close()
+        self.closed = True
+
+    def msgcount(self, topic: str) -> int:
+        """Number of messages of a topic according to metadata.yaml"""
+        return self._msgcounts.get(topic, 0)
+
+    def messages_at_index(self, topic: str, index: int, count: int = 1) -> list[tuple[int, int, bytes]]:
+        """
+        Messages of a topic by their index (in order of timestamps)
+        :return: Up to count messages as (index, timestamp, rawdata), starting at index
+        """
+        messages = []
+        first_index = 0  # Index of the first message of the topic in the current database
+        for i, (db, topic_ids) in enumerate(self._databases):
+            if len(messages) >= count:
+                break
+            db_count = self._count(i, topic_ids.get(topic))
+            if index + len(messages) < first_index + db_count:
+                start = index + len(messages) - first_index
+                _, ids = self._topic_index(i, topic_ids[topic])
+                ids = ids[start:start + count - len(messages)].tolist()
+                rows = {message_id: (timestamp, data) for message_id, timestamp, data in db.execute(
+                    f"SELECT id, timestamp, data FROM messages WHERE id IN ({','.join('?' * len(ids))})", ids)}
+                messages += [(index + len(messages) + k, *rows[message_id]) for k, message_id in enumerate(ids)]
+            first_index += db_count
+        return [(message_index, timestamp, self._payload(data)) for message_index, timestamp, data in messages]
+
+    def nearest_index(self, topic: str, timestamp: int) -> Optional[int]:
+        """Index of the message of a topic with the timestamp closest to the given one, None if there is none"""
+        # Last message before and first message at or after the timestamp
+        before = None
+        after = None
+        first_index = 0
+        for i, (db, topic_ids) in enumerate(self._databases):
+            if after is not None:
+                break
+            db_count = self._count(i, topic_ids.get(topic))
+            if db_count > 0:
+                timestamps, _ = self._topic_index(i, topic_ids[topic])
+                position = int(np.searchsorted(timestamps, timestamp, side="left"))
+                if position > 0:
+                    before = (first_index + position - 1, int(timestamps[position - 1]))
+                if position < db_count:
+                    after = (first_index + position, int(timestamps[position]))
+            first_index += db_count
+        candidates = [c for c in (before, after) if c is not None]
+        if len(candidates) == 0:
+            return None
+        return min(candidates, key=lambda c: abs(c[1] - timestamp))[0]
+
+    def _count(self, database: int, topic_id: Optional[int]) -> int:
+        """Number of messages of a topic in a database (0 if the topic is not contained)"""
+        return 0 if topic_id is None else len(self._topic_index(database, topic_id)[0])
+
+    def _topic_index(self, database: int, topic_id: int) -> tuple[np.ndarray, np.ndarray]:
+        """Timestamps and ids of the messages of a topic in a database, sorted by (timestamp, id)"""
+        index = self._topic_indexes.get((database, topic_id))
+        if index is None:
+            with span("topic_index"):
+                rows = np.array(self._databases[database][0].execute(
+                    "SELECT timestamp, id FROM messages WHERE topic_id = ? ORDER BY timestamp, id",
+                    (topic_id,)).fetchall(), dtype=np.int64).reshape(-1, 2)
+            index = self._topic_indexes[(database, topic_id)] = (rows[:, 0].copy(), rows[:, 1].copy())
+        return index
+
+    def _payload(self, data: bytes) -> bytes:
+        return self._decompress(data) if self._decompress is not None else data
+
+
+class ReaderPool:
+    """LRU pool of OpenBags, one pool per process"""
+
+    _pool: Optional['ReaderPool'] = None
+    _pool_lock = threading.Lock()
+
+    def __init__(self, size: int, idle_timeout: float):
+        """
+        :param size: Maximum number of open bags
+        :param idle_timeout: Seconds after which unused bags are closed
+        """
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._bags: OrderedDict[Path, OpenBag] = OrderedDict()
+        self._lock = threading.Lock()
+        # Closes idle bags (see _schedule_eviction)
+        self._timer: Optional[threading.Timer] = None
+
+    @staticmethod
+    def shared() -> 'ReaderPool':
+        """Pool shared by all requests of the process, configured by the ROSBAG_READER_POOL_* settings"""
+        with ReaderPool._pool_lock:
+            if ReaderPool._pool is None:
+                ReaderPool._pool = ReaderPool(rosbagsApp.settings.ROSBAG_READER_POOL_SIZE,
+                                              rosbagsApp.settings.ROSBAG_READER_POOL_IDLE_TIMEOUT)
+            return ReaderPool._pool
+
+    def __len__(self):
+        return len(self._bags)
+
+    @contextlib.contextmanager
+    def open(self, path: Path) -> Generator[OpenBag, None, None]:
+        """
+        Open bag (from the pool if possible), for exclusive use within the context
+        :raises rb.ReaderError: Bag not readable
+        """
+        while True:
+            bag = self._get(path)
+            with bag.lock:
+                if bag.closed:
+                    # Evicted after it has been taken from the pool
+                    continue
+                bag.last_used = time.monotonic()
+                try:
+                    yield bag
+                finally:
+                    bag.last_used = time.monotonic()
+                    if bag.evicted:
+                        bag.close()
+            with self._lock:
+                self._schedule_eviction()
+            return
+
+    def _get(self, path: Path) -> OpenBag:
+        with self._lock:
+            self._evict_idle()
+            bag = self._bags.get(path)
+            if bag is not None and bag.metadata_mtime != file_mtime(path / "metadata.yaml"):
+                # Bag has been rewritten
+                self._close(path)
+                bag = None
+            cache_lookup("reader_pool", bag is not None)
+            if bag is not None:
+                self._bags.move_to_end(path)
+                return bag
+
+        # Opened without holding the pool lock, decompressing file compressed bags takes long
+        with span("open_bag"):
+            bag = OpenBag(path)
+        with self._lock:
+            if path in self._bags:
+                # Opened concurrently by another request
+                self._close(path)
+            self._bags[path] = bag
+            self._evict_lru()
+            self._schedule_eviction()
+        return bag
+
+    def clear(self):
+        """Close all bags"""
+        with self._lock:
+            for path in list(self._bags):
+                self._close(path)
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        for path, bag in list(self._bags.items()):
+            # Bags in use are not idle, their timeout starts when they are released
+            if now - bag.last_used >= self.idle_timeout and not bag.lock.locked():
+                self._close(path)
+
+    def _schedule_eviction(self):
+        """
+        Start a timer closing the bags which will be idle first, so their databases and decompressed files are released
+        also if no further request arrives (called with the lock held)
+        """
+        unused = [bag.last_used for bag in self._bags.values() if not bag.lock.locked()]
+        if self._timer is not None or len(unused) == 0:
+            # Bags in use schedule the timer when they are released
+            return
+        expiry = min(unused) + self.idle_timeout
+        self._timer = threading.Timer(max(0.0, expiry - time.monotonic()), self._evict_scheduled)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _evict_scheduled(self):
+        with self._lock:
+            self._timer = None
+            self._evict_idle()
+            self._schedule_eviction()
+
+    def _evict_lru(self):
+        while len(self._bags) > self.size:
+            self._close(next(iter(self._bags)))
+
+    def _close(self, path: Path):
+        """Remove a bag from the pool, it is closed once it is not in use anymore"""
+        bag = self._bags.pop(path)
+        if bag.lock.acquire(blocking=False):
+            try:
+                bag.close()
+            finally:
+                bag.lock.release()
+        else:
+            bag.evicted = True
+        logger.debug("Evicted %s from reader pool", path)
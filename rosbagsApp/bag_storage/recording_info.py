@@ -0,0 +1,69 @@
+from dataclasses import dataclass
+from pathlib import Path
+
+import rosbags.rosbag2 as rb
+from ruamel.yaml import YAML
+from ruamel.yaml.error import YAMLError
+
+# Constructing the loader is not free, so it is shared (uses the C implementation if ruamel.yaml.clib is available)
+_yaml = YAML(typ='safe')
+
+
+@dataclass(frozen=True)
+class RecordingInfo:
+    """
+    Recording metadata of a ROS bag (metadata.yaml) which is required for displaying the bag: start time, duration and
+    recorded topics. Kept together so it can be loaded (and cached) at once.
+    """
+    start_time: int  # Nanoseconds since epoch
+    duration: int  # Nanoseconds
+    topics: tuple[tuple[str, str, int], ...]  # (topic, msgtype, msgcount) per connection
+
+    @staticmethod
+    def from_metadata_file(path: Path) -> 'RecordingInfo':
+        """
+        Load recording info by parsing metadata.yaml once.
+        In contrast to opening a rosbags Reader, this does not check (or touch) the storage files, which is slow on
+        network mounts. Values are interpreted like rosbags.rosbag2.Reader does.
+        :param path: Bag directory
+        :raises rb.ReaderError: metadata.yaml could not be read
+        """
+        yaml_path = path / "metadata.yaml"
+        try:
+            dct = _yaml.load(yaml_path.read_text())
+        except OSError as e:
+            raise rb.ReaderError(f"Could not read metadata at {yaml_path}: {e}") from None
+        except YAMLError as e:
+            raise rb.ReaderError(f"Could not load YAML from {yaml_path}: {e}") from None
+
+        try:
+            metadata = dct["rosbag2_bagfile_information"]
+            message_count = metadata["message_count"]
+            if message_count > 0:
+                start_time = metadata["starting_time"]["nanoseconds_since_epoch"]
+                duration = metadata["duration"]["nanoseconds"] + 1
+            else:
+                start_time = 2 ** 63 - 1
+                duration = 0
+            topics = tuple((t["topic_metadata"]["name"], t["topic_metadata"]["type"], t["message_count"])
+                           for t in metadata["topics_with_message_count"])
+        except (KeyError, TypeError) as e:
+            raise rb.ReaderError(f"Invalid metadata in {path}: {e!r}") from None
+
+        return RecordingInfo(start_time, duration, topics)
+
+    @staticmethod
+    def from_reader(path: Path) -> 'RecordingInfo':
+        """
+        Load recording info using a single rosbags Reader, which also verifies that all storage files exist
+        :raises rb.ReaderError: metadata.yaml could not be read
+        """
+        try:
+            reader = rb.Reader(path)
+        except TypeError as e:
+            # rosbags does not check the structure of metadata.yaml before accessing it (e.g. if it is empty)
+            raise rb.ReaderError(f"Invalid metadata in {path}: {e}") from None
+
+        with reader:
+            return RecordingInfo(reader.start_time, reader.duration,
+                                 tuple((c.topic, c.msgtype, c.msgcount) for c in reader.connections))
@@ -0,0 +1,165 @@
+import enum
+import os
+import stat
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+from rosbagsApp.bag_storage.additional_metadata import additional_metadata_file_name
+from rosbagsApp.instrumentation import count
+
+
+class BagEventType(enum.Enum):
+    ADDED = "added"
+    REMOVED = "removed"
+    CHANGED = "changed"  # metadata.yaml or additional_metadata.json modified
+
+
+@dataclass(frozen=True)
+class BagEvent:
+    type: BagEventType
+    rel_path: Path
+
+
+@dataclass
+class _Directory:
+    mtime: int
+    is_bag: bool
+    # Subdirectories (relative to storage), only for directories which are not bags
+    children: list[Path] = field(default_factory=list)
+
+
+# Directories modified less than this long before they were listed might be modified again without changing their
+# mtime (limited timestamp resolution), so they are listed again on the next scan (see "racy git" problem).
+_RACY_INTERVAL_NS = 2 * 1000000000
+
+
+def _mtime(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class StorageScanner:
+    """
+    Keeps track of the bags in a storage directory without walking the whole tree on every scan.
+
+    The mtime of a directory changes whenever an entry is added to, removed from or renamed within it. The scanner
+    remembers the mtime and subdirectories of every directory, and only lists directories whose mtime changed.
+    Bags are additionally checked for modified metadata.yaml and additional_metadata.json (which are usually modified
+    in place and therefore do not change the mtime of the bag directory).
+    A rescan of an unchanged storage thus costs one stat per directory and two per bag.
+
+    inotify is deliberately not used: the storage is usually a network mount, where changes made by other hosts are
+    not reported.
+    """
+
+    _scanners: dict[Path, 'StorageScanner'] = {}
+    _scanners_lock = threading.Lock()
+
+    def __init__(self, base_path: Path):
+        self.base_path = base_path
+        # Paths are joined as strings, pathlib's overhead exceeds the cost of the stat calls on local storage
+        self._base = str(base_path)
+        self._directories: dict[Path, _Directory] = {}
+        # Bag path -> (mtime of metadata.yaml, mtime of additional_metadata.json)
+        self._bags: dict[Path, tuple[int, Optional[int]]] = {}
+        self._lock = threading.Lock()
+        # Held from a scan until its events are applied (see BagStorage.refresh), so concurrent refreshes apply the
+        # events in order and do not write the catalog at the same time
+        self.refresh_lock = threading.Lock()
+
+    @staticmethod
+    def for_storage(base_path: Path) -> 'StorageScanner':
+        """Scanner shared by all BagStorage instances (of one process) for the same directory"""
+        with StorageScanner._scanners_lock:
+            scanner = StorageScanner._scanners.get(base_path)
+            if scanner is None:
+                scanner = StorageScanner(base_path)
+                StorageScanner._scanners[base_path] = scanner
+            return scanner
+
+    @property
+    def bags(self) -> list[Path]:
+        """Paths (relative to storage) of all bags found by the last scan"""
+        return list(self._bags.keys())
+
+    def scan(self) -> list[BagEvent]:
+        """
+        Update the known state of the storage
+        :return: Changes since the last scan. The first scan reports all bags as added.
+        """
+        events = []
+        with self._lock:
+            self._scan_directory(Path("."), events)
+        return events
+
+    def _scan_directory(self, rel_path: Path, events: list[BagEvent]):
+        path = os.path.join(self._base, rel_path)
+        try:
+            st = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            st = None
+        if st is None or not stat.S_ISDIR(st.st_mode):
+            self._forget(rel_path, events)
+            return
+        mtime = st.st_mtime_ns
+
+        directory = self._directories.get(rel_path)
+        if directory is None or directory.mtime != mtime:
+            # The storage root itself is never treated as a bag
+            is_bag = rel_path != Path(".") and os.path.exists(os.path.join(path, "metadata.yaml"))
+            children = []
+            if not is_bag:
+                children = [rel_path / entry.name for entry in os.scandir(path) if entry.is_dir()]
+
+            if directory is not None:
+                for child in set(directory.children).difference(children):
+                    self._forget(child, events)
+                if directory.is_bag and not is_bag:
+                    self._forget_bag(rel_path, events)
+
+            if time.time_ns() - mtime < _RACY_INTERVAL_NS:
+                mtime = -1
+            directory = _Directory(mtime, is_bag, children)
+            self._directories[rel_path] = directory
+
+        if directory.is_bag:
+            self._check_bag(rel_path, events)
+        for child in directory.children:
+            self._scan_directory(child, events)
+
+    def _check_bag(self, rel_path: Path, events: list[BagEvent]):
+        count("bags_scanned")
+        path = os.path.join(self._base, rel_path)
+        mtimes = (_mtime(os.path.join(path, "metadata.yaml")),
+                  _mtime(os.path.join(path, additional_metadata_file_name)))
+        if mtimes[0] is None:
+            # metadata.yaml removed since the directory was listed, the directory is checked again next scan
+            del self._directories[rel_path]
+            self._forget_bag(rel_path, events)
+            return
+
+        previous = self._bags.get(rel_path)
+        if previous is None:
+            events.append(BagEvent(BagEventType.ADDED, rel_path))
+        elif previous != mtimes:
+            events.append(BagEvent(BagEventType.CHANGED, rel_path))
+        self._bags[rel_path] = mtimes
+
+    def _forget_bag(self, rel_path: Path, events: list[BagEvent]):
+        if self._bags.pop(rel_path, None) is not None:
+            events.append(BagEvent(BagEventType.REMOVED, rel_path))
+
+    def _forget(self, rel_path: Path, events: list[BagEvent]):
+        """Forget a directory and everything below it"""
+        directory = self._directories.pop(rel_path, None)
+        if directory is None:
+            return
+        if directory.is_bag:
+            self._forget_bag(rel_path, events)
+        for child in directory.children:
+            self._forget(child, events)
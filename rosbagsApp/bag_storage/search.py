@@ -0,0 +1,110 @@
+"""
+Full-text search over the catalog, using an SQLite FTS5 table (created by migration 0004_catalog_search) which contains
+one row per CatalogEntry (rowid = entry id). Rows are written when an entry is (re)loaded and removed by a trigger
+when the entry is deleted.
+
+With other database backends the search index is not available, search_entries then falls back to substring matching.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q, QuerySet
+
+from rosbagsApp.models import CatalogEntry
+
+SEARCH_TABLE = "rosbagsApp_catalogsearch"
+SEARCH_COLUMNS = ["name", "description", "hardware", "location", "tags", "topics"]
+# bm25 weight of each column (same order as SEARCH_COLUMNS), matches in the name and tags rank highest
+SEARCH_WEIGHTS = [10.0, 2.0, 3.0, 3.0, 5.0, 1.0]
+
+# Anything but letters and digits separates tokens (same as the unicode61 tokenizer)
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def search_available() -> bool:
+    return connection.vendor == "sqlite"
+
+
+def create_search_table(schema_editor):
+    """Create the FTS5 table and the trigger removing rows of deleted entries (called by migrations)"""
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    schema_editor.execute(f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5({', '.join(SEARCH_COLUMNS)}, "
+                          f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+    schema_editor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rank) "
+                          f"VALUES('rank', 'bm25({', '.join(str(w) for w in SEARCH_WEIGHTS)})')")
+    schema_editor.execute(f"CREATE TRIGGER {SEARCH_TABLE}_delete AFTER DELETE ON rosbagsApp_catalogentry BEGIN "
+                          f"DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id; END")
+
+
+def drop_search_table(schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    schema_editor.execute(f"DROP TRIGGER IF EXISTS {SEARCH_TABLE}_delete")
+    schema_editor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+def index_entry(entry: CatalogEntry, tags: list[str]):
+    """Add or replace the search index row of an entry"""
+    if not search_available():
+        return
+    description = (entry.additional_metadata or {}).get("description") or ""
+    topics = " ".join(f"{topic} {msgtype}" for topic, msgtype, _ in entry.topics)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [entry.id])
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE}(rowid, {', '.join(SEARCH_COLUMNS)}) "
+                       f"VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                       [entry.id, entry.name, description, entry.hardware or "", entry.location or "", " ".join(tags),
+                        topics])
+
+
+def fts_query(query: str) -> str | None:
+    """
+    FTS5 query matching entries which contain all words of query, the last word as prefix (search as you type)
+    :return: None if the query does not contain any words
+    """
+    tokens = _TOKEN_PATTERN.findall(query)
+    if len(tokens) == 0:
+        return None
+    # Quoted, FTS5 syntax (operators, column filters) in the user input is not interpreted
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += "*"
+    return " AND ".join(terms)
+
+
+def search_entries(entries: QuerySet, query: str, limit: int) -> list[tuple[CatalogEntry, float]]:
+    """
+    Entries matching the query, best matches first
+    :param entries: Entries to search in
+    :return: Entries with their rank (lower is better)
+    """
+    match = fts_query(query)
+    if match is None:
+        return []
+    if not search_available():
+        q = query.strip()
+        matching = entries.filter(Q(name__icontains=q) | Q(additional_metadata__description__icontains=q) |
+                                  Q(hardware__icontains=q) | Q(location__icontains=q) |
+                                  Q(catalog_tags__tag__icontains=q) | Q(catalog_topics__name__icontains=q))
+        return [(e, 0.0) for e in matching.distinct().order_by("-recording_date", "id")[:limit]]
+
+    ranked = entries.extra(
+        tables=[SEARCH_TABLE],
+        where=[f"{SEARCH_TABLE}.rowid = rosbagsApp_catalogentry.id", f"{SEARCH_TABLE} MATCH %s"],
+        params=[match],
+        select={"search_rank": f"{SEARCH_TABLE}.rank"},
+        order_by=["search_rank"],
+    )[:limit]
+    return [(e, e.search_rank) for e in ranked]
+
+
+def matching_entries(entries: QuerySet, query: str) -> QuerySet:
+    """Filter entries by query, without ranking (e.g. for the bag list, which has its own sort order)"""
+    match = fts_query(query)
+    if match is None:
+        return entries
+    if not search_available():
+        q = query.strip()
+        return entries.filter(Q(name__icontains=q) | Q(additional_metadata__description__icontains=q))
+    return entries.extra(where=[f"rosbagsApp_catalogentry.id IN (SELECT rowid FROM {SEARCH_TABLE} "
+                                f"WHERE {SEARCH_TABLE} MATCH %s)"], params=[match])
@@ -1,15 +1,29 @@
 import datetime
+import logging
 import os
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional, Generator
+from typing import Callable, Optional, Generator
 
 import rosbags.rosbag2 as rb
 from django.utils.functional import cached_property
 
 import rosbagsApp.settings
 from rosbagsApp.bag_storage.additional_metadata import AdditionalMetadata, additional_metadata_file_name
-from rosbagsApp.bag_storage.thumbnails import create_thumbnail_spatz, create_thumbnail_image
+from rosbagsApp.bag_storage.catalog import BagCatalog, file_mtime
+from rosbagsApp.bag_storage.index import AmbiguousBagName, BagIndex
+from rosbagsApp.bag_storage.parallel_reader import ParallelReader
+from rosbagsApp.bag_storage.recording_info import RecordingInfo
+from rosbagsApp.bag_storage.scanner import StorageScanner
+from rosbagsApp.bag_storage.thumbnail_registry import thumbnail_generator
+from rosbagsApp.bag_storage.thumbnails import PREVIEW_VIDEO_VARIANT, is_generated_name, make_content_addressed, \
+    thumbnail_variant
+from rosbagsApp.bag_storage.topic_statistics import TopicStatistics, compute_topic_statistics, \
+    load_topic_statistics, store_topic_statistics
+from rosbagsApp.instrumentation import cache_lookup, span
+from rosbagsApp.models import CatalogEntry
+
+logger = logging.getLogger(__name__)
 
 
 def is_rosbag(path: Path):
@@ -32,25 +46,48 @@ class TopicRecordingInfo:
 class ROSBag:
     """
     ROS bag, providing access to metadata (metadata.yaml) and additional metadata (additional_metadata.json).
-    Metadata is loaded lazily and cached, additional metadata is loaded on construction.
-
-    TODO: not lazily load stuff? We probably need most of the data most of the time?
-     Would opening the reader only once be faster?
+    Metadata is loaded lazily (all at once, see RecordingInfo) and cached, additional metadata is loaded on
+    construction. Both can be provided on construction instead, e.g. from the BagCatalog.
     """
 
-    def __init__(self, base_path: Path, rel_path: Path):
+    def __init__(self, base_path: Path, rel_path: Path, metadata: AdditionalMetadata | None = None,
+                 recording_info: RecordingInfo | None = None, load_error: str | None = None):
+        """
+        :param metadata: Additional metadata, read from additional_metadata.json if not given
+        :param recording_info: Recording metadata, read from metadata.yaml on first access if not given
+        :param load_error: Reason why the bag is already known to be unreadable
+        """
         self._base_path = base_path
         self._rel_path = rel_path
+        self._recording_info = recording_info
+        self._load_error = load_error
 
-        assert (is_rosbag(self.path))
         # Bag name: last part of path (dir name)
         self._name: str = str(rel_path.name)
 
-        metadata_path = os.path.join(self.path, additional_metadata_file_name)
-        if os.path.exists(metadata_path):
-            self.metadata = AdditionalMetadata.from_file(Path(metadata_path))
+        if metadata is None:
+            assert (is_rosbag(self.path))
+            metadata_path = os.path.join(self.path, additional_metadata_file_name)
+            if os.path.exists(metadata_path):
+                metadata = AdditionalMetadata.from_file(Path(metadata_path))
+            else:
+                metadata = AdditionalMetadata.default()
+        self.metadata = metadata
+
+    @staticmethod
+    def from_catalog(base_path: Path, entry: CatalogEntry) -> 'ROSBag':
+        """Construct bag from catalog entry, without accessing the bag directory"""
+        if entry.additional_metadata is not None:
+            # Already validated when the entry was created
+            metadata = AdditionalMetadata.from_dict(entry.additional_metadata, validate_schema=False)
         else:
-            self.metadata = AdditionalMetadata.default()
+            metadata = AdditionalMetadata.default()
+
+        recording_info = None
+        if entry.start_time is not None:
+            recording_info = RecordingInfo(entry.start_time, entry.duration, tuple(tuple(t) for t in entry.topics))
+
+        return ROSBag(base_path, Path(entry.rel_path), metadata, recording_info, entry.error)
 
     @property
     def name(self):
@@ -73,6 +110,33 @@ class ROSBag:
         return f"ROSBag{{{self.name} at {self.path}, recorded at {self.recording_date} for {self.duration}," \
                f" topics: {self.topics}}}"
 
+    @property
+    def recording_info(self) -> RecordingInfo:
+        """
+        Contents of metadata.yaml
+        :raises rb.ReaderError: Bag is not readable
+        """
+        if self._recording_info is None:
+            if self._load_error is not None:
+                raise rb.ReaderError(self._load_error)
+            try:
+                with span("metadata_yaml"):
+                    self._recording_info = RecordingInfo.from_metadata_file(self.path)
+            except rb.ReaderError as e:
+                self._load_error = str(e)
+                raise
+        return self._recording_info
+
+    @property
+    def load_error(self) -> str | None:
+        """Reason why the bag (or its additional metadata) could not be loaded, None for valid bags"""
+        if self._load_error is None:
+            try:
+                _ = self.recording_info
+            except rb.ReaderError:
+                pass
+        return self._load_error
+
     @cached_property
     def recording_date(self) -> datetime.datetime:
         """Date and time of recording start"""
@@ -85,8 +149,7 @@ class ROSBag:
         if self.metadata.recording_time is not None:
             return self.metadata.recording_time
 
-        with rb.Reader(self.path) as reader:
-            return datetime.datetime.fromtimestamp(reader.start_time // 1000000000, tz=datetime.timezone.utc)
+        return datetime.datetime.fromtimestamp(self.recording_info.start_time // 1000000000, tz=datetime.timezone.utc)
 
     @cached_property
     def is_simulation_time(self) -> bool:
@@ -100,17 +163,15 @@ class ROSBag:
 
     @cached_property
     def duration(self) -> datetime.timedelta:
-        with rb.Reader(self.path) as reader:
-            return datetime.timedelta(microseconds=reader.duration // 1000)
+        return datetime.timedelta(microseconds=self.recording_info.duration // 1000)
 
     @cached_property
     def topics(self) -> list[TopicRecordingInfo]:
         """List (name, type) of topics in bag"""
         topics = []
-        with rb.Reader(self.path) as reader:
-            for connection in reader.connections:
-                thumbs = self.metadata.thumbnails.get(connection.topic, set())
-                topics.append(TopicRecordingInfo(connection.topic, connection.msgtype, thumbs, connection.msgcount))
+        for topic, msgtype, msgcount in self.recording_info.topics:
+            thumbs = self.metadata.thumbnails.get(topic, set())
+            topics.append(TopicRecordingInfo(topic, msgtype, thumbs, msgcount))
         return topics
 
     @property
@@ -127,26 +188,139 @@ class ROSBag:
         """Available thumbnails as specified in metadata"""
         return self.metadata.thumbnails
 
-    def generate_thumbnails(self):
-        thumbnails = {}
-        with rb.Reader(self.path) as reader:
-            for connection in reader.connections:
-                if connection.msgtype == "spatz_interfaces/msg/Spatz":
-                    thumbnails[connection.topic] = create_thumbnail_spatz(self.path, reader, connection)
-                elif connection.msgtype == "sensor_msgs/msg/Image":
-                    thumbnails[connection.topic] = create_thumbnail_image(self.path, reader, connection)
-
-        for topic, thumbs in thumbnails.items():
-            if len(self.metadata.thumbnails) == 0:
-                self.metadata.thumbnails = {topic: thumbs}
-            else:
-                md_thumbs = self.metadata.thumbnails.get(topic, set())
-                md_thumbs.update(thumbs)
-                self.metadata.thumbnails[topic] = md_thumbs
+    def thumbnails_of_variant(self, variant: str) -> dict[str, list[str]]:
+        """
+        Thumbnails to display for each topic: those of the given size variant (see IMAGE_THUMBNAIL_SIZES), or all
+        thumbnails without variant if a topic has none of this variant
+        """
+        result = {}
+        for topic, thumbs in self.metadata.thumbnails.items():
+            selected = [t for t in thumbs if thumbnail_variant(t) == variant]
+            if len(selected) == 0:
+                selected = [t for t in thumbs if thumbnail_variant(t) is None]
+            if len(selected) > 0:
+                result[topic] = sorted(selected)
+        return result
+
+    def preview_videos(self) -> dict[str, list[str]]:
+        """Preview videos of each topic which has one"""
+        result = {}
+        for topic, thumbs in self.metadata.thumbnails.items():
+            selected = [t for t in thumbs if thumbnail_variant(t) == PREVIEW_VIDEO_VARIANT]
+            if len(selected) > 0:
+                result[topic] = sorted(selected)
+        return result
+
+    def list_thumbnails(self) -> dict[str, list[str]]:
+        """Thumbnails for the bag list"""
+        return self.thumbnails_of_variant("small")
+
+    def detail_thumbnails(self) -> dict[str, list[str]]:
+        """Thumbnails for the detail view"""
+        return self.thumbnails_of_variant("large")
+
+    def generate_thumbnails(self, progress: Callable[[float], None] | None = None):
+        """
+        Generate thumbnails for all topics with a registered generator (see thumbnail_registry) and add them to the
+        additional metadata. A topic whose generator fails is logged and recorded in the additional metadata, it is
+        only retried by another version of the generator (see thumbnails_outdated).
+        The additional metadata is written after each topic, so it never lists files replaced by a generator.
+        :param progress: Called with the fraction of processed topics after each topic
+        """
+        with ParallelReader(self.path) as reader:
+            for i, connection in enumerate(reader.connections):
+                generator = thumbnail_generator(connection.msgtype)
+                if generator is not None:
+                    try:
+                        thumbs = generator.generate(self.path, reader, connection)
+                    except Exception:
+                        logger.exception("Generating thumbnails of %s in %s failed", connection.topic, self.path)
+                        self.metadata.thumbnail_failures[connection.topic] = generator.version
+                        self._write_metadata()
+                    else:
+                        self._replace_thumbnails(connection.topic, thumbs, generator.version)
+                if progress is not None:
+                    progress((i + 1) / len(reader.connections))
+
+    def _replace_thumbnails(self, topic: str, generated: set[str], version: int):
+        """
+        Rename generated thumbnails to their content addressed names and replace the thumbnails of a previous
+        generation (e.g. of another version, or named before content hashes were used) by them, in the additional
+        metadata and on disk. Thumbnails not created by a generator are kept.
+        """
+        thumbs = {make_content_addressed(self.path / "thumbnails", thumb) for thumb in generated}
+        md_thumbs = self.metadata.thumbnails.get(topic, set())
+        stale = [t for t in md_thumbs if self._generated(topic, t) and t not in thumbs]
+        for thumb in stale:
+            md_thumbs.discard(thumb)
+            self.metadata.thumbnail_versions.pop(thumb, None)
+        md_thumbs.update(thumbs)
+        self.metadata.thumbnails[topic] = md_thumbs
+        for thumb in thumbs:
+            self.metadata.thumbnail_versions[thumb] = version
+        self.metadata.thumbnail_failures.pop(topic, None)
+        self._write_metadata()
+        # Deleted once they are not listed anymore
+        for thumb in stale:
+            (self.path / "thumbnails" / thumb).unlink(missing_ok=True)
+
+    def _write_metadata(self):
+        """Write the additional metadata to additional_metadata.json (replaced at once)"""
+        path = self.path / additional_metadata_file_name
+        temporary = path.with_name(f".{additional_metadata_file_name}.tmp")
+        temporary.write_text(self.metadata.to_json())
+        os.replace(temporary, path)
+
+    def _generated(self, topic: str, thumb_name: str) -> bool:
+        """Whether a thumbnail of a topic has been created by a generator (of any version)"""
+        return thumb_name in self.metadata.thumbnail_versions or is_generated_name(topic, thumb_name)
+
+    def storage_files(self) -> list[Path]:
+        """Database files (message data) of the bag"""
+        return [p for p in self.path.iterdir() if p.suffix in (".db3", ".zstd")]
+
+    def thumbnails_outdated(self) -> bool:
+        """
+        Whether generated thumbnails are missing for a supported topic, are older than the bag contents, or have been
+        created by an outdated generator. Thumbnails not created by a generator are not checked.
+        """
+        thumb_dir = self.path / "thumbnails"
+        data_mtime = max(os.stat(p).st_mtime_ns for p in self.storage_files() + [self.path / "metadata.yaml"])
+        for topic in self.topics:
+            generator = thumbnail_generator(topic.type)
+            if generator is None:
+                continue
+            version = generator.version
+            generated = [t for t in topic.thumbnails if self._generated(topic.name, t)]
+            if len(generated) == 0:
+                if self.metadata.thumbnail_failures.get(topic.name) == version:
+                    # Failed with this generator version before
+                    continue
+                return True
+            for thumb in generated:
+                if self.metadata.thumbnail_versions.get(thumb) != version:
+                    return True
+                try:
+                    if os.stat(thumb_dir / thumb).st_mtime_ns < data_mtime:
+                        return True
+                except FileNotFoundError:
+                    return True
+        return False
+
+    def topic_statistics(self) -> Optional[dict[str, TopicStatistics]]:
+        """Timing statistics of each topic, None if not computed yet or outdated"""
+        return load_topic_statistics(self.path)
+
+    def update_topic_statistics(self):
+        """Compute timing statistics of all topics (from message timestamps and sizes) and store them in the bag"""
+        with span("topic_statistics"):
+            statistics = compute_topic_statistics(self.path)
+        store_topic_statistics(self.path, statistics)
 
-        json_dump = self.metadata.to_json()
-        with open(os.path.join(self.path, additional_metadata_file_name), 'w') as file:
-            file.write(json_dump)
+    def topics_with_statistics(self) -> list[tuple[TopicRecordingInfo, Optional[TopicStatistics]]]:
+        """Topics with their timing statistics (None if not available)"""
+        statistics = self.topic_statistics() or {}
+        return [(topic, statistics.get(topic.name)) for topic in self.topics]
 
     def json(self) -> dict:
         """Dict representation for serializing to json, intended for displaying in frontend -> used by JS"""
@@ -157,17 +331,9 @@ class ROSBag:
                 "duration": str(self.duration),
                 "tags": self.tags,
                 "path": str(self.rel_path),
-                "description": self.description}
-
-
-def rosbag_iter_impl(base_path: Path, current_subdir: Path) -> Generator[ROSBag, None, None]:
-    for entry in os.scandir(base_path / current_subdir):
-        if entry.is_dir():
-            if is_rosbag(Path(entry.path)):
-                yield ROSBag(base_path, current_subdir / entry.name)
-            else:
-                for b in rosbag_iter_impl(base_path, current_subdir / Path(entry.name)):
-                    yield b
+                "description": self.description,
+                "thumbnails": [{"topic": topic, "name": thumb}
+                               for topic, thumbs in self.list_thumbnails().items() for thumb in thumbs]}
 
 
 class BagStorage:
@@ -175,18 +341,39 @@ class BagStorage:
     Class representing a directory containing ROS bags, allowing iteration and lookup by name
     """
 
-    def __init__(self, path: str = rosbagsApp.settings.ROSBAG_STORAGE_PATH):
+    def __init__(self, path: str | None = None):
         """
         :param path: Directory containing ROS bags. Defaults to configured path from ROSBAG_STORAGE_PATH setting
         """
+        if path is None:
+            # Looked up on construction, so the setting can be changed at runtime (e.g. by tests and benchmarks)
+            path = rosbagsApp.settings.ROSBAG_STORAGE_PATH
         self.base_path: Path = Path(path).resolve()
+        self.catalog = BagCatalog(self.base_path)
+        self.scanner = StorageScanner.for_storage(self.base_path)
+        self.index = BagIndex.for_storage(self.base_path)
+
+    def refresh(self):
+        """
+        Rescan the directory for changes and update the catalog and index accordingly. Concurrent refreshes of the
+        same storage (within a process) wait for each other.
+        """
+        with self.scanner.refresh_lock:
+            with span("scan"):
+                events = self.scanner.scan()
+            bags = self.scanner.bags
+            with span("catalog"):
+                self.catalog.update(events, bags)
+            self.index.update(events, bags)
 
     def __iter__(self) -> Generator[ROSBag, None, None]:
         """
-        Iterating over the BagStorage yields all bags in configured directory
+        Iterating over the BagStorage yields all bags in configured directory.
+        The directory is rescanned for changes and bag contents are read from the (updated) catalog.
         """
-        for b in rosbag_iter_impl(self.base_path, Path(".")):
-            yield b
+        self.refresh()
+        for entry in self.catalog.entries().order_by("rel_path"):
+            yield ROSBag.from_catalog(self.base_path, entry)
 
     def find_by_path(self, path: Path) -> Optional[ROSBag]:
         """
@@ -194,23 +381,42 @@ class BagStorage:
         :param path: relative to BagStorage
         :return:
         """
+        rel_path = Path(os.path.normpath(path))
         abs_path = (self.base_path / path).resolve()
         if Path(os.path.commonpath([abs_path, self.base_path])) != self.base_path:
-            # Path must be below the base path, to prevent accessing outside directories
+            # Path must be below the base path, to prevent accessing outside directories. Also checked for bags found
+            # by the scanner, which follows symlinks.
             return None
 
-        if not is_rosbag(abs_path):
-            return None
-        return ROSBag(self.base_path, path)
+        bag_path = self.base_path / rel_path
+        mtimes = (file_mtime(bag_path / "metadata.yaml"), file_mtime(bag_path / additional_metadata_file_name))
+        entry = self.index.cached_entry(rel_path, mtimes)
+        cache_lookup("bag_index", entry is not None)
+        if entry is None:
+            entry = self.catalog.get(rel_path)
+            if entry is None:
+                return None
+            self.index.cache_entry(rel_path, (entry.metadata_mtime, entry.additional_metadata_mtime), entry)
+        # A new bag for every lookup, bags are mutable (e.g. by generate_thumbnails) and not shared between requests
+        return ROSBag.from_catalog(self.base_path, entry)
 
     def find_by_name(self, name: str) -> Optional[ROSBag]:
         """
         Lookup ROS bag by name
         :param name: Name of the ROS bag (directory)
         :return: ROS bag with specified name, or None if not found
+        :raises AmbiguousBagName: Multiple bags (in different subdirectories) have the name
         """
-
-        for b in self.__iter__():
-            if b.name == name:
-                return b
+        paths = self.index.paths(name)
+        if not self.index.built or len(paths) == 0:
+            # Bag might have been added since the last scan
+            self.refresh()
+            paths = self.index.paths(name)
+
+        if len(paths) > 1:
+            raise AmbiguousBagName(name, paths)
+        for path in paths:
+            bag = self.find_by_path(path)
+            if bag is not None:
+                return bag
         return None
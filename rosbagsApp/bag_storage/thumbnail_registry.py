@@ -0,0 +1,150 @@
+"""
+Registry of thumbnail generators by message type, used by ROSBag.generate_thumbnails.
+
+The generators of rosbagsApp.bag_storage.thumbnails are built in. Generators for further (e.g. custom) message types
+are registered with register_thumbnail_generator in modules listed in the ROSBAG_THUMBNAIL_GENERATORS setting, which
+are imported once per process when a generator is first looked up. A later registration for the same message type
+replaces the earlier one, so built-in generators can be overridden.
+
+Each generator declares
+
+- a version: thumbnails created by another version are regenerated (see ROSBag.thumbnails_outdated)
+- the definitions of the message types it deserializes, registered once per process before it is first used
+- a budget of messages, bytes or seconds per topic: once one is exhausted, the reader passed to the generator stops
+  returning messages, so the thumbnail shows only the beginning of a huge topic instead of stalling the whole bag
+"""
+import importlib
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Optional
+
+import rosbags.rosbag2 as rb
+from rosbags.typesys import get_types_from_msg, register_types, types
+
+import rosbagsApp.settings
+from rosbagsApp.instrumentation import span
+
+logger = logging.getLogger(__name__)
+
+# Imported before the modules of ROSBAG_THUMBNAIL_GENERATORS
+BUILTIN_GENERATORS_MODULE = "rosbagsApp.bag_storage.thumbnails"
+
+_types_lock = threading.Lock()
+
+
+def register_message_types(definitions: dict[str, str]):
+    """
+    Register message types which are not registered yet (i.e. once per process)
+    :param definitions: Message type -> message definition (.msg)
+    """
+    with _types_lock:
+        missing = {msgtype: msgdef for msgtype, msgdef in definitions.items() if msgtype not in types.FIELDDEFS}
+        if len(missing) == 0:
+            return
+        parsed = {}
+        for msgtype, msgdef in missing.items():
+            parsed.update(get_types_from_msg(msgdef, msgtype))
+        register_types(parsed)
+
+
+@dataclass(frozen=True)
+class ThumbnailBudget:
+    """Limits of the messages a generator reads from one topic, None is unlimited"""
+    max_messages: Optional[int] = None
+    max_bytes: Optional[int] = None
+    max_seconds: Optional[float] = None
+
+
+class BudgetedReader:
+    """
+    Reader passed to a generator: like the wrapped reader, but messages() stops returning messages once the budget is
+    exhausted (across all calls)
+    """
+
+    def __init__(self, reader, budget: ThumbnailBudget):
+        self._reader = reader
+        self._budget = budget
+        self._deadline = time.monotonic() + budget.max_seconds if budget.max_seconds is not None else None
+        self.messages_read = 0
+        self.bytes_read = 0
+        self.exhausted = False
+
+    def __getattr__(self, name):
+        return getattr(self._reader, name)
+
+    def messages(self, *args, **kwargs):
+        messages = self._reader.messages(*args, **kwargs)
+        try:
+            for message in messages:
+                self.exhausted = self.exhausted or self._exceeded()
+                if self.exhausted:
+                    return
+                self.messages_read += 1
+                self.bytes_read += len(message[2])
+                yield message
+        finally:
+            messages.close()
+
+    def _exceeded(self) -> bool:
+        budget = self._budget
+        return (budget.max_messages is not None and self.messages_read >= budget.max_messages) \
+            or (budget.max_bytes is not None and self.bytes_read >= budget.max_bytes) \
+            or (self._deadline is not None and time.monotonic() >= self._deadline)
+
+
+@dataclass(frozen=True)
+class ThumbnailGenerator:
+    msgtype: str
+    name: str  # Used for the instrumentation span "thumbnail_<name>"
+    # Creates the thumbnails of a topic in <bag directory>/thumbnails, :return: Their file names
+    create: Callable[[Path, BudgetedReader, rb.reader.Connection], set[str]]
+    version: int
+    budget: ThumbnailBudget
+    message_definitions: dict[str, str] = field(default_factory=dict)
+
+    def generate(self, bag_dir: Path, reader, connection: rb.reader.Connection) -> set[str]:
+        """Create the thumbnails of a topic within the budget, :return: File names of the thumbnails"""
+        register_message_types(self.message_definitions)
+        budgeted = BudgetedReader(reader, self.budget)
+        with span(f"thumbnail_{self.name}"):
+            thumbnails = self.create(bag_dir, budgeted, connection)
+        if budgeted.exhausted:
+            logger.info("Thumbnails of %s in %s created from the first %d messages (%d bytes), budget exhausted",
+                        connection.topic, bag_dir, budgeted.messages_read, budgeted.bytes_read)
+        return thumbnails
+
+
+# Message type -> generator
+THUMBNAIL_GENERATORS: dict[str, ThumbnailGenerator] = {}
+_loaded = False
+_load_lock = threading.RLock()
+
+
+def register_thumbnail_generator(msgtype: str, name: str, version: int, budget: ThumbnailBudget,
+                                 message_definitions: Optional[dict[str, str]] = None):
+    """
+    Decorator registering a function as thumbnail generator of a message type, see ThumbnailGenerator
+    :param version: Increment when the output changes, so existing thumbnails are regenerated
+    :param message_definitions: Message type -> message definition, of types which are not built into rosbags
+    """
+
+    def register(create):
+        THUMBNAIL_GENERATORS[msgtype] = ThumbnailGenerator(msgtype, name, create, version, budget,
+                                                           dict(message_definitions or {}))
+        return create
+
+    return register
+
+
+def thumbnail_generator(msgtype: str) -> Optional[ThumbnailGenerator]:
+    """Generator of a message type, None if thumbnails are not supported"""
+    global _loaded
+    with _load_lock:
+        if not _loaded:
+            for module in [BUILTIN_GENERATORS_MODULE] + list(rosbagsApp.settings.ROSBAG_THUMBNAIL_GENERATORS):
+                importlib.import_module(module)
+            _loaded = True
+    return THUMBNAIL_GENERATORS.get(msgtype)
@@ -1,3 +1,6 @@
+import hashlib
+import os
+import re
 from pathlib import Path
 
 import cv2
@@ -7,86 +10,183 @@ import numpy as np
 import rosbags.rosbag2 as rb
 from django.utils.text import slugify
 from rosbags.serde import deserialize_cdr
-from rosbags.typesys import get_types_from_msg, register_types
-from rosbags.typesys.types import sensor_msgs__msg__Image as Image
+from rosbags.typesys.types import sensor_msgs__msg__CompressedImage as CompressedImage, \
+    sensor_msgs__msg__Image as Image
 
+from rosbagsApp.bag_storage.cdr import FieldDecoder
+from rosbagsApp.bag_storage.images import IMAGE_MSGTYPES, message_to_bgr
+from rosbagsApp.bag_storage.thumbnail_registry import ThumbnailBudget, register_message_types, \
+    register_thumbnail_generator
+from rosbagsApp.instrumentation import span
 
-def ros_encoding_to_opencv(ros_encoding: str):
-    if ros_encoding == "bayer_rggb8":
-        return cv2.COLOR_BAYER_RGGB2BGR
-    else:
-        raise NotImplementedError(f"OpenCV conversion for {ros_encoding} not specified")
+# Budgets of the built-in generators per topic (see thumbnail_registry). The filmstrip of an image topic only reads a
+# few frames, the preview video reads all of them.
+IMAGE_THUMBNAIL_BUDGET = ThumbnailBudget(max_bytes=8 * 1024 * 1024 * 1024, max_seconds=5 * 60)
+SPATZ_THUMBNAIL_BUDGET = ThumbnailBudget(max_bytes=1024 * 1024 * 1024, max_seconds=60)
 
+# Image topics are previewed by a strip of frames sampled over the whole recording, which is generated in multiple
+# sizes: "small" for the bag list, "large" for the detail view. Sizes are the height of a frame in pixels.
+IMAGE_THUMBNAIL_FRAMES = 8
+IMAGE_THUMBNAIL_SIZES = {"small": 48, "large": 240}
+IMAGE_THUMBNAIL_FORMAT = "webp"
+IMAGE_THUMBNAIL_ENCODE_PARAMS = [cv2.IMWRITE_WEBP_QUALITY, 80]
 
-def create_thumbnail_image(bag_dir: Path, reader: rb.Reader, connection: rb.reader.Connection) -> set[str]:
-    assert (connection.msgtype == Image.__msgtype__)
-    (_, timestamp, rawdata) = next(reader.messages([connection]))
-    msg: Image = deserialize_cdr(rawdata, connection.msgtype)
-
-    data = np.reshape(msg.data, (msg.height, msg.width))
-    color = cv2.cvtColor(data, ros_encoding_to_opencv(msg.encoding))
-
-    thumb_name = slugify(connection.topic) + ".png"
-    thumb_dir = bag_dir / "thumbnails"
-    thumb_dir.mkdir(exist_ok=True)
-
-    success = cv2.imwrite(str(thumb_dir / thumb_name), color)
-    if not success:
-        raise RuntimeError("Writing image using OpenCV failed.")
-    return {thumb_name}
-
+# Image topics additionally get a low resolution preview video (variant "preview") for the detail view. VP8/WebM is
+# played by all browsers and supported by the FFmpeg backend of OpenCV's VideoWriter (H.264 encoders are usually not).
+PREVIEW_VIDEO_VARIANT = "preview"
+PREVIEW_VIDEO_FPS = 5
+PREVIEW_VIDEO_HEIGHT = 240
+PREVIEW_VIDEO_FORMAT = "webm"
+PREVIEW_VIDEO_FOURCC = "VP80"
 
-def create_thumbnail_spatz(bag_dir: Path, reader: rb.Reader, connection: rb.reader.Connection) -> set[str]:
-    """
-    This is just an example of how thumbnail generation might work.
-    TODO: We still have to figure out how (if) we want to provide custom message types and thumbnail generators.
-    (https://github.com/teamspatzenhirn/rosbagBrowser/issues/6)
-    The next step however will be to implement this for well known, useful types (like sensor_msgs/Image, which is
-    implemented above).
+# Number of hex digits of the content hash in thumbnail names
+CONTENT_HASH_LENGTH = 16
 
-    :return: List of filenames of generated thumbnails
-    """
-    assert (connection.msgtype == "spatz_interfaces/msg/Spatz")
-    register_types(get_types_from_msg("""
+# Definitions of the custom Spatz message types, which are not contained in the bags
+SPATZ_MESSAGE_DEFINITIONS = {
+    "spatz_interfaces/msg/SystemParams": """
             float64 width
             float64 length
             float64 origin_x
             float64 track_length
             float64 track_width
             float64 mass
-            
+
             float64 max_steering_angle
-            
+
             float64 dist_cog_to_front_axle
             float64 dist_cog_to_rear_axle
             float64 dist_cam_origin_x
-            """, "spatz_interfaces/msg/SystemParams"))
-
-    register_types(get_types_from_msg("""
+            """,
+    "spatz_interfaces/msg/Spatz": """
             std_msgs/Header header
-            
+
             geometry_msgs/Point pose # x, y, psi (yaw angle in rad)
             geometry_msgs/Point velocity # x, y velocity in global coordinates
             geometry_msgs/Point acceleration # acceleration (in vehicle coordinates) without gravity
             float64 d_psi # angular velocity
-            
+
             # Sensors
             float64 laser_front
             float64 steer_angle_front # estimated steering angle of the front axle in rad (left is positive)
             float64 steer_angle_rear # estimated steering angle of the rear axle in rad (left is positive)
-            
+
             bool light_switch_rear
-            
+
             float64 integrated_distance
-            
+
             SystemParams system_params
-            """, "spatz_interfaces/msg/Spatz"))
-    xs = np.zeros((connection.msgcount,))
-    ys = np.zeros((connection.msgcount,))
-    for i, (_, timestamp, rawdata) in enumerate(reader.messages([connection])):
+            """,
+}
+
+
+def register_spatz_types():
+    """Register the Spatz message types (once per process)"""
+    register_message_types(SPATZ_MESSAGE_DEFINITIONS)
+
+
+def thumbnail_variant(thumb_name: str) -> str | None:
+    """
+    Variant of a thumbnail: size (key of IMAGE_THUMBNAIL_SIZES) or PREVIEW_VIDEO_VARIANT, None if there is only one
+    size
+    """
+    # Topic slugs never contain a dot, variants are named <slug>.<variant>[.<hash>].<extension>
+    return next((part for part in thumb_name.split(".")[1:-1]
+                 if part in IMAGE_THUMBNAIL_SIZES or part == PREVIEW_VIDEO_VARIANT), None)
+
+
+def is_content_addressed(thumb_name: str) -> bool:
+    """Whether the name of a thumbnail contains the hash of its contents, i.e. the file never changes"""
+    parts = thumb_name.split(".")
+    return len(parts) >= 3 and re.fullmatch(f"[0-9a-f]{{{CONTENT_HASH_LENGTH}}}", parts[-2]) is not None
+
+
+def is_generated_name(topic: str, thumb_name: str) -> bool:
+    """
+    Whether a thumbnail is named like those generated for a topic (<slug>[.<variant>][.<hash>].<extension>), including
+    thumbnails generated before versions and content hashes were recorded
+    """
+    return thumb_name.split(".")[0] == slugify(topic)
+
+
+def make_content_addressed(thumb_dir: Path, thumb_name: str) -> str:
+    """
+    Rename a generated thumbnail to <name>.<hash>.<extension>, so it can be cached by browsers indefinitely
+    :return: New name
+    """
+    path = thumb_dir / thumb_name
+    digest = hashlib.sha256(path.read_bytes()).hexdigest()[:CONTENT_HASH_LENGTH]
+    new_name = f"{path.stem}.{digest}{path.suffix}"
+    os.replace(path, thumb_dir / new_name)
+    return new_name
+
+
+def sample_frames(reader: rb.Reader, connection: rb.reader.Connection, count: int) -> list[tuple[int, bytes]]:
+    """
+    First message of each of `count` equally long intervals of the recording (fewer if an interval contains no
+    message). Messages are looked up by timestamp, the messages in between are not read.
+    :return: List of (timestamp, rawdata)
+    """
+    start = reader.start_time
+    duration = reader.end_time - start
+    bounds = [start + duration * i // count for i in range(count + 1)]
+    frames = []
+    for i in range(count):
+        messages = reader.messages([connection], start=bounds[i], stop=bounds[i + 1])
+        try:
+            message = next(messages, None)
+        finally:
+            messages.close()
+        if message is not None:
+            frames.append((message[1], message[2]))
+    return frames
+
+
+def create_thumbnail_image(bag_dir: Path, reader: rb.Reader, connection: rb.reader.Connection) -> set[str]:
+    """
+    Filmstrip of IMAGE_THUMBNAIL_FRAMES frames sampled evenly over the recording, in all IMAGE_THUMBNAIL_SIZES.
+    Compressed images are decoded at the lowest resolution sufficient for the largest size.
+    :return: List of filenames of generated thumbnails
+    """
+    assert (connection.msgtype in IMAGE_MSGTYPES)
+    frames = []
+    for _, rawdata in sample_frames(reader, connection, min(IMAGE_THUMBNAIL_FRAMES, connection.msgcount)):
         msg = deserialize_cdr(rawdata, connection.msgtype)
-        xs[i] = float(msg.header.stamp.sec) + float(msg.header.stamp.nanosec * 1e-9)
-        ys[i] = msg.pose.x
+        frames.append(message_to_bgr(msg, min_height=max(IMAGE_THUMBNAIL_SIZES.values())))
+    if len(frames) == 0:
+        return set()
+
+    thumb_dir = bag_dir / "thumbnails"
+    thumb_dir.mkdir(exist_ok=True)
+    thumb_names = set()
+    height, width = frames[0].shape[:2]
+    # Largest size first, smaller sizes are downscaled from the previous one (cheaper than from full resolution)
+    for variant, frame_height in sorted(IMAGE_THUMBNAIL_SIZES.items(), key=lambda item: -item[1]):
+        size = (max(1, round(width * frame_height / height)), frame_height)
+        frames = [cv2.resize(frame, size, interpolation=cv2.INTER_AREA) for frame in frames]
+        thumb_name = f"{slugify(connection.topic)}.{variant}.{IMAGE_THUMBNAIL_FORMAT}"
+        success = cv2.imwrite(str(thumb_dir / thumb_name), np.hstack(frames), IMAGE_THUMBNAIL_ENCODE_PARAMS)
+        if not success:
+            raise RuntimeError("Writing image using OpenCV failed.")
+        thumb_names.add(thumb_name)
+    return thumb_names
+
+
+@register_thumbnail_generator("spatz_interfaces/msg/Spatz", "spatz", version=1, budget=SPATZ_THUMBNAIL_BUDGET,
+                              message_definitions=SPATZ_MESSAGE_DEFINITIONS)
+def create_thumbnail_spatz(bag_dir: Path, reader: rb.Reader, connection: rb.reader.Connection) -> set[str]:
+    """
+    Plot of the x position over time. Spatz is a custom message type, its definition is registered by the registry
+    before the generator is used (generators of further custom types are registered the same way, see
+    thumbnail_registry).
+
+    :return: List of filenames of generated thumbnails
+    """
+    assert (connection.msgtype == "spatz_interfaces/msg/Spatz")
+    decoder = FieldDecoder(connection.msgtype, ["header.stamp.sec", "header.stamp.nanosec", "pose.x"])
+    fields = decoder.decode(rawdata for _, _, rawdata in reader.messages([connection]))
+    xs = fields["header.stamp.sec"].astype(np.float64) + fields["header.stamp.nanosec"] * 1e-9
+    ys = fields["pose.x"]
     matplotlib.use("Agg")
     fig: plt.Figure
     ax: plt.Axes
@@ -97,3 +197,51 @@ def create_thumbnail_spatz(bag_dir: Path, reader: rb.Reader, connection: rb.read
     thumb_name = slugify(connection.topic) + ".png"
     fig.savefig(thumb_dir / thumb_name)
     return {thumb_name}
+
+
+def create_preview_video(bag_dir: Path, reader: rb.Reader, connection: rb.reader.Connection) -> set[str]:
+    """
+    Video of all images of the topic, reduced to at most PREVIEW_VIDEO_FPS frames per second (by recording time) and
+    PREVIEW_VIDEO_HEIGHT. Images are converted and encoded one at a time, skipped images are not deserialized.
+    :return: List of filenames of generated thumbnails
+    """
+    assert (connection.msgtype in IMAGE_MSGTYPES)
+    thumb_dir = bag_dir / "thumbnails"
+    thumb_dir.mkdir(exist_ok=True)
+    thumb_name = f"{slugify(connection.topic)}.{PREVIEW_VIDEO_VARIANT}.{PREVIEW_VIDEO_FORMAT}"
+    interval = 1000000000 // PREVIEW_VIDEO_FPS
+    next_timestamp = None
+    writer = None
+    try:
+        for _, timestamp, rawdata in reader.messages([connection]):
+            if next_timestamp is not None and timestamp < next_timestamp:
+                continue
+            # Gaps in the recording are not filled, the video is shorter than the recording then
+            next_timestamp = max(next_timestamp or timestamp, timestamp - interval) + interval
+            frame = message_to_bgr(deserialize_cdr(rawdata, connection.msgtype), min_height=PREVIEW_VIDEO_HEIGHT)
+            if writer is None:
+                height, width = frame.shape[:2]
+                # Even dimensions, required by the chroma subsampling of most codecs
+                size = (max(2, round(width * PREVIEW_VIDEO_HEIGHT / height) // 2 * 2), PREVIEW_VIDEO_HEIGHT)
+                writer = cv2.VideoWriter(str(thumb_dir / thumb_name), cv2.VideoWriter_fourcc(*PREVIEW_VIDEO_FOURCC),
+                                         PREVIEW_VIDEO_FPS, size)
+                if not writer.isOpened():
+                    raise RuntimeError("Writing video using OpenCV failed.")
+            writer.write(cv2.resize(frame, size, interpolation=cv2.INTER_AREA))
+    finally:
+        if writer is not None:
+            writer.release()
+    return {thumb_name} if writer is not None else set()
+
+
+@register_thumbnail_generator(Image.__msgtype__, "image", version=3, budget=IMAGE_THUMBNAIL_BUDGET)
+@register_thumbnail_generator(CompressedImage.__msgtype__, "compressed_image", version=1,
+                              budget=IMAGE_THUMBNAIL_BUDGET)
+def create_thumbnails_image(bag_dir: Path, reader: rb.Reader, connection: rb.reader.Connection) -> set[str]:
+    """
+    Filmstrip (create_thumbnail_image) and preview video (create_preview_video) of an image topic
+    :return: List of filenames of generated thumbnails
+    """
+    thumb_names = create_thumbnail_image(bag_dir, reader, connection)
+    with span("preview_video"):
+        return thumb_names | create_preview_video(bag_dir, reader, connection)
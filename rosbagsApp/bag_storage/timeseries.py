@@ -0,0 +1,238 @@
+"""
+Downsampled time series of numeric message fields (e.g. velocity.x of a Spatz topic) for interactive plots.
+
+The values of a field are extracted in one streaming pass over the topic (vectorised, see FieldDecoder) and stored in
+the bag directory together with a min/max pyramid: level k holds the minimum and maximum (and the index of the
+message they occur at) of blocks of PYRAMID_FANOUT^(k + 1) messages. A query for a time range and a plot width picks the
+coarsest level which still has at least one block per pixel and reduces its blocks to the minimum and maximum of each
+pixel, so the cost of a query depends on the plot width, not on the number of messages in the range. Ranges with at
+most two messages per pixel are returned without downsampling.
+
+Timestamps are the receive timestamps of the bag (not header stamps), like in the messages API.
+"""
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import rosbags.rosbag2 as rb
+import zstandard
+
+from rosbagsApp.asgi import raise_if_cancelled
+from rosbagsApp.bag_storage.cdr import FieldDecoder
+from rosbagsApp.bag_storage.parallel_reader import decompressed
+from rosbagsApp.bag_storage.thumbnails import register_spatz_types
+
+timeseries_dir_name = "timeseries"
+
+# Increment when the stored format changes, existing caches are rebuilt
+TIMESERIES_VERSION = 2
+# Messages per block of the first pyramid level, and blocks of a level per block of the next level
+PYRAMID_FANOUT = 4
+# Messages decoded at once while building the cache
+BATCH_SIZE = 4096
+
+
+@dataclass(frozen=True)
+class _Level:
+    # Per block: minimum and maximum value, and the indices of the messages they occur at
+    minimum: np.ndarray
+    argmin: np.ndarray
+    maximum: np.ndarray
+    argmax: np.ndarray
+
+
+@dataclass(frozen=True)
+class Series:
+    timestamps: np.ndarray  # int64 ns
+    values: np.ndarray  # float64
+    count: int  # Number of messages in the requested range
+    downsampled: bool
+
+
+def _reduce(values: np.ndarray, indices: np.ndarray, reduce_max: bool) -> tuple[np.ndarray, np.ndarray]:
+    """Minimum (or maximum) and its index of each block of PYRAMID_FANOUT consecutive values"""
+    padding = -len(values) % PYRAMID_FANOUT
+    fill = -np.inf if reduce_max else np.inf
+    blocks = np.concatenate([values, np.full((padding,), fill)]).reshape(-1, PYRAMID_FANOUT)
+    block_indices = np.concatenate([indices, np.zeros((padding,), dtype=np.int64)]).reshape(-1, PYRAMID_FANOUT)
+    selected = (np.argmax if reduce_max else np.argmin)(blocks, axis=1)[:, None]
+    return np.take_along_axis(blocks, selected, 1)[:, 0], np.take_along_axis(block_indices, selected, 1)[:, 0]
+
+
+class TimeSeriesCache:
+    """Values of one field of a topic and their min/max pyramid"""
+
+    def __init__(self, timestamps: np.ndarray, values: np.ndarray, levels: list[_Level]):
+        self.timestamps = timestamps
+        self.values = values
+        self.levels = levels
+
+    @classmethod
+    def build(cls, timestamps: np.ndarray, values: np.ndarray) -> "TimeSeriesCache":
+        values = values.astype(np.float64)
+        # Non-finite values are never selected as minimum or maximum
+        finite = np.isfinite(values)
+        minimum, maximum = np.where(finite, values, np.inf), np.where(finite, values, -np.inf)
+        argmin = argmax = np.arange(len(values), dtype=np.int64)
+        levels = []
+        while len(minimum) > 1:
+            minimum, argmin = _reduce(minimum, argmin, False)
+            maximum, argmax = _reduce(maximum, argmax, True)
+            levels.append(_Level(minimum, argmin, maximum, argmax))
+        return cls(timestamps, values, levels)
+
+    def query(self, width: int, start: Optional[int] = None, stop: Optional[int] = None) -> Series:
+        """
+        Values within [start, stop], at most two (minimum and maximum) per pixel
+        :param width: Width of the plot in pixels
+        :param start: First timestamp (ns), defaults to the first message
+        :param stop: Last timestamp (ns), defaults to the last message
+        """
+        first = 0 if start is None else int(np.searchsorted(self.timestamps, start, "left"))
+        end = len(self.timestamps) if stop is None else int(np.searchsorted(self.timestamps, stop, "right"))
+        count = max(end - first, 0)
+        if count <= 2 * width:
+            return Series(self.timestamps[first:end], self.values[first:end], count, False)
+
+        # Coarsest level with at least one block per pixel (level k has blocks of PYRAMID_FANOUT^(k + 1) messages)
+        k = 0
+        while k + 1 < len(self.levels) and count // PYRAMID_FANOUT ** (k + 2) >= width:
+            k += 1
+        level = self.levels[k]
+        block_size = PYRAMID_FANOUT ** (k + 1)
+
+        # Pixel boundaries as block indices
+        t_start = self.timestamps[first]
+        t_stop = self.timestamps[end - 1]
+        edges = np.searchsorted(self.timestamps[first:end], np.linspace(t_start, t_stop, width + 1)[1:-1]) + first
+        first_block, end_block = first // block_size, -(-end // block_size)
+        starts = np.unique(np.concatenate([[first_block], edges // block_size]))
+        pixel = np.searchsorted(starts, np.arange(first_block, end_block), "right") - 1
+
+        blocks = slice(first_block, end_block)
+        points = []
+        # Per pixel the block with the smallest (largest) value: sort by pixel, then by value
+        for key, arg in ((level.minimum[blocks], level.argmin[blocks]), (-level.maximum[blocks], level.argmax[blocks])):
+            order = np.lexsort((key, pixel))
+            points.append(arg[order[np.flatnonzero(np.diff(pixel[order], prepend=-1))]])
+        indices = np.unique(np.concatenate(points))
+        return Series(self.timestamps[indices], self.values[indices], count, True)
+
+    def save(self, path: Path, metadata_mtime: int, topic: str, field: str):
+        arrays = {"version": TIMESERIES_VERSION, "metadata_mtime": metadata_mtime, "topic": topic, "field": field,
+                  "timestamps": self.timestamps, "values": self.values}
+        for k, level in enumerate(self.levels):
+            arrays.update({f"minimum_{k}": level.minimum, f"argmin_{k}": level.argmin,
+                           f"maximum_{k}": level.maximum, f"argmax_{k}": level.argmax})
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as file:
+            np.savez(file, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path, metadata_mtime: int, topic: str, field: str) -> Optional["TimeSeriesCache"]:
+        """:return: None if the file does not exist, is outdated or belongs to another topic or field"""
+        try:
+            with np.load(path) as stored:
+                if stored["version"] != TIMESERIES_VERSION or stored["metadata_mtime"] != metadata_mtime \
+                        or stored["topic"] != topic or stored["field"] != field:
+                    return None
+                levels = []
+                while f"minimum_{len(levels)}" in stored:
+                    k = len(levels)
+                    levels.append(_Level(stored[f"minimum_{k}"], stored[f"argmin_{k}"], stored[f"maximum_{k}"],
+                                         stored[f"argmax_{k}"]))
+                return cls(stored["timestamps"], stored["values"], levels)
+        except (OSError, ValueError, KeyError):
+            return None
+
+
+def extract_field(path: Path, topic: str, field: str) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Timestamps and values of a numeric field of all messages of a topic, read in one pass over the SQLite databases
+    (like compute_topic_statistics, reading through rosbags.rosbag2.Reader.messages is considerably slower)
+    :raises rb.ReaderError: Bag is not readable
+    :raises KeyError: Topic not contained in the bag, or message type unknown
+    :raises ValueError: Message type has no numeric field with this path
+    :raises RequestAborted: Client of the request disconnected (see raise_if_cancelled)
+    """
+    register_spatz_types()
+    with rb.Reader(path) as reader:
+        storage_paths = reader.paths
+        file_compression = reader.compression_mode == "file"
+        message_compression = reader.compression_mode == "message"
+        msgtypes = [c.msgtype for c in reader.connections if c.topic == topic]
+    if len(msgtypes) == 0:
+        raise KeyError(topic)
+    decoder = FieldDecoder(msgtypes[0], [field], BATCH_SIZE)
+    decompressor = zstandard.ZstdDecompressor() if message_compression else None
+
+    timestamps = []
+    values = []
+    # Split bags are recorded consecutively, so the messages are read in order across files
+    for storage_path in storage_paths:
+        with decompressed(storage_path, file_compression) as db_path:
+            # Opened read-only and without locking, the bag is not modified while it is in the storage
+            connection = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?immutable=1", uri=True)
+            try:
+                cursor = connection.execute(
+                    "SELECT timestamp, data FROM messages WHERE topic_id IN (SELECT id FROM topics WHERE name = ?) "
+                    "ORDER BY timestamp", (topic,))
+                while rows := cursor.fetchmany(BATCH_SIZE):
+                    # Building the cache of a long bag takes seconds, stop if the requesting client is gone
+                    raise_if_cancelled()
+                    batch_timestamps, rawdata = zip(*rows)
+                    if decompressor is not None:
+                        rawdata = [decompressor.decompress(data) for data in rawdata]
+                    timestamps.append(np.array(batch_timestamps, dtype=np.int64))
+                    values.append(decoder.decode(rawdata)[field].astype(np.float64))
+            except sqlite3.Error as e:
+                raise rb.ReaderError(f"Could not read {storage_path}: {e}")
+            finally:
+                connection.close()
+    if len(timestamps) == 0:
+        return np.zeros((0,), dtype=np.int64), np.zeros((0,), dtype=np.float64)
+    return np.concatenate(timestamps), np.concatenate(values)
+
+
+def cache_path(path: Path, topic: str, field: str) -> Path:
+    """
+    File of the cache of a field of a topic, named by a hash: topic names are case-sensitive and may contain any
+    character, and the field is a request parameter
+    """
+    digest = hashlib.sha256(json.dumps([topic, field]).encode()).hexdigest()[:32]
+    return path / timeseries_dir_name / f"{digest}.npz"
+
+
+@functools.lru_cache(maxsize=32)
+def _load_cached(file: Path, file_mtime: int, metadata_mtime: int, topic: str,
+                 field: str) -> Optional[TimeSeriesCache]:
+    # Keyed by the mtime of the file, so caches rebuilt by another process are reloaded
+    return TimeSeriesCache.load(file, metadata_mtime, topic, field)
+
+
+def timeseries(path: Path, topic: str, field: str) -> TimeSeriesCache:
+    """
+    Cache of a field of a topic, built (and stored in the bag directory) on first use or if the bag changed
+    :raises: see extract_field
+    """
+    file = cache_path(path, topic, field)
+    try:
+        metadata_mtime = os.stat(path / "metadata.yaml").st_mtime_ns
+    except OSError as e:
+        raise rb.ReaderError(f"Could not read metadata of {path}: {e}")
+    try:
+        cache = _load_cached(file, os.stat(file).st_mtime_ns, metadata_mtime, topic, field)
+    except FileNotFoundError:
+        cache = None
+    if cache is None:
+        cache = TimeSeriesCache.build(*extract_field(path, topic, field))
+        cache.save(file, metadata_mtime, topic, field)
+    return cache
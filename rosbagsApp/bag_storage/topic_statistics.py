@@ -0,0 +1,174 @@
+"""
+Per-topic timing statistics (rate, jitter, gaps, size, message density over time) of a bag.
+
+Only the topic, timestamp and payload size of each message are read from the rosbag2 SQLite databases, no payload is
+deserialized (or even read, length() of a blob only reads the record header). rosbag2 only indexes the timestamp, so
+the messages of all topics are read in a single pass in timestamp order, streamed in chunks into NumPy and split by
+topic there. Memory usage does not depend on the size of the bag.
+"""
+import json
+import os
+import sqlite3
+from dataclasses import asdict, dataclass
+from itertools import chain
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import rosbags.rosbag2 as rb
+
+from rosbagsApp.bag_storage.parallel_reader import decompressed
+
+topic_statistics_file_name = "topic_statistics.json"
+
+# Increment when the computation changes, existing statistics are recomputed
+TOPIC_STATISTICS_VERSION = 1
+# Number of bins of the message density timeline, spanning the whole recording
+DENSITY_BINS = 200
+# Number of largest gaps which are reported per topic
+REPORTED_GAPS = 5
+# Number of messages fetched from SQLite at once
+CHUNK_SIZE = 65536
+
+
+@dataclass(frozen=True)
+class TopicStatistics:
+    msgcount: int
+    bytes: int  # Sum of (serialized, possibly compressed) payload sizes
+    rate: Optional[float]  # Mean message rate in Hz, None for less than two messages
+    jitter: Optional[float]  # Standard deviation of the time between messages in s
+    max_gap: Optional[float]  # Longest time between two messages in s
+    gaps: list[tuple[int, int]]  # Largest gaps as (timestamp of the message before the gap, duration in ns)
+    density: list[int]  # Number of messages in each of DENSITY_BINS intervals of the recording
+
+    def density_points(self, height: float = 20.0) -> str:
+        """Points of an SVG polygon (width DENSITY_BINS) showing the message density"""
+        peak = max(max(self.density, default=0), 1)
+        points = [f"0,{height}"]
+        for i, count in enumerate(self.density):
+            y = height - height * count / peak
+            points.append(f"{i},{y:.2f} {i + 1},{y:.2f}")
+        points.append(f"{len(self.density)},{height}")
+        return " ".join(points)
+
+
+class _TopicAccumulator:
+    """Statistics of one topic, updated chunk by chunk (timestamps in ascending order)"""
+
+    def __init__(self, bin_edges: np.ndarray):
+        self.bin_edges = bin_edges
+        self.msgcount = 0
+        self.bytes = 0
+        self.first: Optional[int] = None
+        self.last: Optional[int] = None
+        self.interval_sum = 0.0
+        self.interval_square_sum = 0.0
+        self.gaps: list[tuple[int, int]] = []
+        self.density = np.zeros((len(bin_edges) - 1,), dtype=np.int64)
+
+    def add(self, timestamps: np.ndarray):
+        if len(timestamps) == 0:
+            return
+        if self.first is None:
+            self.first = int(timestamps[0])
+            starts = timestamps[:-1]
+            intervals = np.diff(timestamps)
+        else:
+            starts = np.concatenate(([self.last], timestamps[:-1]))
+            intervals = np.diff(timestamps, prepend=self.last)
+        self.last = int(timestamps[-1])
+        self.msgcount += len(timestamps)
+
+        seconds = intervals * 1e-9
+        self.interval_sum += float(seconds.sum())
+        self.interval_square_sum += float(np.square(seconds).sum())
+
+        if len(intervals) > 0:
+            largest = np.argsort(intervals)[-REPORTED_GAPS:]
+            self.gaps = sorted(self.gaps + [(int(starts[i]), int(intervals[i])) for i in largest],
+                               key=lambda gap: -gap[1])[:REPORTED_GAPS]
+
+        # Timestamps at the end of the recording belong to the last bin
+        bins = np.clip(np.searchsorted(self.bin_edges, timestamps, side="right") - 1, 0, len(self.density) - 1)
+        self.density += np.bincount(bins, minlength=len(self.density))
+
+    def result(self) -> TopicStatistics:
+        intervals = self.msgcount - 1
+        if intervals < 1:
+            return TopicStatistics(self.msgcount, self.bytes, None, None, None, [], self.density.tolist())
+        mean = self.interval_sum / intervals
+        variance = max(self.interval_square_sum / intervals - mean * mean, 0.0)
+        rate = intervals / ((self.last - self.first) * 1e-9) if self.last > self.first else None
+        return TopicStatistics(self.msgcount, self.bytes, rate, variance ** 0.5, self.gaps[0][1] * 1e-9,
+                               self.gaps, self.density.tolist())
+
+
+def compute_topic_statistics(path: Path) -> dict[str, TopicStatistics]:
+    """
+    :param path: Bag directory
+    :return: Statistics of each topic
+    :raises rb.ReaderError: Bag not readable
+    """
+    with rb.Reader(path) as reader:
+        storage_paths = reader.paths
+        file_compression = reader.compression_mode == "file"
+        start = reader.start_time
+        end = max(reader.end_time, start + 1)
+        topics = [c.topic for c in reader.connections]
+
+    bin_edges = np.linspace(start, end, DENSITY_BINS + 1)
+    accumulators = {topic: _TopicAccumulator(bin_edges) for topic in topics}
+    # Split bags are recorded consecutively, so each topic is streamed in order across files
+    for storage_path in storage_paths:
+        with decompressed(storage_path, file_compression) as db_path:
+            # Opened read-only and without locking, the bag is not modified while it is in the storage
+            connection = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?immutable=1", uri=True)
+            try:
+                names = dict(connection.execute("SELECT id, name FROM topics").fetchall())
+                for name in names.values():
+                    accumulators.setdefault(name, _TopicAccumulator(bin_edges))
+                cursor = connection.execute("SELECT topic_id, timestamp, length(data) FROM messages ORDER BY timestamp")
+                while True:
+                    rows = cursor.fetchmany(CHUNK_SIZE)
+                    if len(rows) == 0:
+                        break
+                    chunk = np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=3 * len(rows)).reshape(-1, 3)
+                    # Grouped by topic, the stable sort keeps the timestamps of each topic in ascending order
+                    chunk = chunk[np.argsort(chunk[:, 0], kind="stable")]
+                    topic_ids, starts = np.unique(chunk[:, 0], return_index=True)
+                    for topic_id, messages in zip(topic_ids.tolist(), np.split(chunk, starts[1:])):
+                        accumulator = accumulators[names[topic_id]]
+                        accumulator.bytes += int(messages[:, 2].sum())
+                        accumulator.add(messages[:, 1])
+            finally:
+                connection.close()
+    return {topic: accumulator.result() for topic, accumulator in accumulators.items()}
+
+
+def load_topic_statistics(path: Path) -> Optional[dict[str, TopicStatistics]]:
+    """
+    Statistics stored by store_topic_statistics
+    :param path: Bag directory
+    :return: None if not computed yet or outdated (bag modified or computed by another version)
+    """
+    try:
+        with open(path / topic_statistics_file_name, 'r') as statistics_file:
+            stored = json.load(statistics_file)
+        metadata_mtime = os.stat(path / "metadata.yaml").st_mtime_ns
+    except (OSError, ValueError):
+        return None
+    if stored.get("version") != TOPIC_STATISTICS_VERSION or stored.get("metadata_mtime") != metadata_mtime:
+        return None
+    return {topic: TopicStatistics(**dict(s, gaps=[tuple(g) for g in s["gaps"]]))
+            for topic, s in stored["topics"].items()}
+
+
+def store_topic_statistics(path: Path, statistics: dict[str, TopicStatistics]):
+    """Write statistics to topic_statistics.json in the bag directory"""
+    stored = {"version": TOPIC_STATISTICS_VERSION,
+              # Statistics are outdated if the bag is rewritten (e.g. recompressed), which also rewrites metadata.yaml
+              "metadata_mtime": os.stat(path / "metadata.yaml").st_mtime_ns,
+              "topics": {topic: asdict(s) for topic, s in statistics.items()}}
+    tmp_path = path / (topic_statistics_file_name + ".tmp")
+    tmp_path.write_text(json.dumps(stored))
+    os.replace(tmp_path, path / topic_statistics_file_name)
@@ -0,0 +1,310 @@
+"""
+Timing instrumentation of requests, enabled by the ROSBAG_INSTRUMENTATION setting.
+
+Code is instrumented with spans (`with span("scan"): ...`) and counters (`count("bags_scanned")`,
+`cache_lookup("bag_index", hit)`). When enabled, spans are reported
+
+- per request in the Server-Timing response header (see ServerTimingMiddleware), summed per span name
+- as Prometheus histograms/counters served by the metrics view (text exposition format)
+
+When disabled, span() returns a shared no-op context manager and count() returns immediately, so instrumented code
+only pays for a function call and a setting lookup.
+
+Metrics are kept per process, i.e. per gunicorn worker. With ROSBAG_METRICS_DIR set, each process writes its metrics
+to a file in that directory after requests (at most every METRICS_WRITE_INTERVAL seconds), and the metrics view sums
+the files of all processes. A scrape therefore reports all workers, whichever worker serves it. Files of exited
+workers are kept, so totals do not decrease when a worker is restarted.
+"""
+import asyncio
+import contextlib
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from asgiref.sync import markcoroutinefunction
+
+import rosbagsApp.settings
+
+# Upper bounds (seconds) of the histogram buckets of span and request durations
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, math.inf)
+# Upper bounds of the histogram buckets of the number of bags scanned by a request
+BAG_COUNT_BUCKETS = (0, 1, 10, 100, 1000, 10000, math.inf)
+# Seconds between writes of the metrics of a process to ROSBAG_METRICS_DIR
+METRICS_WRITE_INTERVAL = 1.0
+
+_null_span = contextlib.nullcontext()
+
+
+def enabled() -> bool:
+    return rosbagsApp.settings.ROSBAG_INSTRUMENTATION
+
+
+class RequestTimings:
+    """Spans and counts of the current request"""
+
+    def __init__(self):
+        # Span name -> (total seconds, number of spans)
+        self.spans: dict[str, tuple[float, int]] = {}
+        self.counts: dict[str, int] = {}
+
+    def server_timing(self) -> str:
+        """Value of the Server-Timing header"""
+        return ", ".join(f'{name};dur={seconds * 1000:.2f};desc="{count}x"'
+                         for name, (seconds, count) in self.spans.items())
+
+
+_request_timings: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar("request_timings",
+                                                                                            default=None)
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: tuple[float, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        # Labels -> (bucket counts, sum)
+        self._values: dict[tuple[tuple[str, str], ...], tuple[list[int], float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * len(self.buckets), 0.0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def exposition(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, (counts, total) in values:
+            for bound, count in zip(self.buckets, counts):
+                le = "+Inf" if bound == math.inf else repr(float(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', le),))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total!r}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {counts[-1]}")
+        return lines
+
+    def snapshot(self) -> list:
+        """Values as JSON serializable list, see merge"""
+        with self._lock:
+            return [[list(labels), counts.copy(), total] for labels, (counts, total) in self._values.items()]
+
+    def merge(self, snapshot: list):
+        """Add the values of a snapshot (of another process)"""
+        with self._lock:
+            for labels, counts, total in snapshot:
+                key = tuple((name, value) for name, value in labels)
+                own_counts, own_total = self._values.get(key) or ([0] * len(self.buckets), 0.0)
+                self._values[key] = ([a + b for a, b in zip(own_counts, counts)], own_total + total)
+
+    def empty_copy(self) -> "Histogram":
+        return Histogram(self.name, self.help_text, self.buckets)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: dict[tuple[tuple[str, str], ...], int] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: int = 1, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def value(self, **labels: str) -> int:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def exposition(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        lines += [f"{self.name}{_format_labels(labels)} {value}" for labels, value in values]
+        return lines
+
+    def snapshot(self) -> list:
+        """Values as JSON serializable list, see merge"""
+        with self._lock:
+            return [[list(labels), value] for labels, value in self._values.items()]
+
+    def merge(self, snapshot: list):
+        """Add the values of a snapshot (of another process)"""
+        for labels, value in snapshot:
+            self.inc(value, **dict(labels))
+
+    def empty_copy(self) -> "Counter":
+        return Counter(self.name, self.help_text)
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if len(labels) == 0:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+span_seconds = Histogram("rosbag_span_seconds", "Duration of instrumented operations", DURATION_BUCKETS)
+request_seconds = Histogram("rosbag_request_seconds", "Duration of requests by view", DURATION_BUCKETS)
+bags_scanned_per_request = Histogram("rosbag_bags_scanned_per_request", "Bags checked for changes by a request",
+                                     BAG_COUNT_BUCKETS)
+events_total = Counter("rosbag_events_total", "Number of counted events (e.g. bags scanned)")
+cache_lookups_total = Counter("rosbag_cache_lookups_total", "Cache lookups by cache and result (hit or miss)")
+METRICS = [span_seconds, request_seconds, bags_scanned_per_request, events_total, cache_lookups_total]
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        seconds = time.perf_counter() - self.start
+        span_seconds.observe(seconds, span=self.name)
+        timings = _request_timings.get()
+        if timings is not None:
+            total, count = timings.spans.get(self.name, (0.0, 0))
+            timings.spans[self.name] = (total + seconds, count + 1)
+
+
+def span(name: str):
+    """
+    Context manager measuring the duration of the enclosed code
+    :param name: Span name, must be a valid Server-Timing metric name (token, e.g. "thumbnail_image")
+    """
+    if not rosbagsApp.settings.ROSBAG_INSTRUMENTATION:
+        return _null_span
+    return _Span(name)
+
+
+def count(name: str, value: int = 1):
+    """Count events (e.g. "bags_scanned"), per request and in total"""
+    if not rosbagsApp.settings.ROSBAG_INSTRUMENTATION:
+        return
+    events_total.inc(value, event=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.counts[name] = timings.counts.get(name, 0) + value
+
+
+def cache_lookup(cache: str, hit: bool):
+    """Count a lookup of a cache (e.g. "bag_index"), for the hit ratio"""
+    if not rosbagsApp.settings.ROSBAG_INSTRUMENTATION:
+        return
+    cache_lookups_total.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def metrics_exposition() -> str:
+    """
+    All metrics in the Prometheus text exposition format, summed over all processes writing to ROSBAG_METRICS_DIR (or
+    of this process if it is not set)
+    """
+    metrics = METRICS
+    directory = rosbagsApp.settings.ROSBAG_METRICS_DIR
+    if directory is not None:
+        write_metrics(force=True)
+        metrics = [metric.empty_copy() for metric in METRICS]
+        for path in sorted(Path(directory).glob("*.json")):
+            try:
+                snapshot = json.loads(path.read_text())
+            except (OSError, ValueError):
+                # Removed (e.g. the directory was cleared), files are replaced atomically
+                continue
+            for metric in metrics:
+                metric.merge(snapshot.get(metric.name, []))
+    return "\n".join(line for metric in metrics for line in metric.exposition()) + "\n"
+
+
+_metrics_file: Optional[tuple[int, Path]] = None  # (pid, path) of the metrics file of this process
+_metrics_written = 0.0  # time.monotonic() of the last write
+_metrics_file_lock = threading.Lock()
+
+
+def write_metrics(force: bool = False):
+    """
+    Write the metrics of this process to its file in ROSBAG_METRICS_DIR (if set)
+    :param force: Write even if the last write was less than METRICS_WRITE_INTERVAL seconds ago
+    """
+    global _metrics_file, _metrics_written
+    directory = rosbagsApp.settings.ROSBAG_METRICS_DIR
+    if directory is None:
+        return
+    with _metrics_file_lock:
+        now = time.monotonic()
+        if not force and now - _metrics_written < METRICS_WRITE_INTERVAL:
+            return
+        _metrics_written = now
+        if _metrics_file is None or _metrics_file[0] != os.getpid() or _metrics_file[1].parent != Path(directory):
+            # Named by pid and start time, the file of an exited process whose pid is reused is not overwritten
+            _metrics_file = (os.getpid(), Path(directory) / f"{os.getpid()}-{time.time_ns()}.json")
+        path = _metrics_file[1]
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_suffix(".tmp")
+        temporary.write_text(json.dumps({metric.name: metric.snapshot() for metric in METRICS}))
+        os.replace(temporary, path)
+
+
+class ServerTimingMiddleware:
+    """
+    Adds the Server-Timing header (spans of the request, and its total duration) and records the duration of
+    requests and the number of bags scanned per request. Supports async requests, so ASGI requests are not forced
+    through Django's thread for synchronous code.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self._call_async(request)
+        if not rosbagsApp.settings.ROSBAG_INSTRUMENTATION:
+            return self.get_response(request)
+
+        timings = RequestTimings()
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_timings.reset(token)
+        return self._finish(request, response, timings, time.perf_counter() - start)
+
+    async def _call_async(self, request):
+        if not rosbagsApp.settings.ROSBAG_INSTRUMENTATION:
+            return await self.get_response(request)
+
+        timings = RequestTimings()
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_timings.reset(token)
+        return self._finish(request, response, timings, time.perf_counter() - start)
+
+    @staticmethod
+    def _finish(request, response, timings: RequestTimings, seconds: float):
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match is not None else "<unresolved>"
+        request_seconds.observe(seconds, view=view)
+        bags_scanned_per_request.observe(timings.counts.get("bags_scanned", 0), view=view)
+        server_timing = timings.server_timing()
+        response["Server-Timing"] = f"{server_timing + ', ' if server_timing else ''}total;dur={seconds * 1000:.2f}"
+        write_metrics()
+        return response
@@ -0,0 +1,156 @@
+import logging
+import multiprocessing
+import time
+from pathlib import Path
+
+from django import db
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+import rosbagsApp.settings
+from rosbagsApp.bag_storage.parallel_reader import DecompressionCache
+from rosbagsApp.bag_storage.storage import BagStorage, ROSBag
+from rosbagsApp.models import ThumbnailJob
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_thumbnail_job(storage: BagStorage, bag: ROSBag) -> ThumbnailJob:
+    """
+    Queue thumbnail generation for a bag
+    :return: New job, or the already queued/running job for the same bag
+    """
+    active_jobs = ThumbnailJob.objects.filter(storage_path=str(storage.base_path), bag_path=str(bag.rel_path),
+                                              status__in=ThumbnailJob.ACTIVE_STATUS)
+    job = active_jobs.first()
+    if job is not None:
+        return job
+    try:
+        with transaction.atomic():
+            return ThumbnailJob.objects.create(storage_path=str(storage.base_path), bag_path=str(bag.rel_path),
+                                               timeout=rosbagsApp.settings.ROSBAG_THUMBNAIL_JOB_TIMEOUT)
+    except IntegrityError:
+        # Queued concurrently by another request
+        return active_jobs.get()
+
+
+def run_thumbnail_job(job_id: int):
+    """
+    Execute a (running) job in the current process, the result is stored in the job. The error of a failed job is
+    shown to users, so it only contains the type of the exception, the traceback is logged.
+    """
+    job = ThumbnailJob.objects.get(id=job_id)
+    jobs = ThumbnailJob.objects.filter(id=job_id)
+    try:
+        bag = BagStorage(job.storage_path).find_by_path(Path(job.bag_path))
+        if bag is None:
+            logger.warning("Thumbnail job %s failed: bag %s not found", job_id, job.bag_path)
+            jobs.update(status=ThumbnailJob.FAILED, error="Bag not found", finished=timezone.now())
+            return
+        bag.generate_thumbnails(progress=lambda p: jobs.update(progress=p))
+        bag.update_topic_statistics()
+    except Exception as e:
+        logger.exception("Thumbnail job %s failed", job_id)
+        jobs.update(status=ThumbnailJob.FAILED, error=f"Thumbnail generation failed ({type(e).__name__})",
+                    finished=timezone.now())
+    else:
+        jobs.update(status=ThumbnailJob.DONE, progress=1.0, finished=timezone.now())
+
+
+def _job_process(job_id: int):
+    # The database connection of the parent must not be used in the forked process
+    db.connections.close_all()
+    run_thumbnail_job(job_id)
+    db.connections.close_all()
+    # The process exits without running atexit handlers. Files of killed processes are deleted by the worker.
+    DecompressionCache.clear_shared()
+
+
+class ThumbnailWorker:
+    """
+    Executes queued thumbnail jobs, each in a separate process (at most `processes` at once).
+    Jobs exceeding their timeout are killed. The job table is polled, no message broker is required.
+    Only one worker should be running per database.
+    """
+
+    def __init__(self, processes: int = 2, poll_interval: float = 1.0):
+        self.processes = processes
+        self.poll_interval = poll_interval
+        # Job id -> (process, monotonic start time, timeout)
+        self._running: dict[int, tuple[multiprocessing.Process, float, float]] = {}
+        self._context = multiprocessing.get_context("fork")
+
+    def requeue_interrupted(self):
+        """Queue jobs again which were running when the previous worker stopped"""
+        count = ThumbnailJob.objects.filter(status=ThumbnailJob.RUNNING).update(
+            status=ThumbnailJob.QUEUED, progress=0.0, started=None)
+        if count > 0:
+            logger.info("Requeued %d interrupted thumbnail jobs", count)
+
+    def run(self, until_idle: bool = False):
+        """
+        Process jobs until interrupted
+        :param until_idle: Return once no job is queued or running anymore
+        """
+        self.requeue_interrupted()
+        # Decompressed files of jobs killed with a previous worker
+        DecompressionCache.remove_stale()
+        try:
+            while True:
+                self._reap()
+                while len(self._running) < self.processes and self._start_next():
+                    pass
+                if until_idle and len(self._running) == 0:
+                    return
+                time.sleep(self.poll_interval)
+        finally:
+            for job_id, (process, _, _) in self._running.items():
+                process.kill()
+                process.join()
+                DecompressionCache.remove_process_files(process.pid)
+                self._fail(job_id, "Worker stopped")
+
+    def _claim_next(self) -> ThumbnailJob | None:
+        for job in ThumbnailJob.objects.filter(status=ThumbnailJob.QUEUED).order_by("created", "id")[:10]:
+            claimed = ThumbnailJob.objects.filter(id=job.id, status=ThumbnailJob.QUEUED) \
+                .update(status=ThumbnailJob.RUNNING, started=timezone.now())
+            if claimed == 1:
+                return job
+        return None
+
+    def _start_next(self) -> bool:
+        job = self._claim_next()
+        if job is None:
+            return False
+        logger.info("Starting thumbnail job %s for %s", job.id, job.bag_path)
+        # Forked process must not share the database connection
+        db.connections.close_all()
+        process = self._context.Process(target=_job_process, args=(job.id,), daemon=True)
+        process.start()
+        self._running[job.id] = (process, time.monotonic(), job.timeout)
+        return True
+
+    def _reap(self):
+        for job_id, (process, start, timeout) in list(self._running.items()):
+            if process.is_alive():
+                if time.monotonic() - start > timeout:
+                    process.kill()
+                    process.join()
+                    DecompressionCache.remove_process_files(process.pid)
+                    del self._running[job_id]
+                    self._fail(job_id, f"Timed out after {timeout} s")
+                continue
+
+            process.join()
+            del self._running[job_id]
+            if process.exitcode != 0:
+                DecompressionCache.remove_process_files(process.pid)
+                self._fail(job_id, f"Process exited with code {process.exitcode}")
+            else:
+                logger.info("Thumbnail job %s finished", job_id)
+
+    @staticmethod
+    def _fail(job_id: int, error: str):
+        logger.warning("Thumbnail job %s failed: %s", job_id, error)
+        ThumbnailJob.objects.filter(id=job_id, status__in=ThumbnailJob.ACTIVE_STATUS) \
+            .update(status=ThumbnailJob.FAILED, error=error, finished=timezone.now())
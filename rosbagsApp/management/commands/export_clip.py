@@ -0,0 +1,38 @@
+import sys
+from pathlib import Path
+
+import rosbags.rosbag2 as rb
+from django.core.management.base import BaseCommand, CommandError
+
+from rosbagsApp.bag_storage.export import export_clip
+from rosbagsApp.bag_storage.storage import BagStorage
+
+
+class Command(BaseCommand):
+    help = "Export the messages of some topics within a time range of a bag as new rosbag2 (tar archive of the bag " \
+           "directory)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("bag_path", type=Path, help="Bag (relative to storage)")
+        parser.add_argument("output", help="Tar archive to write, - for stdout")
+        parser.add_argument("--topics", nargs="+", default=[], help="Topics to export, defaults to all")
+        parser.add_argument("--start", type=int, help="First timestamp (ns) to export")
+        parser.add_argument("--stop", type=int, help="Timestamp (ns) after the last message to export")
+
+    def handle(self, *args, **options):
+        bag = BagStorage().find_by_path(options["bag_path"])
+        if bag is None:
+            raise CommandError(f"Bag not found: {options['bag_path']}")
+
+        name = f"{bag.name}_clip"
+        output = sys.stdout.buffer if options["output"] == "-" else open(options["output"], "xb")
+        try:
+            for chunk in export_clip(bag.path, name, options["topics"], options["start"], options["stop"]):
+                output.write(chunk)
+        except KeyError as e:
+            raise CommandError(f"Topic not contained in the bag: {e.args[0]}")
+        except rb.ReaderError as e:
+            raise CommandError(f"Bag is not readable: {e}")
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
@@ -0,0 +1,84 @@
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from pathlib import Path
+
+from django import db
+from django.core.management.base import BaseCommand, CommandError
+
+from rosbagsApp.bag_storage.parallel_reader import DecompressionCache
+from rosbagsApp.bag_storage.storage import BagStorage, ROSBag
+
+
+def generate(base_path: Path, rel_path: Path) -> tuple[int, str | None]:
+    """
+    Generate thumbnails and topic statistics of a single bag (executed in worker process)
+    :return: Size of the bag's database files, error (None on success)
+    """
+    try:
+        # Read directly from the bag directory, worker processes do not access the catalog
+        bag = ROSBag(base_path, rel_path)
+        size = sum(os.stat(p).st_size for p in bag.storage_files())
+        bag.generate_thumbnails()
+        bag.update_topic_statistics()
+        return size, None
+    except Exception:
+        return 0, traceback.format_exc()
+    finally:
+        # Worker processes exit without running atexit handlers
+        DecompressionCache.clear_shared()
+
+
+class Command(BaseCommand):
+    help = "Generate thumbnails and topic statistics for all bags (or the given bags) whose thumbnails or " \
+           "statistics are missing or outdated"
+
+    def add_arguments(self, parser):
+        parser.add_argument("bag_paths", nargs="*", type=Path, help="Bags (relative to storage), defaults to all")
+        parser.add_argument("--processes", type=int, default=os.cpu_count(), help="Number of worker processes")
+        parser.add_argument("--force", action="store_true",
+                            help="Regenerate thumbnails and statistics which are up-to-date")
+
+    def handle(self, *args, **options):
+        bs = BagStorage()
+        if len(options["bag_paths"]) > 0:
+            bags = [bs.find_by_path(p) for p in options["bag_paths"]]
+            if None in bags:
+                missing = [str(p) for p, b in zip(options["bag_paths"], bags) if b is None]
+                raise CommandError(f"Bags not found: {', '.join(missing)}")
+        else:
+            bags = list(bs)
+
+        pending = []
+        for bag in bags:
+            if bag.load_error is not None:
+                self.stderr.write(f"Skipping unreadable bag {bag.rel_path}: {bag.load_error}")
+            elif options["force"] or bag.thumbnails_outdated() or bag.topic_statistics() is None:
+                pending.append(bag.rel_path)
+        self.stdout.write(f"{len(pending)} of {len(bags)} bags need thumbnails")
+
+        failures = []
+        total_size = 0
+        start = time.monotonic()
+        # Forked processes must not share the database connection
+        db.connections.close_all()
+        with ProcessPoolExecutor(options["processes"], mp_context=get_context("fork")) as executor:
+            futures = {executor.submit(generate, bs.base_path, p): p for p in pending}
+            for i, future in enumerate(as_completed(futures)):
+                rel_path = futures[future]
+                size, error = future.result()
+                total_size += size
+                if error is None:
+                    self.stdout.write(f"[{i + 1}/{len(pending)}] {rel_path}")
+                else:
+                    failures.append(rel_path)
+                    self.stderr.write(f"[{i + 1}/{len(pending)}] {rel_path} failed:\n{error}")
+        seconds = time.monotonic() - start
+
+        self.stdout.write(f"Processed {len(pending)} bags ({total_size / 1e6:.1f} MB) in {seconds:.1f} s: "
+                          f"{len(pending) / max(seconds, 1e-9):.2f} bags/s, "
+                          f"{total_size / 1e6 / max(seconds, 1e-9):.1f} MB/s")
+        if len(failures) > 0:
+            raise CommandError(f"{len(failures)} bags failed: {', '.join(str(p) for p in failures)}")
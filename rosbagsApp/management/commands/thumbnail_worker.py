@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from rosbagsApp.jobs import ThumbnailWorker
+
+
+class Command(BaseCommand):
+    help = "Execute thumbnail generation jobs queued via the generate_thumbnails API"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=2, help="Number of jobs executed in parallel")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between polling for new jobs")
+        parser.add_argument("--until-idle", action="store_true", help="Exit once all queued jobs are finished")
+
+    def handle(self, *args, **options):
+        worker = ThumbnailWorker(options["processes"], options["poll_interval"])
+        try:
+            worker.run(until_idle=options["until_idle"])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,34 @@
+# Generated by Django 4.1.10 on 2026-10-17 17:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('storage_path', models.CharField(max_length=4096)),
+                ('rel_path', models.CharField(max_length=4096)),
+                ('name', models.CharField(db_index=True, max_length=255)),
+                ('metadata_mtime', models.BigIntegerField()),
+                ('additional_metadata_mtime', models.BigIntegerField(null=True)),
+                ('start_time', models.BigIntegerField(null=True)),
+                ('duration', models.BigIntegerField(null=True)),
+                ('topics', models.JSONField(default=list)),
+                ('additional_metadata', models.JSONField(null=True)),
+                ('error', models.TextField(null=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='catalogentry',
+            constraint=models.UniqueConstraint(fields=('storage_path', 'rel_path'), name='unique_catalog_entry_path'),
+        ),
+    ]
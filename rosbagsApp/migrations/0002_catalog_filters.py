@@ -0,0 +1,53 @@
+# Generated by Django 4.1.10 on 2026-10-17 17:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def clear_catalog(apps, schema_editor):
+    # Existing entries lack the new fields, the catalog is rebuilt from the bag directories
+    apps.get_model('rosbagsApp', 'CatalogEntry').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rosbagsApp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_catalog, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='catalogentry',
+            name='hardware',
+            field=models.CharField(db_index=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='catalogentry',
+            name='location',
+            field=models.CharField(db_index=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='catalogentry',
+            name='recording_date',
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='CatalogTopic',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(db_index=True, max_length=255)),
+                ('msgtype', models.CharField(db_index=True, max_length=255)),
+                ('msgcount', models.BigIntegerField()),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='catalog_topics', to='rosbagsApp.catalogentry')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CatalogTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tag', models.CharField(db_index=True, max_length=255)),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='catalog_tags', to='rosbagsApp.catalogentry')),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations
+
+from rosbagsApp.bag_storage.search import create_search_table, drop_search_table
+
+
+def clear_catalog(apps, schema_editor):
+    # The search index is populated when entries are loaded, the catalog is rebuilt from the bag directories
+    apps.get_model('rosbagsApp', 'CatalogEntry').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rosbagsApp', '0003_thumbnail_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_catalog, migrations.RunPython.noop),
+        migrations.RunPython(lambda apps, schema_editor: create_search_table(schema_editor),
+                             lambda apps, schema_editor: drop_search_table(schema_editor)),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.1.10 on 2026-10-17 18:18
+
+from django.db import migrations, models
+
+
+def clear_catalog(apps, schema_editor):
+    # Existing entries lack the size, the catalog (and its aggregates) is rebuilt from the bag directories
+    apps.get_model('rosbagsApp', 'CatalogEntry').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rosbagsApp', '0004_catalog_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_catalog, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='CatalogAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('storage_path', models.CharField(max_length=4096)),
+                ('dimension', models.CharField(max_length=16)),
+                ('key', models.CharField(max_length=255)),
+                ('bags', models.BigIntegerField(default=0)),
+                ('duration', models.BigIntegerField(default=0)),
+                ('size', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='catalogentry',
+            name='size',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='catalogaggregate',
+            constraint=models.UniqueConstraint(fields=('storage_path', 'dimension', 'key'), name='unique_catalog_aggregate'),
+        ),
+    ]
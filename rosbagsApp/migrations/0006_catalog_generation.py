@@ -0,0 +1,21 @@
+# Generated by Django 4.1.10 on 2026-10-17 18:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rosbagsApp', '0005_catalog_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogGeneration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('storage_path', models.CharField(max_length=4096, unique=True)),
+                ('generation', models.BigIntegerField()),
+            ],
+        ),
+    ]
@@ -1,3 +1,141 @@
 from django.db import models
 
-# Create your models here.
+
+class CatalogEntry(models.Model):
+    """
+    Cached metadata of a single ROS bag, see rosbagsApp.bag_storage.catalog.
+    The bag directory stays the source of truth, entries are revalidated using the mtimes of metadata.yaml and
+    additional_metadata.json and can be dropped at any time.
+    """
+    # Resolved BagStorage.base_path, allows multiple storages (e.g. testdata) to share one database
+    storage_path = models.CharField(max_length=4096)
+    rel_path = models.CharField(max_length=4096)
+    name = models.CharField(max_length=255, db_index=True)
+
+    # st_mtime_ns of metadata.yaml and additional_metadata.json (None if the file does not exist)
+    metadata_mtime = models.BigIntegerField()
+    additional_metadata_mtime = models.BigIntegerField(null=True)
+
+    # Contents of metadata.yaml, None if the bag could not be read (see error)
+    start_time = models.BigIntegerField(null=True)  # Nanoseconds since epoch
+    duration = models.BigIntegerField(null=True)  # Nanoseconds
+    topics = models.JSONField(default=list)  # List of [topic, msgtype, msgcount]
+    size = models.BigIntegerField(null=True)  # Bytes of all database files
+
+    # Parsed and validated additional_metadata.json, None if the file does not exist
+    additional_metadata = models.JSONField(null=True)
+
+    # Denormalized for filtering and sorting in the database
+    recording_date = models.DateTimeField(null=True, db_index=True)  # recording_time or start_time
+    hardware = models.CharField(max_length=255, null=True, db_index=True)
+    location = models.CharField(max_length=255, null=True, db_index=True)
+
+    # Reason why the bag could not be loaded, None for readable bags
+    error = models.TextField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["storage_path", "rel_path"], name="unique_catalog_entry_path"),
+        ]
+
+    def __str__(self):
+        return f"CatalogEntry{{{self.rel_path}}}"
+
+
+class CatalogTopic(models.Model):
+    """Topic recorded in a catalogued bag, for filtering by topic or message type"""
+    entry = models.ForeignKey(CatalogEntry, on_delete=models.CASCADE, related_name="catalog_topics")
+    name = models.CharField(max_length=255, db_index=True)
+    msgtype = models.CharField(max_length=255, db_index=True)
+    msgcount = models.BigIntegerField()
+
+
+class CatalogTag(models.Model):
+    """Tag of a catalogued bag, for filtering by tag"""
+    entry = models.ForeignKey(CatalogEntry, on_delete=models.CASCADE, related_name="catalog_tags")
+    tag = models.CharField(max_length=255, db_index=True)
+
+
+class CatalogGeneration(models.Model):
+    """
+    Counter of changes of the catalog of a storage, incremented whenever entries are added, changed or removed (see
+    BagCatalog.generation). Responses derived from the catalog are cached per generation.
+    """
+    storage_path = models.CharField(max_length=4096, unique=True)
+    generation = models.BigIntegerField()
+
+    def __str__(self):
+        return f"CatalogGeneration{{{self.storage_path}: {self.generation}}}"
+
+
+class CatalogAggregate(models.Model):
+    """
+    Totals of the readable bags of a storage grouped by a dimension (e.g. all bags with a tag), see
+    rosbagsApp.bag_storage.aggregates. Updated incrementally whenever an entry is loaded or removed.
+    """
+    TOTAL = "total"  # All bags, key is empty
+    HARDWARE = "hardware"
+    LOCATION = "location"
+    TAG = "tag"
+    MONTH = "month"  # Month of the recording date, key is YYYY-MM
+    TOPIC = "topic"
+    DIMENSIONS = [TOTAL, HARDWARE, LOCATION, TAG, MONTH, TOPIC]
+
+    storage_path = models.CharField(max_length=4096)
+    dimension = models.CharField(max_length=16)
+    key = models.CharField(max_length=255)
+    bags = models.BigIntegerField(default=0)
+    duration = models.BigIntegerField(default=0)  # Nanoseconds
+    size = models.BigIntegerField(default=0)  # Bytes
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["storage_path", "dimension", "key"], name="unique_catalog_aggregate"),
+        ]
+
+    def __str__(self):
+        return f"CatalogAggregate{{{self.dimension}={self.key}: {self.bags} bags}}"
+
+
+class ThumbnailJob(models.Model):
+    """
+    Thumbnail generation for a bag, queued by the generate_thumbnails API and executed by the thumbnail_worker
+    management command (see rosbagsApp.jobs)
+    """
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [(QUEUED, "Queued"), (RUNNING, "Running"), (DONE, "Done"), (FAILED, "Failed")]
+    ACTIVE_STATUS = [QUEUED, RUNNING]
+
+    storage_path = models.CharField(max_length=4096)
+    bag_path = models.CharField(max_length=4096)  # Relative to storage
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    progress = models.FloatField(default=0.0)  # Fraction of topics processed
+    error = models.TextField(null=True)
+    timeout = models.FloatField()  # Seconds
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True)
+    finished = models.DateTimeField(null=True)
+
+    class Meta:
+        constraints = [
+            # There is at most one queued or running job per bag, further requests get the existing job
+            models.UniqueConstraint(fields=["storage_path", "bag_path"],
+                                    condition=models.Q(status__in=["queued", "running"]),
+                                    name="unique_active_thumbnail_job"),
+        ]
+
+    def __str__(self):
+        return f"ThumbnailJob{{{self.id}: {self.bag_path}, {self.status}}}"
+
+    def json(self) -> dict:
+        return {"id": self.id,
+                "bag_path": self.bag_path,
+                "status": self.status,
+                "progress": self.progress,
+                "error": self.error,
+                "created": self.created.isoformat(),
+                "started": self.started.isoformat() if self.started is not None else None,
+                "finished": self.finished.isoformat() if self.finished is not None else None}
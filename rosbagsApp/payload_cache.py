@@ -0,0 +1,136 @@
+"""
+Serialized json responses of the bag list APIs, cached per catalog generation (see BagCatalog.generation).
+
+As long as no bag changed, a repeated request is answered from the cache without querying or serializing the catalog:
+with 304 Not Modified if the client has the payload (ETag), otherwise with the serialized bytes, compressed with
+gzip (or brotli, if the optional brotli package is installed) if the client accepts it. Compressed variants are created
+on first use and kept next to the uncompressed payload. Each process caches up to ROSBAG_PAYLOAD_CACHE_SIZE bytes of
+uncompressed payloads (least recently used first), compressed variants are smaller.
+"""
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
+import rosbagsApp.settings
+from rosbagsApp.instrumentation import cache_lookup, span
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Compression levels, payloads are compressed once per generation
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+
+
+def _compressors() -> dict[str, Callable[[bytes], bytes]]:
+    """Available content encodings (most preferred first) and their compression function"""
+    compressors = {}
+    if brotli is not None:
+        compressors["br"] = lambda body: brotli.compress(body, quality=BROTLI_QUALITY)
+    compressors["gzip"] = lambda body: gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    return compressors
+
+
+def accepted_encodings(accept_encoding: str) -> set[str]:
+    """Content codings accepted according to an Accept-Encoding header (ignoring preferences other than q=0)"""
+    accepted = set()
+    for item in accept_encoding.split(","):
+        coding, *params = [part.strip() for part in item.split(";")]
+        rejected = False
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    rejected = float(value) == 0
+                except ValueError:
+                    rejected = True
+        if coding != "" and not rejected:
+            accepted.add(coding.lower())
+    return accepted
+
+
+class Payload:
+    """Serialized response of one generation, with its compressed variants"""
+
+    def __init__(self, generation: int, body: bytes):
+        self.generation = generation
+        # Weak, since variants with different content encodings share it
+        self.etag = f"W/\"{hashlib.sha256(body).hexdigest()[:32]}\""
+        self._bodies: dict[str, bytes] = {"identity": body}
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        """Bytes of the uncompressed payload"""
+        return len(self._bodies["identity"])
+
+    def encode(self, accept_encoding: str) -> tuple[str, bytes]:
+        """
+        Variant for a request, compressed if the client accepts an available encoding
+        :param accept_encoding: Accept-Encoding header of the request
+        :return: Content encoding ("identity" if uncompressed), body
+        """
+        accepted = accepted_encodings(accept_encoding)
+        for encoding, compress in _compressors().items():
+            if encoding in accepted or "*" in accepted:
+                with self._lock:
+                    if encoding not in self._bodies:
+                        with span("compress"):
+                            self._bodies[encoding] = compress(self._bodies["identity"])
+                    return encoding, self._bodies[encoding]
+        return "identity", self._bodies["identity"]
+
+
+class PayloadCache:
+    """LRU cache of Payloads, one cache per process"""
+
+    _cache: Optional['PayloadCache'] = None
+    _cache_lock = threading.Lock()
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._payloads: OrderedDict[Hashable, Payload] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def shared() -> 'PayloadCache':
+        """Cache shared by all requests of the process, of ROSBAG_PAYLOAD_CACHE_SIZE bytes"""
+        with PayloadCache._cache_lock:
+            if PayloadCache._cache is None:
+                PayloadCache._cache = PayloadCache(rosbagsApp.settings.ROSBAG_PAYLOAD_CACHE_SIZE)
+            return PayloadCache._cache
+
+    def get(self, key: Hashable, generation: int, serialize: Callable[[], bytes]) -> Payload:
+        """
+        Cached payload of the current generation, serialized (and cached) if there is none
+        :param key: Identifies the response within a generation, e.g. path and parameters of the request
+        :param serialize: Creates the response body, called without holding a lock
+        """
+        with self._lock:
+            payload = self._payloads.get(key)
+            hit = payload is not None and payload.generation == generation
+            cache_lookup("payload", hit)
+            if hit:
+                self._payloads.move_to_end(key)
+                return payload
+
+        payload = Payload(generation, serialize())
+        with self._lock:
+            self._payloads[key] = payload
+            self._payloads.move_to_end(key)
+            self._evict()
+        return payload
+
+    def clear(self):
+        with self._lock:
+            self._payloads.clear()
+
+    def _evict(self):
+        total = sum(payload.size for payload in self._payloads.values())
+        while total > self.max_bytes and len(self._payloads) > 0:
+            _, payload = self._payloads.popitem(last=False)
+            total -= payload.size
@@ -1,4 +1,37 @@
+import os
+
 from django.conf import settings
 
 ROSBAG_STORAGE_PATH = getattr(settings, 'ROSBAG_STORAGE_PATH', "/opt/aufnahmen/2023/rosbags/")
 ROSBAG_MOUNT_PATH = getattr(settings, 'ROSBAG_MOUNT_PATH', ROSBAG_STORAGE_PATH)
+# Seconds after which a queued thumbnail generation job is aborted
+ROSBAG_THUMBNAIL_JOB_TIMEOUT = getattr(settings, 'ROSBAG_THUMBNAIL_JOB_TIMEOUT', 15 * 60)
+# If set, files are sent by nginx using X-Accel-Redirect to this prefix followed by the path relative to
+# ROSBAG_STORAGE_PATH, Django only checks authorization (see deployment/nginx_config.j2)
+ROSBAG_ACCEL_REDIRECT_PREFIX = getattr(settings, 'ROSBAG_ACCEL_REDIRECT_PREFIX', None)
+# Number of bags kept open by each process for inspecting messages, and seconds after which unused bags are closed
+ROSBAG_READER_POOL_SIZE = getattr(settings, 'ROSBAG_READER_POOL_SIZE', 8)
+ROSBAG_READER_POOL_IDLE_TIMEOUT = getattr(settings, 'ROSBAG_READER_POOL_IDLE_TIMEOUT', 5 * 60)
+# Maximum bytes of messages per split file of exported clips, bounds the temporary disk space of an export. Each split
+# is only sent once it is complete; the first split is small (1 MiB) and the following ones grow up to this size
+ROSBAG_EXPORT_SPLIT_SIZE = getattr(settings, 'ROSBAG_EXPORT_SPLIT_SIZE', 64 * 1024 * 1024)
+# Report timings in Server-Timing headers and serve metrics at /metrics (see rosbagsApp.instrumentation)
+ROSBAG_INSTRUMENTATION = getattr(settings, 'ROSBAG_INSTRUMENTATION', False)
+# Directory in which each process stores its metrics, /metrics then reports the sum of all processes (e.g. gunicorn
+# workers) instead of those of the process serving the request
+ROSBAG_METRICS_DIR = getattr(settings, 'ROSBAG_METRICS_DIR', None)
+# Database files of split bags read at once (see rosbagsApp.bag_storage.parallel_reader)
+ROSBAG_READER_THREADS = getattr(settings, 'ROSBAG_READER_THREADS', min(os.cpu_count() or 1, 8))
+# Bytes of decompressed database files of file compressed bags kept in a temporary directory for repeated reads
+ROSBAG_DECOMPRESSION_CACHE_SIZE = getattr(settings, 'ROSBAG_DECOMPRESSION_CACHE_SIZE', 4 * 1024 * 1024 * 1024)
+# Threads per process executing blocking work of async views when served with ASGI (see rosbagsApp.asgi), 0 executes
+# it in Django's thread for synchronous code
+ROSBAG_IO_THREADS = getattr(settings, 'ROSBAG_IO_THREADS', 8)
+# Threads per process sending streamed responses (exports, thumbnails) when served with ASGI, i.e. downloads served at
+# once before further downloads wait (see rosbagsApp.asgi)
+ROSBAG_STREAM_THREADS = getattr(settings, 'ROSBAG_STREAM_THREADS', 16)
+# Bytes of serialized bag list responses cached by each process (see rosbagsApp.payload_cache)
+ROSBAG_PAYLOAD_CACHE_SIZE = getattr(settings, 'ROSBAG_PAYLOAD_CACHE_SIZE', 64 * 1024 * 1024)
+# Modules registering additional thumbnail generators, e.g. for custom message types (see
+# rosbagsApp.bag_storage.thumbnail_registry)
+ROSBAG_THUMBNAIL_GENERATORS = getattr(settings, 'ROSBAG_THUMBNAIL_GENERATORS', [])
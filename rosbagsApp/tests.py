@@ -1,16 +1,74 @@
+import asyncio
+import base64
+import contextvars
+import dataclasses
 import datetime
+import gzip
+import io
 import json
+import multiprocessing
 import os.path
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
 from pathlib import Path
+from typing import Callable
+from unittest import mock
 
+import cv2
+import numpy as np
+import rosbags.rosbag2 as rb
+from asgiref.sync import async_to_sync
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.exceptions import RequestAborted
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from rosbags.serde import deserialize_cdr, serialize_cdr
+from rosbags.typesys import types
+from rosbags.typesys.types import builtin_interfaces__msg__Time as Time, \
+    sensor_msgs__msg__CompressedImage as CompressedImage, sensor_msgs__msg__Image as Image, \
+    std_msgs__msg__Header as Header
+from ruamel.yaml import YAML
 
-from rosbagsApp.bag_storage.additional_metadata import AdditionalMetadata, additional_metadata_file_name
-from rosbagsApp.bag_storage.storage import BagStorage, TopicRecordingInfo
+import rosbagsApp.settings
+from rosbagsApp.asgi import ASGIHandler, raise_if_cancelled, run_blocking
+from rosbagsApp.bag_storage.additional_metadata import AdditionalMetadata, additional_metadata_file_name, \
+    load_additional_metadata_file, load_additional_metadata_files
+from rosbagsApp.bag_storage.aggregates import aggregates
+from rosbagsApp.bag_storage.catalog import BagCatalog
+from rosbagsApp.bag_storage.cdr import FieldDecoder
+from rosbagsApp.bag_storage.export import export_clip
+from rosbagsApp.bag_storage.images import compressed_image_size, compressed_image_to_bgr, image_array, \
+    image_to_bgr
+from rosbagsApp.bag_storage.index import AmbiguousBagName
+from rosbagsApp.bag_storage.inspection import MAX_ARRAY_ITEMS, image_preview, message_to_json
+from rosbagsApp.bag_storage.parallel_reader import DecompressionCache, ParallelReader
+from rosbagsApp.bag_storage.reader_pool import ReaderPool
+from rosbagsApp.bag_storage.recording_info import RecordingInfo
+from rosbagsApp.bag_storage.scanner import BagEvent, BagEventType, StorageScanner
+from rosbagsApp.bag_storage.search import search_entries
+from rosbagsApp.bag_storage.storage import BagStorage, ROSBag, TopicRecordingInfo
+from rosbagsApp.bag_storage.thumbnail_registry import THUMBNAIL_GENERATORS, ThumbnailBudget, \
+    register_message_types, register_thumbnail_generator, thumbnail_generator
+from rosbagsApp.bag_storage.thumbnails import IMAGE_THUMBNAIL_SIZES, PREVIEW_VIDEO_HEIGHT, is_content_addressed, \
+    make_content_addressed, register_spatz_types
+from rosbagsApp.bag_storage.timeseries import TimeSeriesCache, cache_path, timeseries_dir_name
+from rosbagsApp.bag_storage.topic_statistics import DENSITY_BINS, REPORTED_GAPS, compute_topic_statistics, \
+    topic_statistics_file_name
+from rosbagsApp.instrumentation import Counter, Histogram, cache_lookups_total, request_seconds, span
+from rosbagsApp.jobs import enqueue_thumbnail_job, run_thumbnail_job
+from rosbagsApp.models import CatalogAggregate, CatalogEntry, ThumbnailJob
+from rosbagsApp.views import THUMBNAIL_MAX_AGE
 
 TEST_DATA_PATH = "rosbagsApp/testdata"
+# Views execute blocking work in the test thread, data of test transactions is not visible to other threads
+rosbagsApp.settings.ROSBAG_IO_THREADS = 0
+rosbagsApp.settings.ROSBAG_STREAM_THREADS = 0
 
 
 class ListViewTests(TestCase):
@@ -27,6 +85,174 @@ class ListViewTests(TestCase):
         self.assertRedirects(response, reverse("login") + "?next=" + reverse("rosbags:list"))
 
 
+class BagsApiTests(TestCase):
+    def setUp(self):
+        self.test_user = get_user_model().objects.create_user("temporary")
+        self.client.force_login(self.test_user)
+
+    def get_names(self, **params):
+        response = self.client.get(reverse("rosbags:bags_api"), params)
+        self.assertEqual(response.status_code, 200)
+        return [b["name"] for b in response.json()["bags"]]
+
+    def test_pagination(self):
+        names = []
+        cursor = None
+        pages = 0
+        while True:
+            params = {"limit": 2}
+            if cursor is not None:
+                params["cursor"] = cursor
+            response = self.client.get(reverse("rosbags:bags_api"), params).json()
+            self.assertLessEqual(len(response["bags"]), 2)
+            names += [b["name"] for b in response["bags"]]
+            cursor = response["next_cursor"]
+            pages += 1
+            if cursor is None:
+                break
+        # Bags in subdirectories have empty metadata.yaml, and are therefore not listed
+        self.assertEqual(pages, 4)
+        self.assertEqual(len(names), 7)
+        self.assertEqual(len(set(names)), 7)
+        # Newest first, bags with equal recording dates are split across pages
+        self.assertEqual(set(names[:2]), {"unit_test_bag_recording_time_with_tz", "unit_test_bag_recording_time"})
+        self.assertEqual(set(names[-2:]), {"test_state_only", "test_state_only_with_thumbs"})
+
+    def test_sort_by_duration(self):
+        names = self.get_names(sort="duration")
+        self.assertEqual(set(names[:2]), {"test_state_only", "test_state_only_with_thumbs"})
+        self.assertEqual(self.get_names(sort="-duration")[-2:], names[:2][::-1])
+
+    def test_filters(self):
+        self.assertEqual(self.get_names(tag="no_metadata"), ["bag_without_metadata"])
+        self.assertEqual(self.get_names(tag=["test", "no_metadata"]), [])
+        self.assertEqual(set(self.get_names(topic="/spatz")), {"test_state_only", "test_state_only_with_thumbs"})
+        self.assertEqual(set(self.get_names(msgtype="spatz_interfaces/msg/Spatz")),
+                         {"test_state_only", "test_state_only_with_thumbs"})
+        self.assertEqual(self.get_names(hardware="mock_robot"), ["unit_test_bag"])
+        self.assertEqual(set(self.get_names(location="simulator")), {"test_state_only", "test_state_only_with_thumbs"})
+        self.assertEqual(set(self.get_names(recorded_after="2023-01-01")),
+                         {"unit_test_bag_recording_time", "unit_test_bag_recording_time_with_tz"})
+        self.assertEqual(set(self.get_names(recorded_before="2000-01-01")),
+                         {"test_state_only", "test_state_only_with_thumbs"})
+        self.assertEqual(self.get_names(q="unit tests"), ["unit_test_bag"])
+
+    def test_invalid_parameters(self):
+        for params in [{"cursor": "invalid"}, {"sort": "name"}, {"limit": 0}, {"recorded_after": "yesterday"}]:
+            response = self.client.get(reverse("rosbags:bags_api"), params)
+            self.assertEqual(response.status_code, 400, msg=params)
+
+    def test_invalid_cursor(self):
+        def cursor(value) -> str:
+            return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+        for params in [{"cursor": cursor([5, 1])}, {"cursor": cursor(["-recording_date", 5, 1])},
+                       {"cursor": cursor(["-recording_date", "garbage", 1])},
+                       {"cursor": cursor(["-recording_date", None, 1])},
+                       {"cursor": cursor(["-recording_date", "2023-01-01T00:00:00", "1"])},
+                       {"cursor": cursor(["duration", "x", 1]), "sort": "duration"},
+                       {"cursor": base64.urlsafe_b64encode(b"\xff").decode()}]:
+            response = self.client.get(reverse("rosbags:bags_api"), params)
+            self.assertEqual(response.status_code, 400, msg=params)
+
+        # Cursor of another sort order
+        first = self.client.get(reverse("rosbags:bags_api"), {"limit": 2}).json()
+        response = self.client.get(reverse("rosbags:bags_api"),
+                                   {"limit": 2, "sort": "duration", "cursor": first["next_cursor"]})
+        self.assertEqual(response.status_code, 400)
+
+    def test_filter_values(self):
+        response = self.client.get(reverse("rosbags:bag_filters_api")).json()
+        self.assertEqual(response["tags"], ["no_metadata", "test"])
+        self.assertEqual(response["topics"], ["/spatz", "/spatz11/sensor_data"])
+
+    def search(self, q: str) -> list[str]:
+        response = self.client.get(reverse("rosbags:bag_search_api"), {"q": q})
+        self.assertEqual(response.status_code, 200)
+        return [b["name"] for b in response.json()["bags"]]
+
+    def test_search(self):
+        # Prefix of the last word
+        self.assertEqual(set(self.search("s-cur")), {"test_state_only", "test_state_only_with_thumbs"})
+        # All words must match, in any column (description and hardware)
+        self.assertEqual(self.search("unit mock_rob"), ["unit_test_bag"])
+        # Topic names and message types
+        self.assertEqual(set(self.search("sensor_data")), set(self.search("Spatz11SensorData")))
+        self.assertIn("unit_test_bag_minimal_metadata", self.search("sensor_data"))
+        # Operators are not interpreted
+        self.assertEqual(self.search("simulator NOT"), [])
+        self.assertEqual(self.search("\"*"), [])
+
+    def test_search_ranking(self):
+        # Match in the name ranks above match in the topics
+        names = self.search("spatz")
+        self.assertEqual(set(names[:2]), {"test_state_only", "test_state_only_with_thumbs"})
+        self.assertIn("unit_test_bag", names[2:])
+
+    def test_search_index_updated(self):
+        with tempfile.TemporaryDirectory() as base_path:
+            shutil.copytree(Path(TEST_DATA_PATH) / "unit_test_bag", Path(base_path) / "bag")
+            bs = BagStorage(base_path)
+            bs.refresh()
+            entries = bs.catalog.entries()
+            self.assertEqual([e.name for e, _ in search_entries(entries, "unittest", 10)], ["bag"])
+
+            amd_path = Path(base_path) / "bag" / additional_metadata_file_name
+            amd = AdditionalMetadata.from_file(amd_path)
+            amd.location = "parking_lot"
+            amd_path.write_text(amd.to_json())
+            os.utime(amd_path, ns=(0, 0))
+            bs.refresh()
+            self.assertEqual(search_entries(entries, "unittest", 10), [])
+            self.assertEqual([e.name for e, _ in search_entries(entries, "parking", 10)], ["bag"])
+
+            shutil.rmtree(Path(base_path) / "bag")
+            bs.refresh()
+            self.assertEqual(search_entries(CatalogEntry.objects.all(), "parking", 10), [])
+
+    def test_conditional_request(self):
+        url = reverse("rosbags:bags_api")
+        response = self.client.get(url, {"limit": 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Cache-Control"], "private, no-cache")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(len(response.json()["bags"]), 3)
+
+        self.assertEqual(self.client.get(url, {"limit": 3}, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+        # Other parameters, other payload
+        self.assertEqual(self.client.get(url, {"limit": 2}, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 200)
+        filters = self.client.get(reverse("rosbags:bag_filters_api"))
+        self.assertEqual(self.client.get(reverse("rosbags:bag_filters_api"),
+                                         HTTP_IF_NONE_MATCH=filters["ETag"]).status_code, 304)
+
+    def test_compressed(self):
+        url = reverse("rosbags:bags_api")
+        uncompressed = self.client.get(url).content
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.content), uncompressed)
+        self.assertLess(len(response.content), len(uncompressed))
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip;q=0, deflate")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(response.content, uncompressed)
+
+    def test_payload_invalidated(self):
+        with tempfile.TemporaryDirectory() as base_path:
+            shutil.copytree(Path(TEST_DATA_PATH) / "unit_test_bag", Path(base_path) / "bag")
+            with mock.patch.object(rosbagsApp.settings, "ROSBAG_STORAGE_PATH", base_path):
+                etag = self.client.get(reverse("rosbags:bags_api"))["ETag"]
+
+                amd_path = Path(base_path) / "bag" / additional_metadata_file_name
+                amd = AdditionalMetadata.from_file(amd_path)
+                amd.description = "changed"
+                amd_path.write_text(amd.to_json())
+                os.utime(amd_path, ns=(0, 0))
+                response = self.client.get(reverse("rosbags:bags_api"), HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()["bags"][0]["description"], "changed")
+
+
 class DetailViewTests(TestCase):
     def setUp(self):
         self.test_user = get_user_model().objects.create_user("temporary")
@@ -45,12 +271,93 @@ class DetailViewTests(TestCase):
         response = self.client.get(reverse("rosbags:detail", args=["bag_without_metadata"]))
         self.assertEqual(response.status_code, 200)
 
+    def test_topic_statistics(self):
+        self.client.force_login(self.test_user)
+        bag = BagStorage(TEST_DATA_PATH).find_by_name("test_state_only")
+        bag.update_topic_statistics()
+        try:
+            response = self.client.get(reverse("rosbags:detail", args=["test_state_only"]))
+        finally:
+            (bag.path / topic_statistics_file_name).unlink()
+        self.assertContains(response, "199.69 Hz")
+        self.assertContains(response, "<polygon", count=1)
+
     def test_detail_needs_authentication(self):
         url = reverse("rosbags:detail", args=["unit_test_bag"])
         response = self.client.get(url)
         self.assertRedirects(response, reverse("login") + "?next=" + url)
 
 
+class ThumbnailViewTests(TestCase):
+    def setUp(self):
+        self.test_user = get_user_model().objects.create_user("temporary")
+        self.client.force_login(self.test_user)
+        self.url = reverse("rosbags:thumbnail", args=["test_state_only_with_thumbs", "spatz.png"])
+
+    def test_conditional_request(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Cache-Control"], "private, no-cache")
+        self.assertEqual(b"".join(response.streaming_content)[:4], b"\x89PNG")
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_content_addressed(self):
+        with tempfile.TemporaryDirectory() as base_path:
+            thumb_dir = Path(base_path) / "bag" / "thumbnails"
+            thumb_dir.mkdir(parents=True)
+            (thumb_dir / "topic.png").write_bytes(b"content")
+            name = make_content_addressed(thumb_dir, "topic.png")
+            self.assertTrue(is_content_addressed(name))
+            self.assertFalse(is_content_addressed("topic.png"))
+
+            with mock.patch.object(rosbagsApp.settings, "ROSBAG_STORAGE_PATH", base_path):
+                response = self.client.get(reverse("rosbags:thumbnail", args=["bag", name]))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Cache-Control"], f"private, max-age={THUMBNAIL_MAX_AGE}, immutable")
+
+    def test_accel_redirect(self):
+        with mock.patch.object(rosbagsApp.settings, "ROSBAG_ACCEL_REDIRECT_PREFIX", "/internal/rosbags/"):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Accel-Redirect"],
+                         "/internal/rosbags/test_state_only_with_thumbs/thumbnails/spatz.png")
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertEqual(response.content, b"")
+
+    def test_byte_range(self):
+        content = (Path(TEST_DATA_PATH) / "test_state_only_with_thumbs" / "thumbnails" / "spatz.png").read_bytes()
+        response = self.client.get(self.url, HTTP_RANGE="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], f"bytes 10-19/{len(content)}")
+        self.assertEqual(b"".join(response.streaming_content), content[10:20])
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=-5")
+        self.assertEqual(b"".join(response.streaming_content), content[-5:])
+        response = self.client.get(self.url, HTTP_RANGE=f"bytes={len(content) - 3}-")
+        self.assertEqual(b"".join(response.streaming_content), content[-3:])
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE=f"bytes={len(content)}-").status_code, 416)
+
+        # Invalid or multiple ranges, or range of a changed file (If-Range): whole file
+        for headers in [{"HTTP_RANGE": "bytes=5-1"}, {"HTTP_RANGE": "bytes=0-1,5-6"},
+                        {"HTTP_RANGE": "bytes=0-1", "HTTP_IF_RANGE": '"outdated"'}]:
+            response = self.client.get(self.url, **headers)
+            self.assertEqual(response.status_code, 200, msg=headers)
+            self.assertEqual(response["Accept-Ranges"], "bytes")
+            self.assertEqual(b"".join(response.streaming_content), content)
+
+    def test_path_outside_storage(self):
+        response = self.client.get(reverse("rosbags:thumbnail", args=["../..", "spatz.png"]))
+        self.assertEqual(response.status_code, 400)
+
+    def test_missing(self):
+        response = self.client.get(reverse("rosbags:thumbnail", args=["test_state_only", "missing.png"]))
+        self.assertEqual(response.status_code, 404)
+
+
 class MetadataStorageTests(TestCase):
     def test_topic_metadata(self):
         bs = BagStorage(TEST_DATA_PATH)
@@ -71,7 +378,41 @@ class MetadataStorageTests(TestCase):
                                123)])
 
 
+class RecordingInfoTests(TestCase):
+    def test_metadata_file_matches_reader(self):
+        for bag in ["bag_without_metadata", "test_state_only", "unit_test_bag", "unit_test_bag_minimal_metadata"]:
+            path = Path(TEST_DATA_PATH) / bag
+            self.assertEqual(RecordingInfo.from_metadata_file(path), RecordingInfo.from_reader(path), msg=bag)
+
+
 class AdditionalMetadataTests(TestCase):
+    def test_parse_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / additional_metadata_file_name
+            shutil.copy(Path(TEST_DATA_PATH) / "unit_test_bag" / additional_metadata_file_name, path)
+            metadata = load_additional_metadata_file(path)
+            self.assertIs(load_additional_metadata_file(path), metadata)
+
+            amd = AdditionalMetadata.from_dict(metadata)
+            amd.tags.append("modified")
+            path.write_text(amd.to_json())
+            self.assertIn("modified", load_additional_metadata_file(path)["tags"])
+            self.assertNotIn("modified", metadata.get("tags", []))
+
+    def test_load_files_reports_all_errors(self):
+        with tempfile.TemporaryDirectory() as directory:
+            valid = Path(TEST_DATA_PATH) / "unit_test_bag" / additional_metadata_file_name
+            schema_violations = Path(directory) / "schema.json"
+            schema_violations.write_text(json.dumps({"description": 5, "tags": "not a list"}))
+            broken = Path(directory) / "broken.json"
+            broken.write_text("{")
+            missing = Path(directory) / "missing.json"
+
+            result = load_additional_metadata_files([valid, schema_violations, broken, missing])
+            self.assertEqual(result.metadata.keys(), {valid})
+            self.assertEqual(result.errors.keys(), {schema_violations, broken, missing})
+            self.assertEqual(len(result.errors[schema_violations]), 2)
+
     def test_optional_items(self):
         md = AdditionalMetadata("desc", "hw", "loc", None, [])
         self.assertEqual(md.thumbnails, {})
@@ -107,25 +448,1067 @@ class ThumbnailGeneration(TestCase):
     def test_create_thumbnail_states(self):
         bs = BagStorage(TEST_DATA_PATH)
         bag = bs.find_by_name("test_state_only")
-        expected_thumb_path = bag.path / "thumbnails" / "spatz.png"
-        if os.path.exists(expected_thumb_path):
-            os.remove(expected_thumb_path)
-
         amd_path = bag.path / additional_metadata_file_name
 
         bag.generate_thumbnails()
-        self.assertEqual(bag.metadata.thumbnails, {"/spatz": {"spatz.png"}})
+        self.assertEqual(bag.metadata.thumbnails.keys(), {"/spatz"})
+        (thumb_name,) = bag.metadata.thumbnails["/spatz"]
+        self.assertRegex(thumb_name, r"^spatz\.[0-9a-f]{16}\.png$")
+        expected_thumb_path = bag.path / "thumbnails" / thumb_name
         self.assertTrue(os.path.exists(expected_thumb_path))
         # Verify metadata written to file
         new_amd = AdditionalMetadata.from_file(amd_path)
-        self.assertEqual(new_amd.thumbnails, {"/spatz": {"spatz.png"}})
+        self.assertEqual(new_amd.thumbnails, {"/spatz": {thumb_name}})
 
         # Cleanup: restore metadata, delete thumbnail
         if os.path.exists(expected_thumb_path):
             os.remove(expected_thumb_path)
         new_amd.thumbnails = None
+        new_amd.thumbnail_versions = None
         amd_path.write_text(new_amd.to_json())
 
+    def test_regenerate_legacy_thumbnails(self):
+        with tempfile.TemporaryDirectory() as base_path:
+            shutil.copytree(Path(TEST_DATA_PATH) / "test_state_only_with_thumbs", Path(base_path) / "bag")
+            bag_path = Path(base_path) / "bag"
+            # Provided by the user, not generated
+            shutil.copy(bag_path / "thumbnails" / "spatz.png", bag_path / "thumbnails" / "custom.png")
+            amd = AdditionalMetadata.from_file(bag_path / additional_metadata_file_name)
+            amd.thumbnails["/spatz"].add("custom.png")
+            (bag_path / additional_metadata_file_name).write_text(amd.to_json())
+
+            bag = ROSBag(Path(base_path), Path("bag"))
+            # Named like a generated thumbnail, but without version
+            self.assertTrue(bag.thumbnails_outdated())
+
+            def check_written(_):
+                # Renamed thumbnails are updated in additional_metadata.json after each topic
+                listed = AdditionalMetadata.from_file(bag_path / additional_metadata_file_name).thumbnails["/spatz"]
+                self.assertNotIn("spatz.png", listed)
+                self.assertTrue(all((bag_path / "thumbnails" / thumb).exists() for thumb in listed))
+
+            bag.generate_thumbnails(progress=check_written)
+
+            bag = ROSBag(Path(base_path), Path("bag"))
+            self.assertFalse(bag.thumbnails_outdated())
+            thumbs = bag.metadata.thumbnails["/spatz"]
+            self.assertIn("custom.png", thumbs)
+            (generated,) = thumbs - {"custom.png"}
+            self.assertRegex(generated, r"^spatz\.[0-9a-f]{16}\.png$")
+            self.assertEqual({p.name for p in (bag_path / "thumbnails").iterdir()}, {"custom.png", generated})
+
+    def test_create_thumbnail_images(self):
+        with tempfile.TemporaryDirectory() as base_path:
+            # 40 bayer images over 4 s, the brightness of an image is its index
+            with rb.Writer(Path(base_path) / "camera_bag") as writer:
+                connection = writer.add_connection("/camera/image", Image.__msgtype__)
+                for i in range(40):
+                    timestamp = 1000000000 + i * 100000000
+                    msg = Image(Header(Time(timestamp // 1000000000, timestamp % 1000000000), "camera"),
+                                height=60, width=80, encoding="bayer_rggb8", is_bigendian=0, step=80,
+                                data=np.full((60 * 80,), i, dtype=np.uint8))
+                    writer.write(connection, timestamp, serialize_cdr(msg, Image.__msgtype__))
+
+            bag = ROSBag(Path(base_path), Path("camera_bag"))
+            # Generated by a previous version, replaced
+            bag.metadata.thumbnails = {"/camera/image": {"cameraimage.png"}}
+            bag.metadata.thumbnail_versions = {"cameraimage.png": 1}
+            bag.generate_thumbnails()
+            small_name, = bag.list_thumbnails()["/camera/image"]
+            large_name, = bag.detail_thumbnails()["/camera/image"]
+            video_name, = bag.preview_videos()["/camera/image"]
+            self.assertEqual(bag.metadata.thumbnails, {"/camera/image": {small_name, large_name, video_name}})
+            self.assertRegex(small_name, r"^cameraimage\.small\.[0-9a-f]{16}\.webp$")
+            self.assertRegex(large_name, r"^cameraimage\.large\.[0-9a-f]{16}\.webp$")
+
+            small = cv2.imread(str(bag.path / "thumbnails" / small_name))
+            self.assertEqual(small.shape, (IMAGE_THUMBNAIL_SIZES["small"], 8 * 64, 3))
+            large = cv2.imread(str(bag.path / "thumbnails" / large_name), cv2.IMREAD_GRAYSCALE)
+            self.assertEqual(large.shape, (IMAGE_THUMBNAIL_SIZES["large"], 8 * 320))
+            # Frames sampled every 0.5 s, i.e. every fifth image
+            brightness = [large[:, i * 320:(i + 1) * 320].mean() for i in range(8)]
+            np.testing.assert_allclose(brightness, [0, 5, 10, 15, 20, 25, 30, 35], atol=1.5)
+
+            # 10 Hz recording reduced to PREVIEW_VIDEO_FPS, i.e. every second image
+            self.assertRegex(video_name, r"^cameraimage\.preview\.[0-9a-f]{16}\.webm$")
+            video = cv2.VideoCapture(str(bag.path / "thumbnails" / video_name))
+            frames = []
+            while (frame := video.read()[1]) is not None:
+                frames.append(frame)
+            video.release()
+            self.assertEqual(len(frames), 20)
+            self.assertEqual(frames[0].shape, (PREVIEW_VIDEO_HEIGHT, 320, 3))
+            # Lossy, brightness steps of 2 are not preserved exactly
+            np.testing.assert_allclose([f.mean() for f in frames], np.arange(0, 40, 2), atol=5)
+
+    def test_custom_generator(self):
+        msgtype = "rosbag_browser_test/msg/Counter"
+        definitions = {msgtype: "uint32 count"}
+        register_message_types(definitions)
+        # Registered once, repeated registrations are skipped
+        register_message_types(definitions)
+        Counter = getattr(types, msgtype.replace("/", "__"))
+
+        with tempfile.TemporaryDirectory() as base_path, mock.patch.dict(THUMBNAIL_GENERATORS):
+            with rb.Writer(Path(base_path) / "counter_bag") as writer:
+                connection = writer.add_connection("/counter", msgtype)
+                for i in range(10):
+                    writer.write(connection, 1000000000 + i, serialize_cdr(Counter(i), msgtype))
+
+            @register_thumbnail_generator(msgtype, "counter", version=7, budget=ThumbnailBudget(max_messages=4),
+                                          message_definitions=definitions)
+            def create_thumbnail_counter(bag_dir, reader, connection):
+                counts = [deserialize_cdr(raw, msgtype).count for _, _, raw in reader.messages([connection])]
+                (bag_dir / "thumbnails").mkdir(exist_ok=True)
+                (bag_dir / "thumbnails" / "counter.txt").write_text(repr(counts))
+                return {"counter.txt"}
+
+            bag = ROSBag(Path(base_path), Path("counter_bag"))
+            self.assertTrue(bag.thumbnails_outdated())
+            bag.generate_thumbnails()
+            (thumb_name,) = bag.metadata.thumbnails["/counter"]
+            self.assertRegex(thumb_name, r"^counter\.[0-9a-f]{16}\.txt$")
+            self.assertEqual(bag.metadata.thumbnail_versions, {thumb_name: 7})
+            self.assertFalse(ROSBag(Path(base_path), Path("counter_bag")).thumbnails_outdated())
+            # Only the messages within the budget are read
+            self.assertEqual((bag.path / "thumbnails" / thumb_name).read_text(), "[0, 1, 2, 3]")
+
+
+def raw_image(encoding: str, pixels: np.ndarray, padding: int = 0, bigendian: bool = False) -> Image:
+    """Image message of an encoding, rows padded by `padding` bytes"""
+    if pixels.itemsize > 1:
+        pixels = pixels.astype(pixels.dtype.newbyteorder(">" if bigendian else "<"))
+    rows = pixels.reshape(pixels.shape[0], -1).view(np.uint8)
+    data = np.hstack([rows, np.zeros((rows.shape[0], padding), dtype=np.uint8)])
+    return Image(Header(Time(0, 0), "camera"), height=pixels.shape[0], width=pixels.shape[1], encoding=encoding,
+                 is_bigendian=int(bigendian), step=data.shape[1], data=data.reshape(-1))
+
+
+class ImageDecodingTests(TestCase):
+    def setUp(self):
+        self.bgr = np.random.default_rng(0).integers(0, 256, (12, 16, 3), dtype=np.uint8)
+
+    def test_raw_color_encodings(self):
+        bgr = self.bgr
+        gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+        cases = [
+            ("bgr8", bgr, bgr),
+            ("rgb8", bgr[..., ::-1], bgr),
+            ("bgra8", np.dstack([bgr, np.full(bgr.shape[:2], 255, dtype=np.uint8)]), bgr),
+            ("rgba8", np.dstack([bgr[..., ::-1], np.zeros(bgr.shape[:2], dtype=np.uint8)]), bgr),
+            ("mono8", gray, np.dstack([gray] * 3)),
+            # Scaled by the maximum
+            ("bgr16", bgr.astype(np.uint16) * 256, bgr),
+        ]
+        for encoding, pixels, expected in cases:
+            for padding in (0, 5):
+                msg = raw_image(encoding, np.ascontiguousarray(pixels), padding)
+                np.testing.assert_array_equal(image_to_bgr(msg), expected, err_msg=f"{encoding}, padding {padding}")
+        # Zero-copy view of the message data
+        msg = raw_image("rgb8", bgr, 5)
+        self.assertTrue(np.shares_memory(image_array(msg), msg.data))
+
+    def test_raw_mono16(self):
+        # 12 bit depth image, scaled by its maximum
+        depth = np.random.default_rng(0).integers(0, 4096, (12, 16), dtype=np.uint16)
+        depth[0, 0] = 4095
+        expected = np.round(depth * (255 / 4095)).astype(np.uint8)
+        for encoding in ("mono16", "16UC1"):
+            for bigendian in (False, True):
+                bgr = image_to_bgr(raw_image(encoding, depth, padding=2, bigendian=bigendian))
+                np.testing.assert_array_equal(bgr, np.dstack([expected] * 3))
+
+    def test_raw_yuv422(self):
+        # Gray: U = V = 128, Y is the brightness
+        uyvy = np.zeros((12, 16, 2), dtype=np.uint8)
+        uyvy[..., 0] = 128
+        uyvy[..., 1] = 100
+        # Limited range (16..235) of the luma is expanded
+        np.testing.assert_allclose(image_to_bgr(raw_image("yuv422", uyvy, padding=4)), 98, atol=1)
+        # YUY2 has the luma first
+        np.testing.assert_allclose(image_to_bgr(raw_image("yuv422_yuy2", uyvy[..., ::-1].copy())), 98, atol=1)
+
+    def test_raw_bayer(self):
+        color = {"b": 30, "g": 120, "r": 200}
+        for pattern in ("rggb", "bggr", "gbrg", "grbg"):
+            mosaic = np.zeros((12, 16), dtype=np.uint16)
+            for i, channel in enumerate(pattern):
+                mosaic[i // 2::2, i % 2::2] = color[channel]
+            for bits, scale in ((8, 1), (16, 256)):
+                msg = raw_image(f"bayer_{pattern}{bits}", (mosaic * scale).astype(f"u{bits // 8}"))
+                # 16 bit scaled by the maximum (red)
+                expected = [round(color[c] * 255 / 200) if bits == 16 else color[c] for c in "bgr"]
+                np.testing.assert_allclose(image_to_bgr(msg).reshape(-1, 3), [expected] * (12 * 16), atol=1,
+                                           err_msg=f"{pattern}{bits}")
+
+    def test_raw_float_depth(self):
+        depth = np.linspace(0, 10, 12 * 16, dtype=np.float32).reshape(12, 16)
+        depth[0, :4] = [np.nan, np.inf, -np.inf, 0]
+        expected = np.round(np.nan_to_num(depth, nan=0, posinf=0, neginf=0) * 25.5).astype(np.uint8)
+        for bigendian in (False, True):
+            bgr = image_to_bgr(raw_image("32FC1", depth, padding=4, bigendian=bigendian))
+            np.testing.assert_allclose(bgr, np.dstack([expected] * 3), atol=1)
+
+    def test_raw_invalid(self):
+        # Unsupported encodings are expected input
+        with self.assertRaises(ValueError):
+            image_to_bgr(raw_image("64FC1", self.bgr))
+        msg = raw_image("bgr8", self.bgr)
+        msg.step -= 1
+        with self.assertRaises(ValueError):
+            image_to_bgr(msg)
+        msg = raw_image("bgr8", self.bgr)
+        msg.height += 1
+        with self.assertRaises(ValueError):
+            image_to_bgr(msg)
+
+    def test_compressed_reduced_resolution(self):
+        image = cv2.resize(self.bgr, (1920, 1080), interpolation=cv2.INTER_NEAREST)
+        for fmt in ("jpeg", "png"):
+            data = np.frombuffer(cv2.imencode(f".{fmt}", image)[1].tobytes(), dtype=np.uint8)
+            self.assertEqual(compressed_image_size(data), (1920, 1080))
+            msg = CompressedImage(Header(Time(0, 0), "camera"), format=fmt, data=data)
+            self.assertEqual(compressed_image_to_bgr(msg).shape, (1080, 1920, 3))
+            # Largest reduction leaving at least the requested rows
+            self.assertEqual(compressed_image_to_bgr(msg, min_height=240).shape, (270, 480, 3))
+            self.assertEqual(compressed_image_to_bgr(msg, min_height=100).shape, (135, 240, 3))
+            self.assertEqual(compressed_image_to_bgr(msg, min_height=1000).shape, (1080, 1920, 3))
+        self.assertIsNone(compressed_image_size(np.frombuffer(b"\xff\xd8\xff", dtype=np.uint8)))
+
+        msg = CompressedImage(Header(Time(0, 0), "camera"), format="jpeg", data=np.zeros(100, dtype=np.uint8))
+        with self.assertRaises(ValueError):
+            compressed_image_to_bgr(msg)
+
+    def test_compressed_depth(self):
+        depth = np.arange(12 * 16, dtype=np.uint16).reshape(12, 16) * 100
+        png = cv2.imencode(".png", depth)[1].reshape(-1)
+        msg = CompressedImage(Header(Time(0, 0), "camera"), format="16UC1; compressedDepth png",
+                              data=np.concatenate([np.zeros(12, dtype=np.uint8), png]))
+        bgr = compressed_image_to_bgr(msg)
+        self.assertEqual(bgr.shape, (12, 16, 3))
+        self.assertEqual(bgr.max(), 255)
+
+    def test_failed_topic_skipped(self):
+        with tempfile.TemporaryDirectory() as base_path:
+            with rb.Writer(Path(base_path) / "camera_bag") as writer:
+                broken = writer.add_connection("/depth/image", Image.__msgtype__)
+                camera = writer.add_connection("/camera/image", Image.__msgtype__)
+                for i in range(10):
+                    timestamp = 1000000000 + i * 100000000
+                    for image_connection, encoding in ((broken, "64FC1"), (camera, "mono8")):
+                        msg = raw_image(encoding, np.full((12, 16), i, dtype=np.uint8))
+                        writer.write(image_connection, timestamp, serialize_cdr(msg, Image.__msgtype__))
+
+            bag = ROSBag(Path(base_path), Path("camera_bag"))
+            with self.assertLogs("rosbagsApp.bag_storage.storage", "ERROR"):
+                bag.generate_thumbnails()
+            self.assertEqual(bag.metadata.thumbnails.keys(), {"/camera/image"})
+            version = thumbnail_generator(Image.__msgtype__).version
+            self.assertEqual(bag.metadata.thumbnail_failures, {"/depth/image": version})
+            # Not retried until the generator changes
+            bag = ROSBag(Path(base_path), Path("camera_bag"))
+            self.assertFalse(bag.thumbnails_outdated())
+            generator = thumbnail_generator(Image.__msgtype__)
+            with mock.patch.dict(THUMBNAIL_GENERATORS, {generator.msgtype: dataclasses.replace(generator,
+                                                                                               version=version + 1)}):
+                self.assertTrue(bag.thumbnails_outdated())
+
+    def test_create_thumbnail_compressed_images(self):
+        with tempfile.TemporaryDirectory() as base_path:
+            with rb.Writer(Path(base_path) / "camera_bag") as writer:
+                connection = writer.add_connection("/camera/image/compressed", CompressedImage.__msgtype__)
+                for i in range(20):
+                    timestamp = 1000000000 + i * 100000000
+                    jpeg = cv2.imencode(".jpg", np.full((1080, 1920, 3), i * 10, dtype=np.uint8))[1].reshape(-1)
+                    msg = CompressedImage(Header(Time(timestamp // 1000000000, timestamp % 1000000000), "camera"),
+                                          format="jpeg", data=jpeg)
+                    writer.write(connection, timestamp, serialize_cdr(msg, CompressedImage.__msgtype__))
+
+            bag = ROSBag(Path(base_path), Path("camera_bag"))
+            bag.generate_thumbnails()
+            large_name, = bag.detail_thumbnails()["/camera/image/compressed"]
+            video_name, = bag.preview_videos()["/camera/image/compressed"]
+            large = cv2.imread(str(bag.path / "thumbnails" / large_name), cv2.IMREAD_GRAYSCALE)
+            self.assertEqual(large.shape, (IMAGE_THUMBNAIL_SIZES["large"], 8 * 427))
+            # First image of each eighth of the recording
+            np.testing.assert_allclose([large[:, i * 427:(i + 1) * 427].mean() for i in range(8)],
+                                       np.ceil(np.arange(8) * 19 / 8) * 10, atol=2)
+            video = cv2.VideoCapture(str(bag.path / "thumbnails" / video_name))
+            self.assertEqual(video.read()[1].shape, (PREVIEW_VIDEO_HEIGHT, 426, 3))
+            video.release()
+
+
+class FieldDecoderTests(TestCase):
+    fields = ["header.stamp.sec", "header.stamp.nanosec", "pose.x", "light_switch_rear"]
+
+    def setUp(self):
+        register_spatz_types()
+        with rb.Reader(Path(TEST_DATA_PATH) / "test_state_only") as reader:
+            self.messages = [bytes(rawdata) for _, _, rawdata in reader.messages()]
+
+    def assertDecodedCorrectly(self, decoder: FieldDecoder, messages: list[bytes]):
+        decoded = decoder.decode(messages)
+        for name in self.fields:
+            expected = []
+            for rawdata in messages:
+                value = deserialize_cdr(rawdata, decoder.msgtype)
+                for part in name.split("."):
+                    value = getattr(value, part)
+                expected.append(value)
+            self.assertEqual(decoded[name].tolist(), expected, msg=name)
+
+    def test_matches_deserialize_cdr(self):
+        decoder = FieldDecoder("spatz_interfaces/msg/Spatz", self.fields, batch_size=100)
+        self.assertDecodedCorrectly(decoder, self.messages)
+        self.assertEqual(decoder.fallback_count, 0)
+
+    def test_varying_string_length(self):
+        # A different frame_id length shifts the following fields, even if the payload size stays the same (padding)
+        msg = deserialize_cdr(self.messages[1], "spatz_interfaces/msg/Spatz")
+        msg.header.frame_id = ""
+        same_size = bytes(serialize_cdr(msg, "spatz_interfaces/msg/Spatz"))
+        self.assertEqual(len(same_size), len(self.messages[0]))
+        msg.header.frame_id = "a" * 16
+        longer = bytes(serialize_cdr(msg, "spatz_interfaces/msg/Spatz"))
+
+        decoder = FieldDecoder("spatz_interfaces/msg/Spatz", self.fields)
+        self.assertDecodedCorrectly(decoder, [self.messages[0], same_size, self.messages[2], longer, self.messages[3]])
+        # Only the message with the same size but different layout is deserialized
+        self.assertEqual(decoder.fallback_count, 1)
+
+    def test_unknown_field(self):
+        with self.assertRaises(ValueError):
+            FieldDecoder("spatz_interfaces/msg/Spatz", ["header.frame_id"])
+
+    def test_empty(self):
+        decoded = FieldDecoder("spatz_interfaces/msg/Spatz", self.fields).decode([])
+        self.assertEqual(decoded["pose.x"].shape, (0,))
+
+
+class TopicStatisticsTests(TestCase):
+    def test_matches_reader(self):
+        path = Path(TEST_DATA_PATH) / "test_state_only"
+        with rb.Reader(path) as reader:
+            timestamps = np.array([t for _, t, _ in reader.messages()])
+            size = sum(len(rawdata) for _, _, rawdata in reader.messages())
+        intervals = np.diff(timestamps)
+
+        stats = compute_topic_statistics(path)["/spatz"]
+        self.assertEqual(stats.msgcount, len(timestamps))
+        self.assertEqual(stats.bytes, size)
+        self.assertAlmostEqual(stats.rate, len(intervals) / ((timestamps[-1] - timestamps[0]) * 1e-9))
+        self.assertAlmostEqual(stats.jitter, np.std(intervals * 1e-9), places=6)
+        self.assertAlmostEqual(stats.max_gap, intervals.max() * 1e-9)
+        self.assertEqual(len(stats.gaps), REPORTED_GAPS)
+        self.assertEqual(len(stats.density), DENSITY_BINS)
+        self.assertEqual(sum(stats.density), len(timestamps))
+
+    def test_gaps_across_chunks(self):
+        with tempfile.TemporaryDirectory() as base_path:
+            path = Path(base_path) / "bag"
+            # 1 kHz with a dropout of 0.5 s, the longest gap spans two chunks
+            timestamps = [i * 1000000 for i in range(2000)]
+            timestamps += [timestamps[-1] + 500000000 + i * 1000000 for i in range(1000)]
+            with rb.Writer(path) as writer:
+                connection = writer.add_connection("/clock", "builtin_interfaces/msg/Time")
+                for timestamp in timestamps:
+                    writer.write(connection, timestamp, serialize_cdr(Time(sec=0, nanosec=0), Time.__msgtype__))
+
+            with mock.patch("rosbagsApp.bag_storage.topic_statistics.CHUNK_SIZE", 2000):
+                stats = compute_topic_statistics(path)["/clock"]
+            self.assertEqual(stats.msgcount, 3000)
+            self.assertEqual(stats.gaps[0], (timestamps[1999], 500000000))
+            self.assertAlmostEqual(stats.max_gap, 0.5)
+            self.assertEqual(sum(stats.density), 3000)
+            # No messages during the dropout
+            self.assertIn(0, stats.density)
+
+    def test_stored_in_bag(self):
+        with tempfile.TemporaryDirectory() as base_path:
+            shutil.copytree(Path(TEST_DATA_PATH) / "test_state_only", Path(base_path) / "bag")
+            bag = BagStorage(base_path).find_by_name("bag")
+            self.assertIsNone(bag.topic_statistics())
+            bag.update_topic_statistics()
+            self.assertEqual(bag.topic_statistics(), compute_topic_statistics(bag.path))
+
+            (topic, stats), = bag.topics_with_statistics()
+            self.assertEqual(topic.name, "/spatz")
+            self.assertEqual(stats.msgcount, topic.nr_of_messages)
+
+            # Outdated once the bag is rewritten
+            os.utime(bag.path / "metadata.yaml", ns=(0, 0))
+            self.assertIsNone(bag.topic_statistics())
+
+
+class ReaderPoolTests(TestCase):
+    def setUp(self):
+        self.path = (Path(TEST_DATA_PATH) / "test_state_only").resolve()
+        with rb.Reader(self.path) as reader:
+            self.timestamps = [t for _, t, _ in reader.messages()]
+
+    def test_lookup(self):
+        pool = ReaderPool(2, 60)
+        with pool.open(self.path) as bag:
+            self.assertEqual(bag.msgcount("/spatz"), len(self.timestamps))
+            self.assertEqual(bag.msgcount("/missing"), 0)
+            messages = bag.messages_at_index("/spatz", 10, 3)
+            self.assertEqual([(i, t) for i, t, _ in messages], [(i, self.timestamps[i]) for i in range(10, 13)])
+            self.assertEqual(len(bag.messages_at_index("/spatz", len(self.timestamps) - 1, 3)), 1)
+            self.assertEqual(bag.messages_at_index("/spatz", len(self.timestamps)), [])
+
+            self.assertEqual(bag.nearest_index("/spatz", 0), 0)
+            self.assertEqual(bag.nearest_index("/spatz", self.timestamps[20] + 1), 20)
+            self.assertEqual(bag.nearest_index("/spatz", self.timestamps[21] - 1), 21)
+            self.assertEqual(bag.nearest_index("/spatz", self.timestamps[-1] + 10 ** 9), len(self.timestamps) - 1)
+            self.assertIsNone(bag.nearest_index("/missing", 0))
+
+    def test_idle_bags_closed_by_timer(self):
+        pool = ReaderPool(2, 0.05)
+        with pool.open(self.path) as bag:
+            # Opening does not read the messages, counts are taken from metadata.yaml
+            self.assertEqual(bag._topic_indexes, {})
+            self.assertEqual(bag.msgcount("/spatz"), len(self.timestamps))
+            time.sleep(0.2)
+            # Not closed while in use
+            self.assertFalse(bag.closed)
+        for _ in range(100):
+            if bag.closed:
+                break
+            time.sleep(0.01)
+        # Closed without a further request
+        self.assertTrue(bag.closed)
+        self.assertEqual(len(pool), 0)
+
+    def test_lookup_uses_topic_index(self):
+        pool = ReaderPool(1, 60)
+        with pool.open(self.path) as bag:
+            bag.nearest_index("/spatz", 0)
+            statements = []
+            for db, _ in bag._databases:
+                db.set_trace_callback(statements.append)
+            self.assertEqual(bag.nearest_index("/spatz", self.timestamps[500]), 500)
+            self.assertEqual([t for _, t, _ in bag.messages_at_index("/spatz", 600, 2)], self.timestamps[600:602])
+            for db, _ in bag._databases:
+                db.set_trace_callback(None)
+        # Timestamps are looked up in the index, only the requested messages are read by their id
+        self.assertEqual(len(statements), 1)
+        self.assertIn("WHERE id IN (", statements[0])
+
+    def test_reused_and_evicted(self):
+        pool = ReaderPool(1, 60)
+        with pool.open(self.path) as bag:
+            pass
+        with pool.open(self.path) as reused:
+            self.assertIs(reused, bag)
+
+        # Least recently used bag is closed when the pool is full
+        with pool.open((Path(TEST_DATA_PATH) / "test_state_only_with_thumbs").resolve()):
+            pass
+        self.assertEqual(len(pool), 1)
+        self.assertTrue(bag.closed)
+
+        # Idle bags are closed
+        pool.idle_timeout = 0
+        with pool.open(self.path) as bag:
+            pass
+        with pool.open(self.path) as reopened:
+            self.assertIsNot(reopened, bag)
+        self.assertTrue(bag.closed)
+        pool.clear()
+        self.assertEqual(len(pool), 0)
+
+    def test_unreadable(self):
+        with self.assertRaises(rb.ReaderError):
+            with ReaderPool(1, 60).open((Path(TEST_DATA_PATH) / "unit_test_bag").resolve()):
+                pass
+
+    def test_evicted_while_in_use(self):
+        pool = ReaderPool(1, 60)
+        with pool.open(self.path) as bag:
+            pool.clear()
+            self.assertFalse(bag.closed)
+            self.assertEqual(len(bag.messages_at_index("/spatz", 0)), 1)
+        self.assertTrue(bag.closed)
+
+
+class ParallelReaderTests(TestCase):
+    def setUp(self):
+        self.base_path = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.base_path.cleanup()
+        DecompressionCache.clear_shared()
+
+    def write_split_bag(self, name: str, splits: list[list[int]], compression=rb.Writer.CompressionMode.NONE) -> Path:
+        """Bag with one database file per split, each containing messages on /a and /b at the given timestamps"""
+        path = Path(self.base_path.name) / name
+        path.mkdir()
+        yaml = YAML(typ="safe")
+        infos = []
+        for i, timestamps in enumerate(splits):
+            writer = rb.Writer(path / f"split_{i}")
+            writer.set_compression(compression, rb.Writer.CompressionFormat.ZSTD)
+            with writer:
+                connections = [writer.add_connection(topic, Header.__msgtype__) for topic in ("/a", "/b")]
+                for k, timestamp in enumerate(timestamps):
+                    msg = Header(Time(timestamp // 1000000000, timestamp % 1000000000), f"{i}_{k}")
+                    writer.write(connections[k % 2], timestamp, serialize_cdr(msg, Header.__msgtype__))
+            infos.append(yaml.load(path / f"split_{i}" / "metadata.yaml")["rosbag2_bagfile_information"])
+            for file in infos[-1]["relative_file_paths"]:
+                (path / f"split_{i}" / file).rename(path / file)
+            shutil.rmtree(path / f"split_{i}")
+
+        metadata = infos[0]
+        start = min(info["starting_time"]["nanoseconds_since_epoch"] for info in infos)
+        end = max(info["starting_time"]["nanoseconds_since_epoch"] + info["duration"]["nanoseconds"] for info in infos)
+        metadata["relative_file_paths"] = [file for info in infos for file in info["relative_file_paths"]]
+        metadata["files"] = [file for info in infos for file in info["files"]]
+        metadata["starting_time"]["nanoseconds_since_epoch"] = start
+        metadata["duration"]["nanoseconds"] = end - start
+        for k, topic in enumerate(metadata["topics_with_message_count"]):
+            topic["message_count"] = sum(info["topics_with_message_count"][k]["message_count"] for info in infos)
+        metadata["message_count"] = sum(info["message_count"] for info in infos)
+        yaml.dump({"rosbag2_bagfile_information": metadata}, path / "metadata.yaml")
+        return path
+
+    @staticmethod
+    def read(reader, *args) -> list[tuple[str, int, bytes]]:
+        return [(c.topic, t, bytes(data)) for c, t, data in reader.messages(*args)]
+
+    def test_merge(self):
+        # Overlapping splits (not recorded consecutively), the middle one ends before the first one
+        path = self.write_split_bag("overlapping", [
+            list(range(100, 5000, 10)), list(range(2003, 3000, 10)), list(range(4507, 9000, 5))])
+        with rb.Reader(path) as reader:
+            expected = sorted(self.read(reader), key=lambda m: m[1])
+            connection_b = [c for c in reader.connections if c.topic == "/b"]
+
+        for threads in (1, 2, 8):
+            with ParallelReader(path, threads) as reader:
+                self.assertEqual(reader.start_time, 100)
+                self.assertEqual(self.read(reader), expected)
+                self.assertEqual(self.read(reader, connection_b), [m for m in expected if m[0] == "/b"])
+                self.assertEqual(self.read(reader, (), 2500, 4600), [m for m in expected if 2500 <= m[1] < 4600])
+                # Stopped after the first message
+                messages = reader.messages(start=3000)
+                self.assertEqual(next(messages)[1], min(m[1] for m in expected if m[1] >= 3000))
+                messages.close()
+
+    def test_compression(self):
+        splits = [list(range(0, 1000, 5)), list(range(1000, 2000, 5))]
+        for mode in (rb.Writer.CompressionMode.FILE, rb.Writer.CompressionMode.MESSAGE):
+            path = self.write_split_bag(mode.name, splits, mode)
+            with rb.Reader(path) as reader:
+                expected = self.read(reader)
+            with ParallelReader(path, 2) as reader:
+                self.assertEqual(reader.compression_mode, mode.name.lower())
+                self.assertEqual(self.read(reader), expected)
+                self.assertEqual(self.read(reader, (), 995, 1010), expected[199:202])
+
+    def test_unreadable(self):
+        path = self.write_split_bag("broken", [[1, 2, 3], [4, 5, 6]])
+        (path / "split_1.db3").write_bytes(b"not a database")
+        with ParallelReader(path) as reader, self.assertRaises(rb.ReaderError):
+            self.read(reader)
+
+    def test_decompression_cache(self):
+        paths = [next(self.write_split_bag(f"bag_{i}", [list(range(1000))], rb.Writer.CompressionMode.FILE)
+                      .glob("*.zstd")) for i in range(2)]
+        cache = DecompressionCache(0)
+        with cache.open(paths[0]) as first:
+            with cache.open(paths[0]) as shared:
+                self.assertEqual(shared, first)
+            # Kept while in use
+            with cache.open(paths[1]):
+                self.assertTrue(first.exists())
+        # Evicted once unused
+        self.assertFalse(first.exists())
+
+        cache.max_bytes = 10 * 1024 * 1024
+        with cache.open(paths[0]) as first:
+            pass
+        # Kept while the cache is not full
+        with cache.open(paths[0]) as reused:
+            self.assertEqual(reused, first)
+        cache.clear()
+        self.assertFalse(first.exists())
+
+        with self.assertRaises(rb.ReaderError):
+            with cache.open(paths[0].with_name("missing.db3.zstd")):
+                pass
+
+    def test_decompression_cache_of_killed_process(self):
+        path = next(self.write_split_bag("bag", [list(range(1000))], rb.Writer.CompressionMode.FILE).glob("*.zstd"))
+        context = multiprocessing.get_context("fork")
+        decompressed_event = context.Event()
+
+        def decompress_and_wait():
+            with DecompressionCache.shared().open(path):
+                decompressed_event.set()
+                time.sleep(60)
+
+        process = context.Process(target=decompress_and_wait, daemon=True)
+        process.start()
+        try:
+            self.assertTrue(decompressed_event.wait(30))
+            directory = DecompressionCache.process_directory(process.pid)
+            self.assertEqual(len(list(directory.rglob("*.db3"))), 1)
+            # Still running
+            DecompressionCache.remove_stale()
+            self.assertTrue(directory.exists())
+        finally:
+            process.kill()
+            process.join()
+        DecompressionCache.remove_stale()
+        self.assertFalse(directory.exists())
+
+
+class MessagesApiTests(TestCase):
+    def setUp(self):
+        self.test_user = get_user_model().objects.create_user("temporary")
+        self.client.force_login(self.test_user)
+        self.url = reverse("rosbags:messages_api")
+
+    def test_by_index(self):
+        response = self.client.get(self.url, {"bag_path": "test_state_only", "topic": "/spatz", "index": 5,
+                                              "count": 2})
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(result["msgtype"], "spatz_interfaces/msg/Spatz")
+        self.assertEqual(result["msgcount"], 640)
+        self.assertEqual([m["index"] for m in result["messages"]], [5, 6])
+        message = result["messages"][0]["message"]
+        self.assertEqual(result["messages"][0]["timestamp"],
+                         message["header"]["stamp"]["sec"] * 10 ** 9 + message["header"]["stamp"]["nanosec"])
+        self.assertIn("x", message["pose"])
+        self.assertIsNone(result["messages"][0]["preview"])
+
+    def test_by_timestamp(self):
+        first = self.client.get(self.url, {"bag_path": "test_state_only", "topic": "/spatz", "index": 100}).json()
+        timestamp = first["messages"][0]["timestamp"]
+        result = self.client.get(self.url, {"bag_path": "test_state_only", "topic": "/spatz",
+                                            "timestamp": timestamp + 1}).json()
+        self.assertEqual(result["messages"], first["messages"])
+
+    def test_invalid_parameters(self):
+        for params in [{"topic": "/spatz", "index": 0}, {"bag_path": "test_state_only", "topic": "/spatz"},
+                       {"bag_path": "test_state_only", "topic": "/spatz", "index": "a"},
+                       {"bag_path": "test_state_only", "topic": "/spatz", "index": 0, "count": 1000}]:
+            self.assertEqual(self.client.get(self.url, params).status_code, 400, msg=params)
+        for params in [{"bag_path": "missing", "topic": "/spatz", "index": 0},
+                       {"bag_path": "test_state_only", "topic": "/missing", "index": 0}]:
+            self.assertEqual(self.client.get(self.url, params).status_code, 404, msg=params)
+
+    def test_message_to_json(self):
+        header = Header(stamp=Time(sec=1, nanosec=2), frame_id="camera")
+        image = Image(header=header, height=480, width=640, encoding="bayer_rggb8", is_bigendian=0, step=640,
+                      data=np.zeros((480 * 640,), dtype=np.uint8))
+        result = message_to_json(image)
+        self.assertEqual(result["header"], {"stamp": {"sec": 1, "nanosec": 2}, "frame_id": "camera"})
+        self.assertEqual(result["data"], {"length": 480 * 640, "items": [0] * MAX_ARRAY_ITEMS})
+        self.assertEqual(message_to_json([float("nan"), 1.0]), ["nan", 1.0])
+        json.dumps(result)
+
+        preview = image_preview(image)
+        self.assertTrue(preview.startswith("data:image/png;base64,"))
+        png = cv2.imdecode(np.frombuffer(base64.b64decode(preview.split(",")[1]), dtype=np.uint8), cv2.IMREAD_COLOR)
+        self.assertEqual(png.shape, (240, 320, 3))
+
+
+class TimeSeriesTests(TestCase):
+    def setUp(self):
+        self.test_user = get_user_model().objects.create_user("temporary")
+        self.client.force_login(self.test_user)
+        self.url = reverse("rosbags:timeseries_api")
+
+    def tearDown(self):
+        shutil.rmtree(Path(TEST_DATA_PATH) / "test_state_only" / timeseries_dir_name, ignore_errors=True)
+
+    def test_downsampling_keeps_extremes(self):
+        timestamps = np.arange(100000, dtype=np.int64) * 10000000
+        values = np.sin(np.arange(100000) / 1000)
+        values[12345] = 5
+        values[54321] = np.nan
+        cache = TimeSeriesCache.build(timestamps, values)
+
+        series = cache.query(500)
+        self.assertTrue(series.downsampled)
+        self.assertLessEqual(len(series.values), 2 * 500)
+        self.assertEqual(series.count, 100000)
+        self.assertIn(5, series.values)
+        self.assertEqual(np.nanmin(series.values), np.nanmin(values))
+        self.assertTrue(np.all(np.diff(series.timestamps) > 0))
+
+        # Zoomed in far enough, all values are returned
+        series = cache.query(500, timestamps[1000], timestamps[1500])
+        self.assertFalse(series.downsampled)
+        np.testing.assert_array_equal(series.values, values[1000:1501])
+
+    def test_api(self):
+        register_spatz_types()
+        with rb.Reader(Path(TEST_DATA_PATH) / "test_state_only") as reader:
+            messages = [(t, deserialize_cdr(d, c.msgtype).velocity.x) for c, t, d in reader.messages()
+                        if c.topic == "/spatz"]
+        params = {"bag_path": "test_state_only", "topic": "/spatz", "field": "velocity.x"}
+        result = self.client.get(self.url, dict(params, width=10000)).json()
+        self.assertFalse(result["downsampled"])
+        self.assertEqual(list(zip(result["timestamps"], result["values"])), messages)
+        self.assertTrue((Path(TEST_DATA_PATH) / "test_state_only" / timeseries_dir_name).is_dir())
+
+        result = self.client.get(self.url, dict(params, width=100, start=messages[10][0])).json()
+        self.assertTrue(result["downsampled"])
+        self.assertEqual(result["count"], len(messages) - 10)
+        self.assertLessEqual(len(result["values"]), 200)
+        self.assertEqual(max(result["values"]), max(v for _, v in messages[10:]))
+
+    def test_cache_per_topic_and_field(self):
+        path = Path(TEST_DATA_PATH) / "test_state_only"
+        # Topics with equal slugs get separate caches, the field is not used in the file name
+        self.assertNotEqual(cache_path(path, "/Spatz", "x"), cache_path(path, "/spatz", "x"))
+        self.assertNotEqual(cache_path(path, "/camera/left/image", "x"), cache_path(path, "/camera/leftimage", "x"))
+        self.assertEqual(cache_path(path, "/spatz", "../../x").parent, path / timeseries_dir_name)
+
+        cache = TimeSeriesCache.build(np.arange(10, dtype=np.int64), np.arange(10, dtype=np.float64))
+        file = cache_path(path, "/spatz", "pose.x")
+        cache.save(file, 1, "/spatz", "pose.x")
+        self.assertIsNotNone(TimeSeriesCache.load(file, 1, "/spatz", "pose.x"))
+        self.assertIsNone(TimeSeriesCache.load(file, 1, "/Spatz", "pose.x"))
+        self.assertIsNone(TimeSeriesCache.load(file, 1, "/spatz", "pose.y"))
+
+    def test_invalid_parameters(self):
+        params = {"bag_path": "test_state_only", "topic": "/spatz", "field": "velocity.x"}
+        for invalid in [{"field": None}, {"width": 0}, {"width": "a"}, {"field": "header.frame_id"}]:
+            query = {k: v for k, v in dict(params, **invalid).items() if v is not None}
+            self.assertEqual(self.client.get(self.url, query).status_code, 400, msg=invalid)
+        for invalid in [{"bag_path": "missing"}, {"topic": "/missing"}]:
+            self.assertEqual(self.client.get(self.url, dict(params, **invalid)).status_code, 404, msg=invalid)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.test_user = get_user_model().objects.create_user("temporary")
+        self.client.force_login(self.test_user)
+        self.output_dir = tempfile.TemporaryDirectory()
+        with rb.Reader(Path(TEST_DATA_PATH) / "test_state_only") as reader:
+            self.messages = [(c.topic, t, bytes(d)) for c, t, d in reader.messages()]
+
+    def tearDown(self):
+        self.output_dir.cleanup()
+
+    def extract(self, chunks) -> list[tuple[str, int, bytes]]:
+        with tarfile.open(fileobj=io.BytesIO(b"".join(chunks))) as tar:
+            tar.extractall(self.output_dir.name)
+        with rb.Reader(Path(self.output_dir.name) / "test_state_only_clip") as reader:
+            return [(c.topic, t, bytes(d)) for c, t, d in reader.messages()]
+
+    def test_time_range(self):
+        start, stop = self.messages[100][1], self.messages[200][1]
+        chunks = export_clip(Path(TEST_DATA_PATH) / "test_state_only", "test_state_only_clip", ["/spatz"], start,
+                             stop, split_size=4096)
+        self.assertEqual(self.extract(chunks), [m for m in self.messages if start <= m[1] < stop])
+        self.assertGreater(len(list((Path(self.output_dir.name) / "test_state_only_clip").glob("*.db3"))), 1)
+
+    def test_api(self):
+        response = self.client.get(reverse("rosbags:export"), {"bag_path": "test_state_only", "topic": "/spatz"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="test_state_only_clip.tar"')
+        self.assertEqual(self.extract(response.streaming_content), self.messages)
+
+    def test_first_split_small(self):
+        with mock.patch("rosbagsApp.bag_storage.export.FIRST_SPLIT_SIZE", 1024):
+            chunks = list(export_clip(Path(TEST_DATA_PATH) / "test_state_only", "test_state_only_clip", ["/spatz"]))
+        self.assertEqual(self.extract(chunks), self.messages)
+        # The clip is far below ROSBAG_EXPORT_SPLIT_SIZE, the first splits are still sent separately
+        self.assertGreater(len(list((Path(self.output_dir.name) / "test_state_only_clip").glob("*.db3"))), 1)
+
+    def test_invalid_parameters(self):
+        url = reverse("rosbags:export")
+        for params in [{}, {"bag_path": "test_state_only", "start": "a"},
+                       {"bag_path": "test_state_only", "start": 2, "stop": 1}]:
+            self.assertEqual(self.client.get(url, params).status_code, 400, msg=params)
+        for params in [{"bag_path": "missing"}, {"bag_path": "test_state_only", "topic": "/missing"}]:
+            self.assertEqual(self.client.get(url, params).status_code, 404, msg=params)
+
+    def test_command(self):
+        output = Path(self.output_dir.name) / "clip.tar"
+        call_command("export_clip", "test_state_only", str(output), "--stop", str(self.messages[10][1]))
+        self.assertEqual(self.extract([output.read_bytes()]), self.messages[:10])
+
+
+class AsgiTests(TestCase):
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create_user("temporary"))
+        self.handler = ASGIHandler()
+
+    def request(self, path: str, query: str, disconnect: Callable[[list[dict]], bool]) -> list[dict]:
+        """
+        Request using the ASGI handler
+        :param disconnect: Called with the sent messages, the client disconnects once it returns True
+        :return: Messages sent by the handler
+        """
+        cookie = f"sessionid={self.client.cookies['sessionid'].value}".encode()
+        scope = {"type": "http", "method": "GET", "path": path, "query_string": query.encode(),
+                 "server": ("testserver", 80), "headers": [(b"host", b"testserver"), (b"cookie", cookie)]}
+        sent = []
+        body_received = threading.Event()
+
+        async def receive():
+            if not body_received.is_set():
+                body_received.set()
+                return {"type": "http.request", "body": b"", "more_body": False}
+            while not disconnect(sent):
+                await asyncio.sleep(0.01)
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        async_to_sync(self.handler)(scope, receive, send)
+        return sent
+
+    def test_streaming(self):
+        sent = self.request(reverse("rosbags:export"), "bag_path=test_state_only", lambda sent: False)
+        self.assertEqual(sent[0]["status"], 200)
+        self.assertNotIn("more_body", sent[-1])
+        with tarfile.open(fileobj=io.BytesIO(b"".join(m.get("body", b"") for m in sent[1:]))) as tar:
+            self.assertIn("test_state_only_clip/metadata.yaml", tar.getnames())
+
+    def test_streaming_pool(self):
+        threads = []
+
+        def export(*args, **kwargs):
+            threads.append(threading.current_thread().name)
+            yield b"x"
+
+        with mock.patch("rosbagsApp.views.export_clip", export), \
+                mock.patch.object(rosbagsApp.settings, "ROSBAG_STREAM_THREADS", 2):
+            sent = self.request(reverse("rosbags:export"), "bag_path=test_state_only", lambda sent: False)
+        self.assertEqual(b"".join(m.get("body", b"") for m in sent[1:]), b"x")
+        # Not sent by a thread of the pool of views
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith("rosbagsApp-stream"), msg=threads[0])
+
+    def test_streaming_cancelled(self):
+        exported = []
+
+        def export(*args, **kwargs):
+            try:
+                for i in range(1000):
+                    exported.append(i)
+                    yield b"x" * 1024
+            finally:
+                exported.append("closed")
+
+        with mock.patch("rosbagsApp.views.export_clip", export):
+            sent = self.request(reverse("rosbags:export"), "bag_path=test_state_only", lambda sent: len(sent) > 5)
+        self.assertEqual(sent[0]["status"], 200)
+        self.assertTrue(all(m.get("more_body") for m in sent[1:]))
+        # The export is stopped after the disconnect
+        self.assertEqual(exported[-1], "closed")
+        self.assertLess(len(exported), 1000)
+
+    def test_view_cancelled(self):
+        started = threading.Event()
+        cancelled = []
+
+        def slow_timeseries(*args):
+            started.set()
+            for _ in range(500):
+                try:
+                    raise_if_cancelled()
+                except RequestAborted:
+                    cancelled.append(True)
+                    raise
+                time.sleep(0.01)
+            self.fail("Not cancelled")
+
+        with mock.patch("rosbagsApp.views.timeseries", slow_timeseries):
+            sent = self.request(reverse("rosbags:timeseries_api"),
+                                "bag_path=test_state_only&topic=/spatz&field=velocity.x", lambda sent: started.is_set())
+        self.assertEqual(sent, [])
+        self.assertEqual(cancelled, [True])
+
+    def test_run_blocking(self):
+        variable = contextvars.ContextVar("variable")
+        variable.set("request")
+        with mock.patch.object(rosbagsApp.settings, "ROSBAG_IO_THREADS", 2):
+            thread, value = async_to_sync(run_blocking)(lambda: (threading.get_ident(), variable.get()))
+        self.assertNotEqual(thread, threading.get_ident())
+        self.assertEqual(value, "request")
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        self.test_user = get_user_model().objects.create_user("temporary")
+        self.client.force_login(self.test_user)
+
+    def test_disabled(self):
+        self.assertIs(span("scan"), span("catalog"))
+        response = self.client.get(reverse("rosbags:bags_api"))
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 404)
+
+    def test_server_timing_and_metrics(self):
+        with mock.patch.object(rosbagsApp.settings, "ROSBAG_INSTRUMENTATION", True):
+            response = self.client.get(reverse("rosbags:bags_api"))
+            self.assertRegex(response["Server-Timing"], r'^(\w+;dur=[0-9.]+;desc="\d+x", )*total;dur=[0-9.]+$')
+            self.assertIn("scan;dur=", response["Server-Timing"])
+            self.assertIn("serialize;dur=", response["Server-Timing"])
+            response = self.client.get(reverse("rosbags:detail", args=["test_state_only"]))
+            self.assertIn("render;dur=", response["Server-Timing"])
+
+            response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        metrics = response.content.decode()
+        self.assertRegex(metrics, r'rosbag_request_seconds_count\{view="rosbags:detail"\} [1-9]\d*')
+        self.assertRegex(metrics, r'rosbag_bags_scanned_per_request_bucket\{view="rosbags:bags_api",le="\+Inf"\} \d+')
+        self.assertRegex(metrics, r'rosbag_cache_lookups_total\{cache="bag_index",result="(hit|miss)"\} \d+')
+        self.assertRegex(metrics, r'rosbag_span_seconds_sum\{span="scan"\} [0-9.e-]+')
+
+    def test_metrics_of_all_processes(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(rosbagsApp.settings, "ROSBAG_INSTRUMENTATION", True), \
+                mock.patch.object(rosbagsApp.settings, "ROSBAG_METRICS_DIR", directory):
+            self.client.get(reverse("rosbags:bags_api"))
+            count = cache_lookups_total.value(cache="bag_index", result="hit")
+            # Written by another worker
+            other = Counter(cache_lookups_total.name, cache_lookups_total.help_text)
+            other.inc(5, cache="bag_index", result="hit")
+            other_requests = Histogram(request_seconds.name, request_seconds.help_text, request_seconds.buckets)
+            other_requests.observe(0.001, view="other")
+            (Path(directory) / "1-1.json").write_text(json.dumps({other.name: other.snapshot(),
+                                                                  other_requests.name: other_requests.snapshot()}))
+
+            metrics = self.client.get(reverse("metrics")).content.decode()
+            self.assertIn(f'rosbag_cache_lookups_total{{cache="bag_index",result="hit"}} {count + 5}\n', metrics)
+            self.assertIn('rosbag_request_seconds_count{view="other"} 1\n', metrics)
+            self.assertRegex(metrics, r'rosbag_request_seconds_count\{view="rosbags:bags_api"\} [1-9]')
+            self.assertEqual(len(list(Path(directory).glob("*.json"))), 2)
+
+    def test_histogram_exposition(self):
+        histogram = Histogram("test_seconds", "Test", (0.1, 1.0, float("inf")))
+        histogram.observe(0.05, view="a")
+        histogram.observe(0.5, view="a")
+        self.assertEqual(histogram.exposition(), [
+            "# HELP test_seconds Test",
+            "# TYPE test_seconds histogram",
+            'test_seconds_bucket{view="a",le="0.1"} 1',
+            'test_seconds_bucket{view="a",le="1.0"} 2',
+            'test_seconds_bucket{view="a",le="+Inf"} 2',
+            'test_seconds_sum{view="a"} 0.55',
+            'test_seconds_count{view="a"} 2',
+        ])
+
+
+class ThumbnailJobTests(TestCase):
+    def setUp(self):
+        self.test_user = get_user_model().objects.create_user("temporary")
+
+    def test_login_required(self):
+        job = ThumbnailJob.objects.create(storage_path=str(Path(TEST_DATA_PATH).resolve()), bag_path="missing",
+                                          timeout=10)
+        for url, params in [(reverse("rosbags:generate_thumbnails"), {"bag_path": "test_state_only"}),
+                            (reverse("rosbags:thumbnail_job", args=[job.id]), {})]:
+            self.assertEqual(self.client.get(url, params).status_code, 302, msg=url)
+        self.assertFalse(ThumbnailJob.objects.exclude(id=job.id).exists())
+
+    def test_enqueue_deduplicated(self):
+        self.client.force_login(self.test_user)
+        response = self.client.get(reverse("rosbags:generate_thumbnails"), {"bag_path": "test_state_only"})
+        self.assertEqual(response.status_code, 200)
+        job = response.json()
+        self.assertEqual(job["status"], ThumbnailJob.QUEUED)
+
+        response = self.client.get(reverse("rosbags:generate_thumbnails"), {"bag_path": "test_state_only"})
+        self.assertEqual(response.json()["id"], job["id"])
+
+        response = self.client.get(reverse("rosbags:thumbnail_job", args=[job["id"]]))
+        self.assertEqual(response.json()["status"], ThumbnailJob.QUEUED)
+
+    def test_enqueue_after_finished(self):
+        bs = BagStorage(TEST_DATA_PATH)
+        bag = bs.find_by_name("test_state_only")
+        job = enqueue_thumbnail_job(bs, bag)
+        ThumbnailJob.objects.filter(id=job.id).update(status=ThumbnailJob.FAILED)
+        self.assertNotEqual(enqueue_thumbnail_job(bs, bag).id, job.id)
+
+    def test_run_job(self):
+        bs = BagStorage(TEST_DATA_PATH)
+        bag = bs.find_by_name("test_state_only")
+        amd_path = bag.path / additional_metadata_file_name
+        original_amd = amd_path.read_text()
+
+        job = enqueue_thumbnail_job(bs, bag)
+        try:
+            run_thumbnail_job(job.id)
+            job.refresh_from_db()
+            self.assertEqual(job.status, ThumbnailJob.DONE, msg=job.error)
+            self.assertEqual(job.progress, 1.0)
+            (thumb_name,) = AdditionalMetadata.from_file(amd_path).thumbnails["/spatz"]
+            self.assertTrue(os.path.exists(bag.path / "thumbnails" / thumb_name))
+            self.assertIsNotNone(bag.topic_statistics())
+        finally:
+            # Cleanup: restore metadata, delete thumbnails and statistics
+            amd_path.write_text(original_amd)
+            shutil.rmtree(bag.path / "thumbnails", ignore_errors=True)
+            (bag.path / topic_statistics_file_name).unlink(missing_ok=True)
+
+    def test_run_job_missing_bag(self):
+        job = ThumbnailJob.objects.create(storage_path=str(Path(TEST_DATA_PATH).resolve()), bag_path="missing",
+                                          timeout=10)
+        run_thumbnail_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ThumbnailJob.FAILED)
+        self.assertIn("not found", job.error)
+
+    def test_run_job_error_hidden(self):
+        bs = BagStorage(TEST_DATA_PATH)
+        job = enqueue_thumbnail_job(bs, bs.find_by_name("test_state_only"))
+        with mock.patch.object(ROSBag, "generate_thumbnails", side_effect=OSError("/secret/path is broken")), \
+                self.assertLogs("rosbagsApp.jobs", "ERROR") as logs:
+            run_thumbnail_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ThumbnailJob.FAILED)
+        self.assertEqual(job.error, "Thumbnail generation failed (OSError)")
+        # The traceback is only logged
+        self.assertIn("/secret/path", "\n".join(logs.output))
+
+
+class GenerateThumbnailsCommandTests(TestCase):
+    def setUp(self):
+        self.amd_path = Path(TEST_DATA_PATH) / "test_state_only" / additional_metadata_file_name
+        self.original_amd = self.amd_path.read_text()
+
+    def tearDown(self):
+        self.amd_path.write_text(self.original_amd)
+        shutil.rmtree(Path(TEST_DATA_PATH) / "test_state_only" / "thumbnails", ignore_errors=True)
+        (Path(TEST_DATA_PATH) / "test_state_only" / topic_statistics_file_name).unlink(missing_ok=True)
+
+    def test_generate_outdated(self):
+        out = io.StringIO()
+        call_command("generate_thumbnails", "test_state_only", processes=1, stdout=out)
+        self.assertIn("1 of 1 bags need thumbnails", out.getvalue())
+        amd = AdditionalMetadata.from_file(self.amd_path)
+        (thumb_name,) = amd.thumbnails["/spatz"]
+        self.assertEqual(amd.thumbnail_versions,
+                         {thumb_name: thumbnail_generator("spatz_interfaces/msg/Spatz").version})
+        self.assertTrue((self.amd_path.parent / topic_statistics_file_name).exists())
+
+        # Up-to-date thumbnails are skipped
+        out = io.StringIO()
+        call_command("generate_thumbnails", "test_state_only", processes=1, stdout=out)
+        self.assertIn("0 of 1 bags need thumbnails", out.getvalue())
+
+    def test_outdated_generator_version(self):
+        call_command("generate_thumbnails", "test_state_only", processes=1, stdout=io.StringIO())
+        bag = BagStorage(TEST_DATA_PATH).find_by_name("test_state_only")
+        self.assertFalse(bag.thumbnails_outdated())
+        generator = thumbnail_generator("spatz_interfaces/msg/Spatz")
+        with mock.patch.dict(THUMBNAIL_GENERATORS,
+                             {generator.msgtype: dataclasses.replace(generator, version=generator.version + 1)}):
+            self.assertTrue(bag.thumbnails_outdated())
+
 
 class SimulationTimeTests(TestCase):
     def test_identify_simulation_time(self):
@@ -174,3 +1557,353 @@ class BagStorageStest(TestCase):
 
         path = str(bag.path).rstrip("/")
         self.assertTrue(str(path).endswith("subdir/subdir2/testbag_in_subdir2"))
+
+    def test_find_outside_storage(self):
+        bs = BagStorage(TEST_DATA_PATH)
+        self.assertIsNone(bs.find_by_path(Path("../testdata/unit_test_bag/../../..")))
+        self.assertIsNone(bs.find_by_name("no_such_bag"))
+
+
+class BagIndexTests(TestCase):
+    def setUp(self):
+        self.base_path = Path(tempfile.mkdtemp()).resolve()
+        for rel_path in ["a/bag", "b/bag", "other"]:
+            shutil.copytree(Path(TEST_DATA_PATH) / "unit_test_bag", self.base_path / rel_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.base_path)
+
+    def test_duplicate_names(self):
+        bs = BagStorage(str(self.base_path))
+        self.assertEqual(bs.find_by_name("other").rel_path, Path("other"))
+        with self.assertRaises(AmbiguousBagName) as cm:
+            bs.find_by_name("bag")
+        self.assertEqual(cm.exception.paths, [Path("a/bag"), Path("b/bag")])
+        self.assertEqual(bs.index.duplicate_names(), {"bag": [Path("a/bag"), Path("b/bag")]})
+
+        shutil.rmtree(self.base_path / "b")
+        bs.refresh()
+        self.assertEqual(bs.find_by_name("bag").rel_path, Path("a/bag"))
+
+    def test_cached_bag(self):
+        bs = BagStorage(str(self.base_path))
+        bs.refresh()
+        bag = bs.find_by_path(Path("a/bag"))
+        with self.assertNumQueries(0):
+            cached = BagStorage(str(self.base_path)).find_by_path(Path("a/./bag"))
+        self.assertEqual(cached.description, bag.description)
+        # Every lookup gets its own bag, changes of one request are not seen by others
+        self.assertIsNot(cached, bag)
+        cached.metadata.thumbnails = {"/topic": {"thumb.jpg"}}
+        cached.metadata.tags.append("changed")
+        bag = bs.find_by_path(Path("a/bag"))
+        self.assertEqual(bag.metadata.thumbnails, {})
+        self.assertNotIn("changed", bag.tags)
+
+        # Modified additional metadata invalidates the cached bag
+        amd_path = self.base_path / "a" / "bag" / additional_metadata_file_name
+        amd = AdditionalMetadata.from_file(amd_path)
+        amd.description = "modified"
+        amd_path.write_text(amd.to_json())
+        os.utime(amd_path, ns=(0, 0))
+        modified = bs.find_by_path(Path("a/bag"))
+        self.assertIsNot(modified, bag)
+        self.assertEqual(modified.description, "modified")
+
+    def test_symlink_outside_storage(self):
+        with tempfile.TemporaryDirectory() as outside:
+            shutil.copytree(Path(TEST_DATA_PATH) / "unit_test_bag", Path(outside) / "secret")
+            (self.base_path / "linked").symlink_to(Path(outside) / "secret")
+            bs = BagStorage(str(self.base_path))
+            bs.refresh()
+            # Found by the scanner, but not served
+            self.assertTrue(bs.index.contains(Path("linked")))
+            self.assertIsNone(bs.find_by_path(Path("linked")))
+            self.assertIsNone(bs.find_by_name("linked"))
+
+    def test_added_bag(self):
+        bs = BagStorage(str(self.base_path))
+        self.assertIsNone(bs.find_by_name("new_bag"))
+        shutil.copytree(Path(TEST_DATA_PATH) / "unit_test_bag", self.base_path / "a" / "new_bag")
+        os.utime(self.base_path / "a", ns=(0, 0))
+        self.assertEqual(bs.find_by_name("new_bag").rel_path, Path("a/new_bag"))
+
+
+class CatalogTests(TestCase):
+    def setUp(self):
+        self.storage_dir = tempfile.TemporaryDirectory()
+        shutil.copytree(Path(TEST_DATA_PATH) / "unit_test_bag", Path(self.storage_dir.name) / "unit_test_bag")
+
+    def tearDown(self):
+        self.storage_dir.cleanup()
+
+    def test_entries_created(self):
+        bs = BagStorage(self.storage_dir.name)
+        bags = list(bs)
+        self.assertEqual(len(bags), 1)
+        entry = CatalogEntry.objects.get(storage_path=str(bs.base_path), rel_path="unit_test_bag")
+        self.assertEqual(entry.name, "unit_test_bag")
+        self.assertEqual(entry.start_time, 1650450896000000000)
+        self.assertEqual(entry.topics, [['/spatz11/sensor_data', 'spatz_interfaces/msg/Spatz11SensorData', 123]])
+        self.assertIsNone(entry.error)
+
+        # Bags from catalog behave like bags read from disk
+        self.assertEqual(bags[0].description, "Test bag for running unit tests")
+        self.assertEqual(bags[0].duration, datetime.timedelta(microseconds=83456789))
+        self.assertEqual(bags[0].topics, bs.find_by_path(Path("unit_test_bag")).topics)
+
+    def test_revalidate_on_mtime_change(self):
+        bs = BagStorage(self.storage_dir.name)
+        list(bs)
+        amd_path = Path(self.storage_dir.name) / "unit_test_bag" / additional_metadata_file_name
+        amd = AdditionalMetadata.from_file(amd_path)
+        amd.description = "changed"
+        amd_path.write_text(amd.to_json())
+        # Ensure the mtime changes even on file systems with coarse timestamps
+        stat = os.stat(amd_path)
+        os.utime(amd_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+
+        self.assertEqual(bs.find_by_path(Path("unit_test_bag")).description, "changed")
+        self.assertEqual(list(bs)[0].description, "changed")
+
+    def test_concurrent_refresh(self):
+        for i in range(7):
+            shutil.copytree(Path(self.storage_dir.name) / "unit_test_bag", Path(self.storage_dir.name) / f"bag_{i}")
+        applied = []
+        active = [0]
+        max_active = [0]
+        lock = threading.Lock()
+
+        def update(catalog, events, bags):
+            # The threads do not see the database of the test (its transaction is not committed)
+            with lock:
+                active[0] += 1
+                max_active[0] = max(max_active[0], active[0])
+            time.sleep(0.01)
+            with lock:
+                applied.extend(e.rel_path for e in events)
+                active[0] -= 1
+
+        with mock.patch.object(BagCatalog, "update", update):
+            threads = [threading.Thread(target=BagStorage(self.storage_dir.name).refresh) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(max_active[0], 1)
+        # Every bag added exactly once, none lost by a refresh running between the scan and update of another
+        self.assertEqual(sorted(applied), sorted([Path("unit_test_bag")] + [Path(f"bag_{i}") for i in range(7)]))
+
+    def test_removed_bag(self):
+        bs = BagStorage(self.storage_dir.name)
+        list(bs)
+        shutil.rmtree(Path(self.storage_dir.name) / "unit_test_bag")
+        self.assertEqual(list(bs), [])
+        self.assertFalse(CatalogEntry.objects.filter(storage_path=str(bs.base_path)).exists())
+
+    def test_invalid_additional_metadata(self):
+        shutil.copytree(Path(self.storage_dir.name) / "unit_test_bag", Path(self.storage_dir.name) / "invalid_bag")
+        amd_path = Path(self.storage_dir.name) / "invalid_bag" / additional_metadata_file_name
+        amd_path.write_text(json.dumps({"description": 5, "tags": "not a list"}))
+
+        bs = BagStorage(self.storage_dir.name)
+        with self.assertLogs("rosbagsApp.bag_storage.catalog", "WARNING"):
+            bs.refresh()
+        # Other bags are not affected
+        self.assertIsNone(bs.catalog.get(Path("unit_test_bag")).error)
+        error = bs.catalog.get(Path("invalid_bag")).error
+        self.assertIn("description", error)
+        self.assertIn("tags", error)
+
+    def test_generation(self):
+        bs = BagStorage(self.storage_dir.name)
+        bs.refresh()
+        generation = bs.catalog.generation()
+        bs.refresh()
+        self.assertEqual(bs.catalog.generation(), generation)
+
+        amd_path = Path(self.storage_dir.name) / "unit_test_bag" / additional_metadata_file_name
+        os.utime(amd_path, ns=(0, 0))
+        bs.refresh()
+        self.assertGreater(bs.catalog.generation(), generation)
+        generation = bs.catalog.generation()
+
+        shutil.rmtree(Path(self.storage_dir.name) / "unit_test_bag")
+        bs.refresh()
+        self.assertGreater(bs.catalog.generation(), generation)
+
+    def test_unreadable_bag(self):
+        bs = BagStorage(TEST_DATA_PATH)
+        bag = bs.find_by_path(Path("subdir/testbag_in_subdir"))
+        self.assertIsNotNone(bag)
+        self.assertIsNotNone(bag.load_error)
+
+
+class AggregateTests(TestCase):
+    def setUp(self):
+        self.storage_dir = tempfile.TemporaryDirectory()
+        self.base_path = Path(self.storage_dir.name)
+        shutil.copytree(Path(TEST_DATA_PATH) / "unit_test_bag", self.base_path / "unit_test_bag")
+        shutil.copytree(self.base_path / "unit_test_bag", self.base_path / "tagged_bag")
+        self.write_metadata("tagged_bag", {"description": "Tagged", "tags": ["parking"], "hardware": "spatz"})
+
+    def tearDown(self):
+        self.storage_dir.cleanup()
+
+    def write_metadata(self, bag: str, metadata: dict):
+        path = self.base_path / bag / additional_metadata_file_name
+        mtime = os.stat(path).st_mtime_ns if path.exists() else 0
+        path.write_text(json.dumps(metadata))
+        # Ensure the mtime changes even on file systems with coarse timestamps
+        os.utime(path, ns=(mtime + 1000000000, mtime + 1000000000))
+
+    def totals(self, bs: BagStorage) -> dict[tuple[str, str], tuple[int, int, int]]:
+        return {(a.dimension, a.key): (a.bags, a.duration, a.size)
+                for dimension_aggregates in aggregates(str(bs.base_path)).values() for a in dimension_aggregates}
+
+    def test_incremental_updates(self):
+        (self.base_path / "tagged_bag" / "rosbag2_unit_test_bag.db3").write_bytes(b"x" * 1000)
+        bs = BagStorage(self.storage_dir.name)
+        bs.refresh()
+        duration = bs.catalog.get(Path("unit_test_bag")).duration
+        totals = self.totals(bs)
+        self.assertEqual(totals[(CatalogAggregate.TOTAL, "")], (2, 2 * duration, 1000))
+        self.assertEqual(totals[(CatalogAggregate.HARDWARE, "mock_robot")], (1, duration, 0))
+        self.assertEqual(totals[(CatalogAggregate.HARDWARE, "spatz")], (1, duration, 1000))
+        self.assertEqual(totals[(CatalogAggregate.TAG, "parking")], (1, duration, 1000))
+        self.assertEqual(totals[(CatalogAggregate.MONTH, "2022-04")], (2, 2 * duration, 1000))
+        self.assertEqual(totals[(CatalogAggregate.TOPIC, "/spatz11/sensor_data")], (2, 2 * duration, 1000))
+
+        # Changed metadata moves the bag to other aggregates, those without bags are removed
+        self.write_metadata("tagged_bag", {"description": "Tagged", "tags": ["night"], "hardware": "mock_robot"})
+        bs.refresh()
+        totals = self.totals(bs)
+        self.assertNotIn((CatalogAggregate.TAG, "parking"), totals)
+        self.assertNotIn((CatalogAggregate.HARDWARE, "spatz"), totals)
+        self.assertEqual(totals[(CatalogAggregate.TAG, "night")], (1, duration, 1000))
+        self.assertEqual(totals[(CatalogAggregate.HARDWARE, "mock_robot")], (2, 2 * duration, 1000))
+
+        shutil.rmtree(self.base_path / "tagged_bag")
+        bs.refresh()
+        totals = self.totals(bs)
+        self.assertEqual(totals[(CatalogAggregate.TOTAL, "")], (1, duration, 0))
+        self.assertNotIn((CatalogAggregate.TAG, "night"), totals)
+
+    def test_stale_entries(self):
+        bs = BagStorage(self.storage_dir.name)
+        bs.refresh()
+        stale = bs.catalog.get(Path("tagged_bag"))
+        # Changed (e.g. by another process) after the entry was read
+        self.write_metadata("tagged_bag", {"description": "Tagged", "hardware": "first"})
+        bs.catalog.get(Path("tagged_bag"))
+        self.write_metadata("tagged_bag", {"description": "Tagged", "hardware": "second"})
+        bs.catalog._revalidate_all([(Path("tagged_bag"), stale)])
+        totals = self.totals(bs)
+        self.assertEqual({key for dimension, key in totals if dimension == CatalogAggregate.HARDWARE},
+                         {"mock_robot", "second"})
+        self.assertEqual(totals[(CatalogAggregate.TOTAL, "")][0], 2)
+
+        # Deleted twice, only subtracted once
+        entry = bs.catalog.get(Path("tagged_bag"))
+        bs.catalog._delete([entry])
+        bs.catalog._delete([entry])
+        self.assertEqual(self.totals(bs)[(CatalogAggregate.TOTAL, "")][0], 1)
+
+    def test_unreadable_bags_not_counted(self):
+        self.write_metadata("tagged_bag", {"description": 5})
+        bs = BagStorage(self.storage_dir.name)
+        with self.assertLogs("rosbagsApp.bag_storage.catalog", "WARNING"):
+            bs.refresh()
+        self.assertEqual(self.totals(bs)[(CatalogAggregate.TOTAL, "")][0], 1)
+
+    def test_rebuilt_if_out_of_sync(self):
+        bs = BagStorage(self.storage_dir.name)
+        bs.refresh()
+        expected = self.totals(bs)
+        CatalogAggregate.objects.all().delete()
+        CatalogEntry.objects.filter(rel_path="tagged_bag").delete()
+        bs.refresh()
+        self.assertEqual(self.totals(bs), expected)
+
+    def test_api(self):
+        self.client.force_login(get_user_model().objects.get_or_create(username="testuser")[0])
+        with mock.patch.object(rosbagsApp.settings, "ROSBAG_STORAGE_PATH", self.storage_dir.name):
+            response = self.client.get(reverse("rosbags:aggregates_api"))
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertEqual(len(data["total"]), 1)
+            self.assertEqual(data["total"][0]["bags"], 2)
+            self.assertAlmostEqual(data["total"][0]["hours"], 2 * 83.456789 / 3600, places=6)
+            self.assertEqual([row["key"] for row in data["hardware"]], ["mock_robot", "spatz"])
+            self.assertEqual(data["tag"][0]["key"], "parking")
+
+            response = self.client.get(reverse("rosbags:aggregates"))
+            self.assertContains(response, "2 bags")
+            self.assertContains(response, "parking")
+
+
+class CatalogTransactionTests(TransactionTestCase):
+    def setUp(self):
+        self.storage_dir = tempfile.TemporaryDirectory()
+        shutil.copytree(Path(TEST_DATA_PATH) / "unit_test_bag", Path(self.storage_dir.name) / "unit_test_bag")
+
+    def tearDown(self):
+        self.storage_dir.cleanup()
+
+    def test_write_lock_taken_first(self):
+        bs = BagStorage(self.storage_dir.name)
+        with CaptureQueriesContext(connection) as queries:
+            bs.refresh()
+        statements = [q["sql"] for q in queries.captured_queries]
+        begin = statements.index("BEGIN")
+        # A write before any read, SQLite waits for the write lock instead of failing when upgrading a read
+        self.assertTrue(statements[begin + 1].startswith('UPDATE "rosbagsApp_cataloggeneration"'),
+                        msg=statements[begin + 1])
+        self.assertTrue(CatalogEntry.objects.filter(storage_path=str(bs.base_path)).exists())
+
+        # An unchanged storage is only read, concurrent refreshes do not wait for each other
+        with CaptureQueriesContext(connection) as queries:
+            bs.refresh()
+        self.assertEqual([q["sql"] for q in queries.captured_queries if not q["sql"].startswith("SELECT")], [])
+
+
+class StorageScannerTests(TestCase):
+    def setUp(self):
+        self.storage_dir = tempfile.TemporaryDirectory()
+        self.base_path = Path(self.storage_dir.name)
+        shutil.copytree(Path(TEST_DATA_PATH) / "unit_test_bag", self.base_path / "unit_test_bag")
+
+    def tearDown(self):
+        self.storage_dir.cleanup()
+
+    def test_initial_scan(self):
+        scanner = StorageScanner(self.base_path)
+        self.assertEqual(scanner.scan(), [BagEvent(BagEventType.ADDED, Path("unit_test_bag"))])
+        self.assertEqual(scanner.bags, [Path("unit_test_bag")])
+
+    def test_unchanged_storage_is_not_listed(self):
+        # Recently modified directories are always listed again, since they might change within the same mtime tick
+        for path in [self.base_path, self.base_path / "unit_test_bag"]:
+            os.utime(path, (0, 0))
+        scanner = StorageScanner(self.base_path)
+        scanner.scan()
+        with mock.patch("os.scandir", wraps=os.scandir) as scandir:
+            self.assertEqual(scanner.scan(), [])
+            scandir.assert_not_called()
+
+    def test_added_changed_removed(self):
+        scanner = StorageScanner(self.base_path)
+        scanner.scan()
+
+        nested_bag = Path("a/b/nested_bag")
+        shutil.copytree(Path(TEST_DATA_PATH) / "unit_test_bag", self.base_path / nested_bag)
+        self.assertEqual(scanner.scan(), [BagEvent(BagEventType.ADDED, nested_bag)])
+
+        amd_path = self.base_path / nested_bag / additional_metadata_file_name
+        stat = os.stat(amd_path)
+        os.utime(amd_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        self.assertEqual(scanner.scan(), [BagEvent(BagEventType.CHANGED, nested_bag)])
+
+        shutil.rmtree(self.base_path / "a")
+        self.assertEqual(scanner.scan(), [BagEvent(BagEventType.REMOVED, nested_bag)])
+        self.assertEqual(scanner.bags, [Path("unit_test_bag")])
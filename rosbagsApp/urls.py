@@ -6,7 +6,16 @@ app_name = "rosbags"
 urlpatterns = [
     path('', views.index, name='index'),
     path('list/', views.list_view, name='list'),
+    path('aggregates/', views.aggregates_view, name='aggregates'),
     path('bag/<path:bag_path>/', views.detail, name='detail'),
     path('bag/<path:bag_path>/thumbnail/<str:thumb_name>', views.thumbnail, name='thumbnail'),
-    path('api/generate_thumbnails', views.generate_thumbnails, name='generate_thumbnails')
+    path('api/generate_thumbnails', views.generate_thumbnails, name='generate_thumbnails'),
+    path('api/thumbnail_jobs/<int:job_id>', views.thumbnail_job, name='thumbnail_job'),
+    path('api/bags', views.bags_api, name='bags_api'),
+    path('api/bags/filters', views.bag_filters_api, name='bag_filters_api'),
+    path('api/bags/search', views.bag_search_api, name='bag_search_api'),
+    path('api/aggregates', views.aggregates_api, name='aggregates_api'),
+    path('api/messages', views.messages_api, name='messages_api'),
+    path('api/timeseries', views.timeseries_api, name='timeseries_api'),
+    path('api/export', views.export_view, name='export'),
 ]
@@ -1,13 +1,54 @@
+import base64
+import binascii
+import datetime
 import json
+import mimetypes
 import os
+import re
 from pathlib import Path
+from typing import Callable
+from urllib.parse import quote
 
 from django.contrib.auth.decorators import login_required
-from django.http import FileResponse, HttpResponseBadRequest, HttpResponse
-from django.shortcuts import render
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, \
+    StreamingHttpResponse
+from django.shortcuts import get_object_or_404, render
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date
+
+import numpy as np
+import rosbags.rosbag2 as rb
+from rosbags.serde import deserialize_cdr
 
 import rosbagsApp.settings
+from rosbagsApp.asgi import blocking_view
+from rosbagsApp.bag_storage.aggregates import aggregates
+from rosbagsApp.bag_storage.export import export_clip
+from rosbagsApp.bag_storage.inspection import image_preview, message_to_json
+from rosbagsApp.bag_storage.reader_pool import ReaderPool
+from rosbagsApp.bag_storage.search import matching_entries, search_entries
 from rosbagsApp.bag_storage.storage import BagStorage, ROSBag
+from rosbagsApp.bag_storage.thumbnails import is_content_addressed, register_spatz_types
+from rosbagsApp.bag_storage.timeseries import timeseries
+from rosbagsApp.instrumentation import metrics_exposition, span
+from rosbagsApp.jobs import enqueue_thumbnail_job
+from rosbagsApp.models import CatalogTag, CatalogTopic, ThumbnailJob
+from rosbagsApp.payload_cache import PayloadCache
+
+# Sort orders supported by the bag list API. Ties are broken by entry id, which makes the order usable as cursor.
+BAG_LIST_SORT_FIELDS = ["-recording_date", "recording_date", "-duration", "duration"]
+BAG_LIST_DEFAULT_PAGE_SIZE = 50
+BAG_LIST_MAX_PAGE_SIZE = 200
+# Seconds content addressed thumbnails may be cached by browsers
+THUMBNAIL_MAX_AGE = 365 * 24 * 60 * 60
+# Maximum number of messages returned by the messages API at once
+MESSAGES_MAX_COUNT = 20
+# Plot width (pixels) of the time series API if not requested, and the largest supported width
+TIMESERIES_DEFAULT_WIDTH = 1000
+TIMESERIES_MAX_WIDTH = 10000
 
 
 @login_required
@@ -15,36 +56,514 @@ def index(request):
     return render(request, "rosbagsApp/index.html")
 
 
+@blocking_view
 @login_required
 def list_view(request):
+    # Bags are loaded by the page using the bag list API
+    return render(request, "rosbagsApp/list.html")
+
+
+def encode_cursor(sort: str, sort_value, entry_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([sort, sort_value, entry_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str, sort: str) -> tuple:
+    """
+    Sort value and id of the last entry of the previous page
+    :param sort: Sort of the requested page, which has to be the sort the cursor was created for
+    :raises ValueError: Malformed cursor or cursor of another sort
+    """
+    try:
+        cursor_sort, sort_value, entry_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, TypeError, ValueError) as e:
+        raise ValueError(f"Malformed cursor: {e}")
+    if cursor_sort != sort:
+        raise ValueError("Cursor of another sort order")
+    if type(entry_id) is not int:
+        raise ValueError("Malformed cursor")
+    if sort.lstrip("-") == "recording_date":
+        sort_value = parse_datetime(sort_value) if isinstance(sort_value, str) else None
+        if sort_value is None:
+            raise ValueError("Malformed cursor")
+    elif type(sort_value) is not int:
+        raise ValueError("Malformed cursor")
+    return sort_value, entry_id
+
+
+def parse_date_parameter(value: str) -> datetime.datetime:
+    """Parse ISO date or date and time (UTC unless specified)"""
+    date = parse_datetime(value)
+    if date is None:
+        date = datetime.datetime.combine(datetime.date.fromisoformat(value), datetime.time())
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return date
+
+
+def cached_json_response(request, bs: BagStorage, build: Callable[[], dict]) -> HttpResponse:
+    """
+    Response of a bag list API, from the PayloadCache while the catalog generation is unchanged: 304 Not Modified for
+    a matching If-None-Match, the (compressed, depending on Accept-Encoding) serialized payload otherwise
+    :param bs: Refreshed storage
+    :param build: Creates the payload from the catalog, if it is not cached
+    """
+    generation = bs.catalog.generation()
+    key = (str(bs.base_path), request.path,
+           tuple(sorted((name, tuple(values)) for name, values in request.GET.lists())))
+    payload = PayloadCache.shared().get(key, generation,
+                                        lambda: json.dumps(build(), cls=DjangoJSONEncoder).encode())
+    response = get_conditional_response(request, etag=payload.etag)
+    if response is None:
+        encoding, body = payload.encode(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        response = HttpResponse(body, content_type="application/json")
+        if encoding != "identity":
+            response["Content-Encoding"] = encoding
+    response["ETag"] = payload.etag
+    response["Cache-Control"] = "private, no-cache"
+    patch_vary_headers(response, ["Accept-Encoding"])
+    return response
+
+
+@blocking_view
+@login_required
+def bags_api(request):
+    """
+    Paginated list of bags, as json.
+
+    GET parameters (all optional):
+
+    - sort: One of BAG_LIST_SORT_FIELDS, defaults to newest first
+    - limit: Page size
+    - cursor: next_cursor of the previous page
+    - tag, topic, msgtype: Only bags with all given tags/topics/message types (may be repeated)
+    - hardware, location: Only bags recorded with given hardware/at given location
+    - recorded_after, recorded_before: ISO date (time) range of recording date
+    - q: Only bags matching the search query q (see bag_search_api)
+    """
+    sort = request.GET.get("sort", BAG_LIST_SORT_FIELDS[0])
+    if sort not in BAG_LIST_SORT_FIELDS:
+        return HttpResponseBadRequest(f"Parameter sort must be one of {BAG_LIST_SORT_FIELDS}.")
+
+    try:
+        limit = min(int(request.GET.get("limit", BAG_LIST_DEFAULT_PAGE_SIZE)), BAG_LIST_MAX_PAGE_SIZE)
+        recorded_after = request.GET.get("recorded_after")
+        recorded_after = parse_date_parameter(recorded_after) if recorded_after else None
+        recorded_before = request.GET.get("recorded_before")
+        recorded_before = parse_date_parameter(recorded_before) if recorded_before else None
+        cursor = request.GET.get("cursor")
+        cursor = decode_cursor(cursor, sort) if cursor else None
+    except ValueError as e:
+        return HttpResponseBadRequest(f"Invalid parameter: {e}")
+    if limit < 1:
+        return HttpResponseBadRequest("Parameter limit must be positive.")
+
     bs = BagStorage()
-    bags: list[ROSBag] = list(bs)
-    bags.sort(key=lambda b: b.recording_date, reverse=True)
+    bs.refresh()
+    return cached_json_response(request, bs, lambda: bag_list_page(bs, request.GET, sort, limit, recorded_after,
+                                                                   recorded_before, cursor))
+
+
+def bag_list_page(bs: BagStorage, params, sort: str, limit: int, recorded_after: datetime.datetime | None,
+                  recorded_before: datetime.datetime | None, cursor: tuple | None) -> dict:
+    """Page of the bag list API (see bags_api) for validated parameters"""
+    sort_field = sort.lstrip("-")
+    descending = sort.startswith("-")
+    # Bags which can not be read are not listed
+    entries = bs.catalog.entries().filter(error__isnull=True)
+
+    for tag in params.getlist("tag"):
+        entries = entries.filter(catalog_tags__tag=tag)
+    for topic in params.getlist("topic"):
+        entries = entries.filter(catalog_topics__name=topic)
+    for msgtype in params.getlist("msgtype"):
+        entries = entries.filter(catalog_topics__msgtype=msgtype)
+    if "hardware" in params:
+        entries = entries.filter(hardware=params["hardware"])
+    if "location" in params:
+        entries = entries.filter(location=params["location"])
+    if recorded_after is not None:
+        entries = entries.filter(recording_date__gte=recorded_after)
+    if recorded_before is not None:
+        entries = entries.filter(recording_date__lt=recorded_before)
+    if params.get("q"):
+        entries = matching_entries(entries, params["q"])
+
+    if cursor is not None:
+        sort_value, entry_id = cursor
+        if descending:
+            entries = entries.filter(Q(**{f"{sort_field}__lt": sort_value}) |
+                                     Q(**{sort_field: sort_value, "id__lt": entry_id}))
+        else:
+            entries = entries.filter(Q(**{f"{sort_field}__gt": sort_value}) |
+                                     Q(**{sort_field: sort_value, "id__gt": entry_id}))
+
+    entries = entries.distinct().order_by(sort, "-id" if descending else "id")
+    with span("query"):
+        page = list(entries[:limit + 1])
+
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        last = page[-1]
+        sort_value = getattr(last, sort_field)
+        if sort_field == "recording_date":
+            sort_value = sort_value.isoformat()
+        next_cursor = encode_cursor(sort, sort_value, last.id)
+
+    with span("serialize"):
+        bags = [ROSBag.from_catalog(bs.base_path, e).json() for e in page]
+    return {"bags": bags, "next_cursor": next_cursor}
+
+
+@blocking_view
+@login_required
+def bag_search_api(request):
+    """
+    Bags matching a full-text search, best matches first, as json.
+    All words of the query must occur in the name, description, hardware, location, tags or topics (names or message
+    types) of a bag, the last word may be incomplete.
+
+    GET parameters:
+
+    - q: Search query
+    - limit: Maximum number of results (optional)
+    """
+    try:
+        limit = min(int(request.GET.get("limit", BAG_LIST_DEFAULT_PAGE_SIZE)), BAG_LIST_MAX_PAGE_SIZE)
+    except ValueError as e:
+        return HttpResponseBadRequest(f"Invalid parameter: {e}")
+    if limit < 1:
+        return HttpResponseBadRequest("Parameter limit must be positive.")
+
+    bs = BagStorage()
+    bs.refresh()
+
+    def search():
+        results = search_entries(bs.catalog.entries().filter(error__isnull=True), request.GET.get("q", ""), limit)
+        return {"bags": [dict(ROSBag.from_catalog(bs.base_path, entry).json(), rank=rank) for entry, rank in results]}
+
+    return cached_json_response(request, bs, search)
+
+
+@blocking_view
+@login_required
+def bag_filters_api(request):
+    """Values available for filtering the bag list, as json"""
+    bs = BagStorage()
+    bs.refresh()
+
+    def filters():
+        entries = bs.catalog.entries().filter(error__isnull=True)
+        topics = CatalogTopic.objects.filter(entry__in=entries)
+        return {
+            "tags": list(CatalogTag.objects.filter(entry__in=entries).values_list("tag", flat=True)
+                         .distinct().order_by("tag")),
+            "topics": list(topics.values_list("name", flat=True).distinct().order_by("name")),
+            "msgtypes": list(topics.values_list("msgtype", flat=True).distinct().order_by("msgtype")),
+            "hardware": list(entries.exclude(hardware=None).values_list("hardware", flat=True)
+                             .distinct().order_by("hardware")),
+            "locations": list(entries.exclude(location=None).values_list("location", flat=True)
+                              .distinct().order_by("location")),
+        }
+
+    return cached_json_response(request, bs, filters)
+
+
+def storage_aggregates() -> dict[str, list[dict]]:
+    """Aggregates of the (refreshed) storage by dimension, with duration in hours and size in bytes"""
+    bs = BagStorage()
+    bs.refresh()
+    return {dimension: [{"key": a.key, "bags": a.bags, "hours": a.duration / 3600e9, "bytes": a.size}
+                        for a in dimension_aggregates]
+            for dimension, dimension_aggregates in aggregates(str(bs.base_path)).items()}
+
+
+@blocking_view
+@login_required
+def aggregates_api(request):
+    """
+    Archive-wide totals of the readable bags as json: number of bags, recorded hours and bytes on disk, in total and
+    per hardware, location, tag, month of recording (YYYY-MM) and topic, most bags first
+    """
+    return JsonResponse(storage_aggregates())
 
-    bags_json = json.dumps([b.json() for b in bags])
-    context = {'bags': bags_json}
 
-    return render(request, "rosbagsApp/list.html", context)
+@blocking_view
+@login_required
+def aggregates_view(request):
+    storage = storage_aggregates()
+    titles = {"hardware": "Hardware", "location": "Location", "tag": "Tag", "month": "Month", "topic": "Topic"}
+    return render(request, "rosbagsApp/aggregates.html",
+                  {"total": (storage.pop("total") or [None])[0],
+                   "sections": [(title, storage[dimension]) for dimension, title in titles.items()]})
 
 
+@blocking_view
 @login_required
 def detail(request, bag_path: str):
     bs = BagStorage()
     context = {'bag': bs.find_by_path(Path(bag_path)),
                'local_mount_prefix': rosbagsApp.settings.ROSBAG_MOUNT_PATH}
-    return render(request, "rosbagsApp/detail_view.html", context)
+    with span("render"):
+        return render(request, "rosbagsApp/detail_view.html", context)
 
 
+@blocking_view
 @login_required
-def thumbnail(request, bag_path: str, thumb_name: str):
+def messages_api(request):
+    """
+    Deserialized messages of a topic, as json. Image messages additionally contain a PNG preview (data URL), large
+    arrays are truncated (see message_to_json).
+
+    GET parameters:
+
+    - bag_path: Bag (relative to storage)
+    - topic: Topic name
+    - index: Index of the (first) message within the topic, or
+    - timestamp: Select the message closest to this timestamp (ns)
+    - count: Number of consecutive messages (optional, defaults to 1)
+    """
+    bag_path = request.GET.get("bag_path")
+    topic = request.GET.get("topic")
+    if bag_path is None or topic is None:
+        return HttpResponseBadRequest("Parameters bag_path and topic are required.")
+    try:
+        count = int(request.GET.get("count", 1))
+        index = int(request.GET["index"]) if "index" in request.GET else None
+        timestamp = int(request.GET["timestamp"]) if "timestamp" in request.GET else None
+    except ValueError as e:
+        return HttpResponseBadRequest(f"Invalid parameter: {e}")
+    if (index is None) == (timestamp is None):
+        return HttpResponseBadRequest("Either parameter index or timestamp is required.")
+    if not 1 <= count <= MESSAGES_MAX_COUNT:
+        return HttpResponseBadRequest(f"Parameter count must be between 1 and {MESSAGES_MAX_COUNT}.")
+    if index is not None and index < 0:
+        return HttpResponseBadRequest("Parameter index must not be negative.")
+
     bag = BagStorage().find_by_path(Path(bag_path))
-    path = os.path.join(bag.path, "thumbnails", thumb_name)
-    path = os.path.realpath(path)
-    if Path(os.path.commonpath([path, bag.path])) != bag.path:
+    if bag is None:
+        raise Http404(f"Bag with path \"{bag_path}\" is not found.")
+
+    try:
+        with ReaderPool.shared().open(bag.path) as open_bag:
+            connection = open_bag.connections.get(topic)
+            if connection is None:
+                raise Http404(f"Topic \"{topic}\" is not contained in the bag.")
+            if index is None:
+                index = open_bag.nearest_index(topic, timestamp)
+            msgcount = open_bag.msgcount(topic)
+            messages = open_bag.messages_at_index(topic, index, count) if index is not None else []
+    except rb.ReaderError as e:
+        return HttpResponseBadRequest(f"Bag is not readable: {e}")
+
+    register_spatz_types()
+    result = []
+    for msg_index, msg_timestamp, rawdata in messages:
+        try:
+            msg = deserialize_cdr(rawdata, connection.msgtype)
+        except KeyError:
+            return HttpResponseBadRequest(f"Message type {connection.msgtype} is not supported.")
+        result.append({"index": msg_index, "timestamp": msg_timestamp, "message": message_to_json(msg),
+                       "preview": image_preview(msg)})
+    return JsonResponse({"topic": topic, "msgtype": connection.msgtype, "msgcount": msgcount, "messages": result})
+
+
+@blocking_view
+@login_required
+def timeseries_api(request):
+    """
+    Values of a numeric field of all messages of a topic within a time range as json, downsampled to at most two values
+    (minimum and maximum) per pixel of the plot (see rosbagsApp.bag_storage.timeseries). Values which are not finite
+    are null.
+
+    GET parameters:
+
+    - bag_path: Bag (relative to storage)
+    - topic: Topic name
+    - field: Path of the field within the message, e.g. velocity.x
+    - width: Width of the plot in pixels (optional)
+    - start, stop: Time range (ns, optional, defaults to the whole bag)
+    """
+    bag_path = request.GET.get("bag_path")
+    topic = request.GET.get("topic")
+    field = request.GET.get("field")
+    if bag_path is None or topic is None or field is None:
+        return HttpResponseBadRequest("Parameters bag_path, topic and field are required.")
+    try:
+        width = int(request.GET.get("width", TIMESERIES_DEFAULT_WIDTH))
+        start = int(request.GET["start"]) if "start" in request.GET else None
+        stop = int(request.GET["stop"]) if "stop" in request.GET else None
+    except ValueError as e:
+        return HttpResponseBadRequest(f"Invalid parameter: {e}")
+    if not 1 <= width <= TIMESERIES_MAX_WIDTH:
+        return HttpResponseBadRequest(f"Parameter width must be between 1 and {TIMESERIES_MAX_WIDTH}.")
+
+    bag = BagStorage().find_by_path(Path(bag_path))
+    if bag is None:
+        raise Http404(f"Bag with path \"{bag_path}\" is not found.")
+    if topic not in {t.name for t in bag.topics}:
+        raise Http404(f"Topic \"{topic}\" is not contained in the bag.")
+    try:
+        with span("timeseries"):
+            series = timeseries(bag.path, topic, field).query(width, start, stop)
+    except rb.ReaderError as e:
+        return HttpResponseBadRequest(f"Bag is not readable: {e}")
+    except KeyError:
+        return HttpResponseBadRequest("Message type is not supported.")
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    values = series.values.astype(object)
+    values[~np.isfinite(series.values)] = None
+    return JsonResponse({"topic": topic, "field": field, "count": series.count, "downsampled": series.downsampled,
+                         "timestamps": series.timestamps.tolist(), "values": values.tolist()})
+
+
+@blocking_view
+@login_required
+def export_view(request):
+    """
+    Clip of a bag as new rosbag2 (tar archive of the bag directory), streamed while it is written (see export_clip).
+
+    GET parameters:
+
+    - bag_path: Bag (relative to storage)
+    - topic: Topic to export, may be repeated (optional, defaults to all topics)
+    - start: First timestamp (ns) to export (optional, defaults to the start of the bag)
+    - stop: Timestamp (ns) after the last message to export (optional, defaults to the end of the bag)
+    """
+    bag_path = request.GET.get("bag_path")
+    if bag_path is None:
+        return HttpResponseBadRequest("Parameter bag_path is required.")
+    try:
+        start = int(request.GET["start"]) if "start" in request.GET else None
+        stop = int(request.GET["stop"]) if "stop" in request.GET else None
+    except ValueError as e:
+        return HttpResponseBadRequest(f"Invalid parameter: {e}")
+    if start is not None and stop is not None and stop <= start:
+        return HttpResponseBadRequest("Parameter stop must be after start.")
+
+    bag = BagStorage().find_by_path(Path(bag_path))
+    if bag is None:
+        raise Http404(f"Bag with path \"{bag_path}\" is not found.")
+    if bag.load_error is not None:
+        return HttpResponseBadRequest(f"Bag is not readable: {bag.load_error}")
+    topics = request.GET.getlist("topic")
+    missing = set(topics) - {topic.name for topic in bag.topics}
+    if len(missing) > 0:
+        raise Http404(f"Topics not contained in the bag: {', '.join(sorted(missing))}")
+
+    name = f"{bag.name}_clip"
+    response = StreamingHttpResponse(export_clip(bag.path, name, topics, start, stop),
+                                     content_type="application/x-tar")
+    response["Content-Disposition"] = f"attachment; filename=\"{quote(name)}.tar\""
+    # Send chunks as soon as they are generated instead of buffering the response in nginx
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def metrics(request):
+    """
+    Metrics of all processes (see ROSBAG_METRICS_DIR) in the Prometheus text format, if ROSBAG_INSTRUMENTATION is
+    enabled.
+    Not authenticated, access has to be restricted by the web server (see deployment/nginx_config.j2).
+    """
+    if not rosbagsApp.settings.ROSBAG_INSTRUMENTATION:
+        raise Http404("Instrumentation is disabled.")
+    return HttpResponse(metrics_exposition(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def thumbnail_etag(st: os.stat_result) -> str:
+    """Same format as the ETag of nginx, so validators do not change when serving using X-Accel-Redirect"""
+    return f'"{int(st.st_mtime):x}-{st.st_size:x}"'
+
+
+def parse_byte_range(header: str, size: int) -> tuple[int, int] | None:
+    """
+    Requested part of a file from a Range header with a single range ("bytes=first-last", "bytes=first-" or
+    "bytes=-suffix_length")
+    :return: (first, end) byte (first >= size if the range is not satisfiable), None if the header is invalid or
+             requests multiple ranges (the whole file is sent then)
+    """
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", header.strip())
+    if match is None or match.group(1) == match.group(2) == "":
+        return None
+    if match.group(1) == "":
+        suffix_length = int(match.group(2))
+        return (max(size - suffix_length, 0) if suffix_length > 0 else size), size
+    first = int(match.group(1))
+    end = size if match.group(2) == "" else min(int(match.group(2)) + 1, size)
+    return (first, end) if end > first or first >= size else None
+
+
+def file_chunks(path: Path, first: int, end: int, chunk_size: int = 64 * 1024):
+    with open(path, "rb") as file:
+        file.seek(first)
+        remaining = end - first
+        while remaining > 0:
+            chunk = file.read(min(chunk_size, remaining))
+            if len(chunk) == 0:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+@blocking_view
+@login_required
+def thumbnail(request, bag_path: str, thumb_name: str):
+    """
+    Thumbnail file, with ETag and Last-Modified for conditional requests. Content addressed thumbnails (see
+    make_content_addressed) may be cached indefinitely, others have to be revalidated. Single byte ranges are
+    supported, so browsers can seek in preview videos.
+
+    If ROSBAG_ACCEL_REDIRECT_PREFIX is configured, only the path is checked and the file is sent by nginx (which also
+    handles ranges).
+    """
+    # The bag is not loaded, checking the path is sufficient
+    base_path = Path(rosbagsApp.settings.ROSBAG_STORAGE_PATH).resolve()
+    thumb_dir = (base_path / bag_path / "thumbnails").resolve()
+    path = (thumb_dir / thumb_name).resolve()
+    if Path(os.path.commonpath([thumb_dir, base_path])) != base_path or path.parent != thumb_dir:
         return HttpResponseBadRequest(f"Thumbnail path outside bag directory: {path}")
-    return FileResponse(open(path, 'rb'))
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        raise Http404(f"Thumbnail {thumb_name} not found.")
 
+    etag = thumbnail_etag(st)
+    last_modified = int(st.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        if rosbagsApp.settings.ROSBAG_ACCEL_REDIRECT_PREFIX is not None:
+            response = HttpResponse(content_type=mimetypes.guess_type(path)[0])
+            response["X-Accel-Redirect"] = rosbagsApp.settings.ROSBAG_ACCEL_REDIRECT_PREFIX + \
+                quote(str(path.relative_to(base_path)))
+        else:
+            byte_range = None
+            if "HTTP_RANGE" in request.META and request.META.get("HTTP_IF_RANGE", etag) == etag:
+                byte_range = parse_byte_range(request.META["HTTP_RANGE"], st.st_size)
+            if byte_range is None:
+                response = FileResponse(open(path, 'rb'))
+            elif byte_range[0] >= st.st_size:
+                response = HttpResponse(status=416)
+                response["Content-Range"] = f"bytes */{st.st_size}"
+            else:
+                first, end = byte_range
+                response = StreamingHttpResponse(file_chunks(path, first, end), status=206,
+                                                 content_type=mimetypes.guess_type(path)[0])
+                response["Content-Range"] = f"bytes {first}-{end - 1}/{st.st_size}"
+                response["Content-Length"] = str(end - first)
+            response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    if is_content_addressed(thumb_name):
+        response["Cache-Control"] = f"private, max-age={THUMBNAIL_MAX_AGE}, immutable"
+    else:
+        response["Cache-Control"] = "private, no-cache"
+    return response
 
+
+@blocking_view
+@login_required
 def generate_thumbnails(request):
     bag_path = request.GET.get("bag_path", None)
     if bag_path is None:
@@ -54,6 +573,14 @@ def generate_thumbnails(request):
     if bag is None:
         return HttpResponseBadRequest(f"Bag with path \"{bag_path}\" is not found.")
 
-    bag.generate_thumbnails()
+    # Generation takes too long for a request, it is executed by the thumbnail_worker management command
+    job = enqueue_thumbnail_job(bs, bag)
+
+    return JsonResponse(job.json())
 
-    return HttpResponse("done!")
+
+@blocking_view
+@login_required
+def thumbnail_job(request, job_id: int):
+    job = get_object_or_404(ThumbnailJob, id=job_id)
+    return JsonResponse(job.json())